@@ -12,19 +12,20 @@ Green Chromatic Coordinate (GCC) and Red Chromatic Coordinate (RCC) for defined
 L1 phenoCam images. 
 The script exports the time series of GCC and RCC as .csv file in the same file path as the original pictures. 
 The .csv file can be found within a folder 'CSV' and contains all time series metrics. Furthermore, the plots 
-of daily averaged GCC and RCC are exported as a .png file within a folder called 'Graph'. The user defined ROI 
-will be exported as a ROI map in the same directory.
+of daily averaged GCC and RCC are exported as a .jpg file within a folder called 'Graph'. The user defined ROI 
+will be exported as a ROI map in the same directory. The plots are rendered without a display and can be 
+deferred to a separate step (see plotMode and SITES_phenoCam_plotL3.py).
 
 Note: The script was tested on Windows environment in Python 3.7.6 version only. This script is only 
       for internal use within Swedish Infrastructure for Ecosystem Science (SITES).
 
 Package installations:
     1) pytz     : pip install pytz
-    2) scipy    : pip install scipy
-    3) numpy    : pip install numpy
-    4) astral   : pip install astral 
-    5) pandas   : pip install pandas
-    6) Open-CV  : pip install opencv-python
+    2) numpy    : pip install numpy
+    3) astral   : pip install astral 
+    4) pandas   : pip install pandas
+    5) Open-CV  : pip install opencv-python
+    6) pyarrow  : pip install pyarrow (only needed if saveParquet = True)
 
 Instructions for running the script:
     a) Make sure all the required modules are installed.
@@ -34,22 +35,47 @@ Instructions for running the script:
        For example: SWE-LON-SFA-P01_20220101_001_1020.jpg
        General: Country-Station-Location-PhenoCam_YYMMDD_DOY_HHMM
        
-    d) Make sure the images are of same dimensions (For eg: 3072*2048)
-    e) Create a new folder named 'SnowyImage' within the image directory and move all snowy 
-       images to it. In case of no snowy images in the year, skip this step.
-    f) Define correct ROI coordinate ('pts1' variable in the script) for the chosen phenoCam location 
-       and station. This is made available in a separate python script named: SITES_phenoCamROI.py
+    d) Make sure the images are of same dimensions (For eg: 3072*2048). Run SITES_phenoCam_imageCheck.py to
+       find defective (truncated or empty) images before the run; images in its quarantine list are skipped.
+    e) Snowy images are tagged automatically (see SITES_phenoCam_utils.py). To correct the automatic 
+       tagging, list the images in a file 'snowOverride.csv' (columns: Image, Snow with 1 for snow and
+       0 for no snow) within the image directory (e.g. the year folder) or the given path. Images in an old 
+       'SnowyImage' folder (e.g. of each year folder) are still used and tagged as snowy. The quarantine 
+       lists and image catalogs of SITES_phenoCam_imageCheck.py are read from the image folders as well.
+    f) The ROI is taken from the ROI registry (SITES_phenoCam_ROIregistry.json) for each image, according to
+       the phenoCam, the image date and the image size, so that changes of the ROI over the years are
+       followed automatically. Set 'roiNbr' for phenoCams with several ROIs. Add new ROIs to the registry
+       (view them with SITES_phenoCamROI.py); the polygon 'fallbackPts' is only used for phenoCams
+       without ROI in the registry.
+    g) Set registerImages = True to follow small camera movements (wind, maintenance, ice). Each image is 
+       registered against a reference image on downscaled grayscale images and the ROI mask is warped with
+       the transform instead of changing the ROI. The reference is the image given as "Reference" in the ROI
+       version of the registry (the image the ROI was drawn on), otherwise the image nearest to noon on the 
+       first processed day of the ROI version. The transforms are cached in 'registration.csv' in the image directory,
+       so only new images are registered when rerunning.
     h) Change ROI number in the headings of the time series data if there are multiple ROIs.
-    i) Comment/Uncomment line of code dealing with QFLAG based on the temporal resolution of the 
-       phenoCam data.
+    i) The QFLAG thresholds are selected from SITES_phenoCam_QFLAG_rules.csv for the temporal resolution 
+       (cadence) of the phenoCam data, which is detected from the image timestamps. Set the 'cadence' 
+       variable in the script to use the rules of a given cadence instead.
     j) Add metadata information as header in the .csv file exported before uploading it to the 
        SITES data portal.
+    k) Images of several years can be processed in one run (e.g. one subfolder per year below the given
+       path, see 'searchSubfolders'). Give a date range (YYYYMMDD-YYYYMMDD, or YYYYMMDD for one day) to 
+       process only a part of the images. The daily time series is continuous over the date range (whole
+       calendar years of the images if no range is given) and all days without images are filled with 'NaN'.
+    l) Set saveParquet = True to append the per-image metrics (ROI means, GCC, RCC, solar elevation, snow
+       and the quality score, i.e. fraction of ROI pixels neither saturated nor dark) to a Parquet dataset 
+       partitioned by station, phenoCam and year. Rerunning the same date range replaces its files. Read 
+       the data with readImageMetrics in SITES_phenoCam_utils.py, e.g. only GCC of Röbäcksdalen since 2020:
+
+           readImageMetrics(parquetPath, columns = ['Timestamp', 'GCC_ROI1'], 
+                            filters = [('Station', '=', 'RBD'), ('Year', '>=', 2020)])
 
 Limitations of the script:
     a) Script can only take .jpg images as input.
     b) Script is programmed to handle only one ROI at a time.
-    c) Script doesn't account for the change in camera field of view
-    d) Script is programmed to process only one year data at a time.
+    c) Script doesn't account for the change in camera field of view, except by the validity dates and
+       image sizes of the ROI versions in the ROI registry and small movements with registerImages = True
 
 Example Data:
     # Freely downloadable from SITES data portal under SITES Spectral thematic program.
@@ -75,18 +101,17 @@ For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
 ################################################################################################################
 import os
 import cv2
-import glob
 import pytz
 import random
-import calendar
 import datetime
-import statistics
 import numpy as np
 import pandas as pd
 from pytz import timezone
 from astral import Astral
-from scipy import stats as s
-import matplotlib.pyplot as plt
+from SITES_phenoCam_utils import imageList, snowStats, isSnowy, readSnowOverride, readQflagRules, solarClass, qflag
+from SITES_phenoCam_utils import qualityScore, writeImageMetrics, imageTime, plotL3, roiPolygon, roiMask
+from SITES_phenoCam_utils import roiEntry, noonImages, regImage, estimateTransform, readRegistration, writeRegistration
+from SITES_phenoCam_utils import warpMask
 
 # Time zone definition
 timezone_name = 'Europe/Stockholm'
@@ -108,43 +133,80 @@ camSITES = {'SWE-ANS-ANS-FOR-P01' : (68.353729, 18.816522),
             'SWE-SVB-DEG-MIR-P01' : (64.182032, 19.556545),
             'SWE-SVB-SVB-FOR-P01' : (64.256110, 19.774500),
             'SWE-TRS-LAE-GRA-P01' : (68.041889, 18.959309)}
+
+# ROI of the ROI registry (SITES_phenoCam_ROIregistry.json) to process (1 for the first ROI of the phenoCam)
+roiNbr = 1
+
+# ROI used only for phenoCams without ROI in the registry
+fallbackPts = np.array([[100, 400], [280, 800], [1200, 800], [900, 350]])
+
+# Set True to register the images against a reference image and warp the ROI mask accordingly (see 'regScale'
+# and 'regMotion' in SITES_phenoCam_utils.py for the registration settings)
+registerImages = False
+
+# Temporal resolution of the phenoCam images for the quality flagging (e.g. 'half-hourly', 'hourly' or 
+# 'bi-hourly' as in SITES_phenoCam_QFLAG_rules.csv). None detects the cadence from the image timestamps.
+cadence = None
+
+# Set True to process the images of all subfolders of the given path (e.g. one folder per year). Images found 
+# in several folders (e.g. L0 images and their L1 copies) are used once, from the folder nearest to the path.
+searchSubfolders = False
+
+# Set True to append the per-image metrics to the Parquet image metrics store (partitioned by station, 
+# phenoCam and year). By default the store is the folder 'SITES_phenoCam_imageMetrics' above the image path.
+saveParquet = False
+parquetPath = ''
+
+# Plotting of the time series: 'now' plots at the end of the run, 'defer' leaves the plotting to a separate 
+# step (SITES_phenoCam_plotL3.py, e.g. for batch runs on servers) and 'skip' doesn't plot at all
+plotMode = 'now'
  
 ################################################################################################################
-# Empty lists and dictionaries to store the corresponding vegetation indices value
+# Empty list to store the acquisition time of the images
 ################################################################################################################
-GCC = []
-RCC = []
-SOL = []
-DOY = []
+TIM = []
 
-# Define file path of L1 quality filtered images
+# Define file path of L1 quality filtered images and the date range to process
 thePath = input('Enter the path where L1 phenoCam images are stored: ')
-
-# Empty dictionary to store DOY and GCC as Key, value pair 
-GCCdict1day = {}
-RCCdict1day = {}
-Reddict1day = {}
-Grndict1day = {}
-Bludict1day = {}
-SolarAngles = {}
-SElevnClass = {}
-SnowdictTag = {}
+dateRange = input('Enter the date range to process as YYYYMMDD-YYYYMMDD or a single date YYYYMMDD (leave empty to process all images): ')
+
+# A single date processes that day only
+dates = dateRange.replace(' ', '').split('-') if dateRange.strip() else [None, None]
+if len(dates) == 1:
+    dates = dates * 2
+
+# Both dates must be valid dates as YYYYMMDD
+try:
+    if len(dates) != 2:
+        raise ValueError
+    for date in dates:
+        if date is not None and (len(date) != 8 or not date.isdigit()):
+            raise ValueError
+        if date is not None:
+            datetime.datetime.strptime(date, '%Y%m%d')
+except ValueError:
+    raise SystemExit('Invalid date range {}. Give the dates as YYYYMMDD-YYYYMMDD (e.g. 20220101-20221231) or YYYYMMDD.'.format(dateRange))
+startDate, endDate = dates
+if startDate and startDate > endDate:
+    raise SystemExit('Invalid date range {}. The start date is after the end date.'.format(dateRange))
 
 ################################################################################################################
 # Display Region of Interest (ROI) selection in the image  
 ################################################################################################################
-# Get the first and last image from the file path
-imgList = sorted(glob.glob(os.path.join(thePath, '*.jpg')))
+# Get the first and last image from the file path within the date range
+imgList = imageList(thePath, searchSubfolders, startDate, endDate)
+if len(imgList) == 0:
+    raise SystemExit('No images found in {} for the date range {}'.format(thePath, dateRange))
+
 img1st = os.path.basename(imgList[0]).split('_')[1]
 imglst = os.path.basename(imgList[-1]).split('_')[1]
 
 # Random selection of one image from the image folder to show the extent of ROI
-imgDir = thePath + '\\' + random.choice(os.listdir(thePath))
+imgDir = random.choice(imgList)
 
-# Extract image name, station name, year
+# Extract image name, station name
 imName = os.path.basename(imgDir)
 stnName = imName.split('_')[0]
-yyyy = int(imName.split('_')[1][0:4])
 
 # Specific information related with the station
 splitStn = stnName.split('-')
@@ -155,21 +217,13 @@ lat, lon = camSITES[stnName]
 # Reading randomly selected image 
 img = cv2.imread(imgDir)
 
-# Define right ROI for the phenoCam data being processed.
-# ROI used in SITES are available in a python script i.e. SITES_phenoCamROI.py 
-pts1 = np.array([[100, 400], [280, 800], [1200, 800], [900, 350]]) # Change this ROI coordinate pairs 
+# ROI of the registry valid for the date and size of the image (ROI used in SITES, see SITES_phenoCamROI.py)
+pts1 = roiPolygon(imName, img.shape[1], img.shape[0], roiNbr)
+if pts1 is None:
+    print ('No ROI {} in the ROI registry for {}. Using fallbackPts instead.'.format(roiNbr, imName))
+    pts1 = fallbackPts
 cv2.polylines(img, np.int32([pts1]), 1, (0, 0, 255), 10)
 
-################################################################################################################
-# Overlay defined ROI on top of image to give visual representation of ROI 
-################################################################################################################
-
-# OpenCV represents image in reverse order BGR; so convert it to appear in RGB mode and plot it
-plt.rcParams['figure.figsize'] = (16,8)
-plt.figure(0)
-plt.axis('on')
-plt.imshow(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-
 ################################################################################################################
 # Automatically creating folders in the directory to save results
 ################################################################################################################
@@ -182,6 +236,12 @@ for folder in folders:
     except:
         pass
 
+################################################################################################################
+# Export the defined ROI on top of the image as ROI map to give visual representation of ROI 
+################################################################################################################
+if plotMode != 'skip':
+    cv2.imwrite(os.path.join(thePath + r'\Graph\ROI_Map.jpg'), img)
+
 ################################################################################################################
 # Text file to store the mean image metrics
 ################################################################################################################       
@@ -189,7 +249,7 @@ for folder in folders:
 pathVI = os.path.join(thePath + r'\CSV\VI_allImage.txt')
 
 # Header defintion
-heading = "Image DOY Red_ROI1 Green_ROI1 Blue_ROI1 GCC_ROI1 RCC_ROI1 Snow Solar_Angle Solar_Angle_Class"
+heading = "Image DOY Red_ROI1 Green_ROI1 Blue_ROI1 GCC_ROI1 RCC_ROI1 Snow Solar_Angle SnowFrac_ROI1 SnowFrac_IMG Bright_ROI1 Sat_ROI1 Quality_ROI1"
 
 # Open a file for writing the image name, corresponding DOY and vegetation indices
 f1 = open(pathVI, 'w')
@@ -201,14 +261,22 @@ f1.write(heading + "\n")
 # Vegetation indices calculation for all available images for defined ROI
 ################################################################################################################
 
-# Create a mask with 0 as background having same size like original image
-mask = np.zeros_like(img)
-    
-# Fill the polygon with white colour in the area where the mask will be applied
-cv2.fillPoly(mask, np.int32([pts1]), (255,255,255))
+# Masks of fallbackPts for each image size (only used for images without ROI in the registry)
+fallbackMasks = {}
 
-# Iterating all images
-for img in sorted(glob.glob(os.path.join(thePath, '*.jpg'))):
+# Cached transforms, reference image of each ROI version and image size, and image nearest to noon of each day
+if registerImages:
+    transforms = readRegistration(thePath)
+    refImages = {}
+    imgPaths = {os.path.basename(img): img for img in imgList}
+    noonImg = noonImages(imgList)
+
+# Manual corrections of the automatic snow classification (override files and old 'SnowyImage' folders of
+# the image folders)
+snowOverride = readSnowOverride(imgList, thePath)
+
+# Iterating all images (including the images in the old 'SnowyImage' folder)
+for img in imgList:
    
     # Reading image
     cv_img = cv2.imread(img)
@@ -216,17 +284,50 @@ for img in sorted(glob.glob(os.path.join(thePath, '*.jpg'))):
     # Image file name
     imgName = os.path.basename(img)
     
+    # Skip images that cannot be read (see SITES_phenoCam_imageCheck.py to find them before the run)
+    if cv_img is None:
+        print ('Skipping {} (unreadable image).'.format(imgName))
+        continue
+    
+    # ROI mask (255 within the ROI) valid for the image, built once per ROI version and image size
+    mask = roiMask(imgName, cv_img.shape[1], cv_img.shape[0], roiNbr)
+    if mask is None:
+        if cv_img.shape[:2] not in fallbackMasks:
+            fallbackMasks[cv_img.shape[:2]] = np.zeros(cv_img.shape[:2], dtype = np.uint8)
+            cv2.fillPoly(fallbackMasks[cv_img.shape[:2]], np.int32([fallbackPts]), 255)
+        mask = fallbackMasks[cv_img.shape[:2]]
+    
+    # Warp the ROI mask with the transform of the image against the reference image (cached transforms are reused)
+    if registerImages:
+        entry = roiEntry(imgName, cv_img.shape[1], cv_img.shape[0])
+        key = (entry['Version'] if entry else None, cv_img.shape[:2])
+        if key not in refImages:
+            refName = entry.get('Reference') if entry else None
+            if refName not in imgPaths:
+                refName = os.path.basename(noonImg[imgName.split('_')[1]])
+            refImages[key] = (refName, regImage(cv2.imread(imgPaths[refName])))
+            
+            # Images of an unreadable reference image are not registered
+            if refImages[key][1] is None:
+                print ('Warning: reference image {} cannot be read. The images with ROI version {} and size {} are not registered.'.format(
+                       imgPaths[refName], key[0], key[1]))
+        
+        refName, refSmall = refImages[key]
+        if refSmall is not None:
+            if imgName not in transforms or transforms[imgName][0] != refName:
+                transforms[imgName] = (refName,) + estimateTransform(refSmall, regImage(cv_img))
+            
+            mask = warpMask(mask, transforms[imgName][1])
+    
     # Splitting the image name to extract date and time information
     splitted = imgName.split('_')
        
     # Date when the image was acquired
+    yyyy = int(splitted[1][0:4])
     mm = int(splitted[1][4:6])
     dd = int(splitted[1][6:])
     doy = splitted[2]
     
-    # Day of Year information (DOY) extraction from image file name
-    DOY.append(doy)
-    
     # Extract time
     time = splitted[-1].split('.')[0]
     hh = int(time[:2])
@@ -241,17 +342,8 @@ for img in sorted(glob.glob(os.path.join(thePath, '*.jpg'))):
     astral = Astral()
     sun_elevation = round(astral.solar_elevation(info_dt, lat, lon), 2)
     
-    # Categorize the solar angles into 3 classes based on their values
-    # Read more about this here: SITES Spectral – Data Quality Flagging (QFLAG) Documentation
-    if sun_elevation < 20:
-        solClass = 1
-    elif 20 <= sun_elevation <= 30:
-        solClass = 2
-    else:
-        solClass = 3
-    
     # Apply the mask and extract the image data within mask only
-    masked = cv2.bitwise_and(cv_img, mask)
+    masked = cv2.bitwise_and(cv_img, cv_img, mask = mask)
     
     # Splitting RGB image into separate bands
     B, G, R = cv2.split(masked)
@@ -271,362 +363,124 @@ for img in sorted(glob.glob(os.path.join(thePath, '*.jpg'))):
     # Red chromatic Coordinate
     r = round((Rm/(TotalDN_ROI)), 5)    
     
-    snow = 2 # Absence of snow
+    # Automatic snow classification from the image already read, unless corrected in the override file
+    stats = snowStats(cv_img, mask)
+    snowy = snowOverride.get(imgName, isSnowy(stats))
     
-    # Appending GCC values for the images to the empty list created before
-    GCC.append(g)
-    RCC.append(r)
-    SOL.append(sun_elevation)
+    snow = 1 if snowy else 2 # Presence (1) or absence (2) of snow
     
-    # Writing computed time series metrics for defined ROIs to the text file created earlier
-    f1.write('{} {} {} {} {} {} {} {} {} {}\n'.format(imgName, doy, Rm, Gm, Bm, g, r, snow, sun_elevation, solClass))
-    
-    # Update dictionary with corresponding key value pairs
-    if doy in GCCdict1day:
-        GCCdict1day[doy].append(g)
-        RCCdict1day[doy].append(r)
-        Reddict1day[doy].append(Rm)
-        Grndict1day[doy].append(Gm)
-        Bludict1day[doy].append(Bm)
-        SolarAngles[doy].append(sun_elevation)
-        SElevnClass[doy].append(solClass)
-        SnowdictTag[doy].append(snow)
-        
-    else:
-        GCCdict1day[doy] = [g]
-        RCCdict1day[doy] = [r]
-        Reddict1day[doy] = [Rm]
-        Grndict1day[doy] = [Gm]
-        Bludict1day[doy] = [Bm]
-        SolarAngles[doy] = [sun_elevation]
-        SElevnClass[doy] = [solClass]
-        SnowdictTag[doy] = [snow]
-    
-################################################################################################################
-# Lines of code to take into account the snow covered images stored in 'SnowyImage' folder.
-# Script works if there is no 'SnowyImage' folder in the directory        
-################################################################################################################       
-
-# Empty list to store similar VIs for snow covered image and its respective DOY
-doySnow = []
-gccSnow = []
-rccSnow = []
-solSnow = []
-
-# Define file path of snow covered images        
-snowImg = thePath + '\SnowyImage'
-
-# Iterating through snow covered images
-for img in sorted(glob.glob(os.path.join(snowImg, '*.jpg'))):
-    
-    # Reading image
-    cv_img = cv2.imread(img)
-    
-    # Extracting image file name
-    imgName = os.path.basename(img)
-    
-    # Splitting the image name to extract date and time information
-    splitted = imgName.split('_')
-       
-    # Date when the image was acquired
-    mm = int(splitted[1][4:6])
-    dd = int(splitted[1][6:])
-    doy = splitted[2]
-    
-    # DOY extraction from image file name
-    DOY.append(doy)
-    
-    # Extract time
-    time = splitted[-1].split('.')[0]
-    hh = int(time[:2])
-    min = int(time[2:4])
-
-    # Returns sun elevation for a given position (lat, long) at a given date and time    
-    dt = datetime.datetime(yyyy, mm, dd, hh, min, 0)
-    utc_dt = pytz.timezone('UTC').localize(dt)
-    info_timezone = timezone(timezone_name)
-    info_dt = utc_dt.astimezone(info_timezone)
-    
-    astral = Astral()
-    sun_elevation = round(astral.solar_elevation(info_dt, lat, lon), 2)
-    
-    # Categorize the solar angles into 3 classes based on their values
-    # Read more about this here: SITES Spectral – Data Quality Flagging (QFLAG) Documentation
-    if sun_elevation < 20:
-        solClass = 1
-    elif 20 <= sun_elevation <= 30:
-        solClass = 2
-    else:
-        solClass = 3
-        
-    # Apply the mask and extract the image data within mask only
-    masked = cv2.bitwise_and(cv_img, mask)
-    
-    # Splitting RGB image into separate bands
-    B, G, R = cv2.split(masked)
-
-    # Finding out mean DN of RGB bands within ROI 
-    Rm = np.mean(np.ma.masked_equal(R, 0))
-    Gm = np.mean(np.ma.masked_equal(G, 0))
-    Bm = np.mean(np.ma.masked_equal(B, 0))
-
-    # Total mean DN of ROI 
-    TotalDN_ROI = Rm + Gm + Bm
-
-    # Evaluation of visible band based vegetation indices
-    # Green Chromatic Coordinate
-    g = round((Gm/(TotalDN_ROI)), 5)
-    
-    # Red chromatic Coordinate
-    r = round((Rm/(TotalDN_ROI)), 5)
-    
-    snow = 1 # Presence of snow
-    
-    # Appending GCC values for the snow covered images to the empty list created before
-    doySnow.append(doy)
-    gccSnow.append(g)
-    rccSnow.append(r)
-    solSnow.append(sun_elevation)
-       
-    # Appending GCC and RCC values for the images
-    GCC.append(g)
-    RCC.append(r)
-    SOL.append(sun_elevation)
+    # Appending acquisition time of the images to the empty list created before
+    TIM.append(dt)
     
     # Writing computed time series metrics for defined ROIs to the text file created earlier
-    f1.write('{} {} {} {} {} {} {} {} {} {}\n'.format(imgName, doy, Rm, Gm, Bm, g, r, snow, sun_elevation, solClass))
-    
-    # Update dictionary with corresponding key value pairs
-    if doy in GCCdict1day:
-        GCCdict1day[doy].append(g)
-        RCCdict1day[doy].append(r)
-        Reddict1day[doy].append(Rm)
-        Grndict1day[doy].append(Gm)
-        Bludict1day[doy].append(Bm)
-        SolarAngles[doy].append(sun_elevation)
-        SElevnClass[doy].append(solClass)
-        SnowdictTag[doy].append(snow)
-        
-    else:
-        GCCdict1day[doy] = [g]
-        RCCdict1day[doy] = [r]
-        Reddict1day[doy] = [Rm]
-        Grndict1day[doy] = [Gm]
-        Bludict1day[doy] = [Bm]
-        SolarAngles[doy] = [sun_elevation]
-        SElevnClass[doy] = [solClass]
-        SnowdictTag[doy] = [snow]        
+    f1.write('{} {} {} {} {} {} {} {} {} {} {} {} {} {}\n'.format(imgName, doy, Rm, Gm, Bm, g, r, snow, sun_elevation, 
+             stats['SnowFrac_ROI'], stats['SnowFrac_IMG'], stats['Bright_ROI'], stats['Sat_ROI'], 
+             qualityScore(cv_img[mask > 0])))
 
 # Close the file
 f1.close()
 
+# Cache the transforms for the next run
+if registerImages:
+    writeRegistration(thePath, transforms)
+
 ################################################################################################################
 # Export .txt file as .csv file with all the information   
 ################################################################################################################
 
 # Read .txt file as a dataframe 
-df = pd.read_table(pathVI, delim_whitespace = True)
+df = pd.read_table(pathVI, sep = r'\s+')
 
-# Sort the dataframe in increasing DOY order
+# Sort the dataframe in increasing order of acquisition time
 sortedDF = df.sort_values('Image')
 
+# QFLAG rules of the phenoCam cadence (detected from the image timestamps if not set)
+rule = readQflagRules(cadence, TIM)
+print ('Quality flagging with the rules for {} images'.format(rule['Cadence']))
+
+# Categorize the solar angles into 3 classes based on their values
+# Read more about this here: SITES Spectral – Data Quality Flagging (QFLAG) Documentation
+sortedDF.insert(sortedDF.columns.get_loc('Solar_Angle') + 1, 'Solar_Angle_Class', solarClass(sortedDF['Solar_Angle'], rule))
+
 # Export the dataframe as a .csv file
-fileName = os.path.join(thePath + r'\CSV\{}_{}_allImages.csv'.format(stnName, yyyy))
+years = img1st[:4] if img1st[:4] == imglst[:4] else img1st[:4] + '-' + imglst[:4]
+fileName = os.path.join(thePath + r'\CSV\{}_{}_allImages.csv'.format(stnName, years))
 sortedDF.to_csv(fileName, index=False)
 
+# Append the per-image metrics to the Parquet image metrics store
+if saveParquet:
+    if not parquetPath:
+        parquetPath = os.path.join(os.path.dirname(os.path.normpath(thePath)), 'SITES_phenoCam_imageMetrics')
+    
+    metrics = sortedDF.copy()
+    metrics.insert(1, 'Timestamp', imageTime(metrics['Image']))
+    metrics['Station'] = splitStn[1]
+    metrics['PhenoCam'] = stnName
+    metrics['Year'] = metrics['Timestamp'].dt.year
+    
+    writeImageMetrics(metrics, parquetPath, '{}-{}'.format(img1st, imglst))
+    print ('Per-image metrics are appended to {}'.format(parquetPath))
+
 ################################################################################################################
-# Finding mean vegetation indices values from all valid images within a given DOY
+# Finding mean vegetation indices values from all valid images within a given day
 ################################################################################################################
-        
-# Dictionaries to store mean indices per day (Excluding no data values for a DOY)
-avgGCC = {}
-avgRCC = {}
-avgR = {}
-avgG = {}
-avgB = {}
-sTag = {}
-solC = {}
-sElv = {}
-stdGCC = {}
-stdRCC = {}
-nbrImgAvg = {}
-QFLAG = {}
-
-# Define path for new text file to store the daily averaged time series metrics
-path_avgGCC = os.path.join(thePath + r'\CSV\avgGCC1Day.txt')
 
 # Multiple line header defintion
 header1 = "TIMESTAMP DOY RED_ROI_1 GREEN_ROI_1 BLUE_ROI_1 GCC_ROI_1 GCC_STD_1 RCC_ROI_1 RCC_STD_1 NO._IMG_AVG AGL_SUN_MAX QFLAG_ROI_1"
 header2 = "YYYY-MM-DD None DN DN DN Fraction None Fraction None Count Degree Class"
 
-# Open a file for writing the corresponding DOY and vegetation indices
-f4 = open(path_avgGCC, 'w')
-
-# Append header to the text file
-f4.write(header1 + "\n")
-f4.write(header2 + "\n")
+# Acquisition date of each image from the image name
+imgDate = pd.to_datetime(sortedDF['Image'].str.split('_').str[1], format = '%Y%m%d')
+
+# Mean and standard deviation of the indices, number of images and maximum solar elevation per day
+grouped = sortedDF.groupby(imgDate)
+daily = pd.DataFrame({'RED_ROI_1'   : grouped['Red_ROI1'].mean().round(3),
+                      'GREEN_ROI_1' : grouped['Green_ROI1'].mean().round(3),
+                      'BLUE_ROI_1'  : grouped['Blue_ROI1'].mean().round(3),
+                      'GCC_ROI_1'   : grouped['GCC_ROI1'].mean().round(5),
+                      'GCC_STD_1'   : grouped['GCC_ROI1'].std(ddof = 0).round(5),
+                      'RCC_ROI_1'   : grouped['RCC_ROI1'].mean().round(5),
+                      'RCC_STD_1'   : grouped['RCC_ROI1'].std(ddof = 0).round(5),
+                      'NO._IMG_AVG' : grouped.size(),
+                      'AGL_SUN_MAX' : grouped['Solar_Angle'].max()})
+
+# A day is snowy if at least half of its images are snowy
+snowDay = (sortedDF['Snow'] == 1).groupby(imgDate).mean() >= 0.5
+
+# Continuous daily series over the date range (whole calendar years of the images if no range is given), 
+# leap years and year boundaries are handled by the calendar. All missing days are filled with 'NaN'
+firstDay = pd.Timestamp(startDate) if startDate else pd.Timestamp(int(img1st[:4]), 1, 1)
+lastDay = pd.Timestamp(endDate) if endDate else pd.Timestamp(int(imglst[:4]), 12, 31)
+daily = daily.reindex(pd.date_range(firstDay, lastDay, freq = 'D'))
+snowDay = snowDay.reindex(daily.index, fill_value = False)
 
-# Iterating over all dictionary key-value pairs and average the items
-for (k, v), (k1, v1), (k2, v2), (k3, v3), (k4, v4), (k5, v5), (k6, v6), (k7, v7) in zip(sorted(GCCdict1day.items()), \
-    sorted(RCCdict1day.items()), sorted(Reddict1day.items()), sorted(Grndict1day.items()), sorted(Bludict1day.items()), \
-    sorted(SnowdictTag.items()), sorted(SElevnClass.items()), sorted(SolarAngles.items())):
-    
-    # v, v1, v2, etc is the lists of GCC & RCC values on that DOY
-    avgGCC[k] = round(sum(v)/len(v), 5)
-    stdGCC[k] = round(statistics.pstdev(v), 5)
-    nbrImgAvg[k] = len(v)
-    avgRCC[k1] = round(sum(v1)/len(v1), 5)
-    stdRCC[k1] = round(statistics.pstdev(v1), 5)
-    avgR[k2] = round(sum(v2)/len(v2), 3)
-    avgG[k3] = round(sum(v3)/len(v3), 3)
-    avgB[k4] = round(sum(v4)/len(v4), 3) 
-    sTag[k5] = int(s.mode(v5)[0])
-    solC[k6] = max(v6)
-    sElv[k7] = max(v7)
-    
-    ############################################################################################################
-    '''
-    Defining quality flagging scheme for each DOY based on number of images for computing daily average, 
-    presence or absence of snow and solar elevation angle
-    '''
-    ############################################################################################################        
-    """
-    ############################################################################################################
-    # Valid only for half hourly temporal resolution
-    ############################################################################################################  
-    if sTag[k5] == 1:
-        QFLAG[k] = 100
-    
-    elif (nbrImgAvg[k] < 3) and (solC[k6] == 1):
-        QFLAG[k] = 211
-        
-    elif (nbrImgAvg[k] < 3) and (solC[k6] == 2):
-        QFLAG[k] = 212
-    
-    elif (nbrImgAvg[k] < 3) and (solC[k6] == 3):
-        QFLAG[k] = 213
-    
-    elif ((nbrImgAvg[k] >= 3) and (nbrImgAvg[k] < 6)) and (solC[k6] == 1):
-        QFLAG[k] = 221
-    
-    elif ((nbrImgAvg[k] >= 3) and (nbrImgAvg[k] < 6)) and (solC[k6] == 2):
-        QFLAG[k] = 222
-        
-    elif ((nbrImgAvg[k] >= 3) and (nbrImgAvg[k] < 6)) and (solC[k6] == 3):
-        QFLAG[k] = 223
-        
-    elif (nbrImgAvg[k] >= 6) and (solC[k6] == 1):
-        QFLAG[k] = 231
-    
-    elif (nbrImgAvg[k] >= 6) and (solC[k6] == 2):
-        QFLAG[k] = 232     
-    
-    elif (nbrImgAvg[k] >= 6) and (solC[k6] == 3):
-        QFLAG[k] = 233 
-    
-    """
-    ############################################################################################################
-    # Valid only for hourly/bi-hourly temporal resolution
-    ############################################################################################################
-    if sTag[k5] == 1:
-        QFLAG[k] = 100
-    
-    elif (nbrImgAvg[k] < 2) and (solC[k6] == 1):
-        QFLAG[k] = 211
-        
-    elif (nbrImgAvg[k] < 2) and (solC[k6] == 2):
-        QFLAG[k] = 212
-    
-    elif (nbrImgAvg[k] < 2) and (solC[k6] == 3):
-        QFLAG[k] = 213
-    
-    elif ((nbrImgAvg[k] >= 2) and (nbrImgAvg[k] < 4)) and (solC[k6] == 1):
-        QFLAG[k] = 221
-    
-    elif ((nbrImgAvg[k] >= 2) and (nbrImgAvg[k] < 4)) and (solC[k6] == 2):
-        QFLAG[k] = 222
-        
-    elif ((nbrImgAvg[k] >= 2) and (nbrImgAvg[k] < 4)) and (solC[k6] == 3):
-        QFLAG[k] = 223
-        
-    elif (nbrImgAvg[k] >= 4) and (solC[k6] == 1):
-        QFLAG[k] = 231
-    
-    elif (nbrImgAvg[k] >= 4) and (solC[k6] == 2):
-        QFLAG[k] = 232     
-    
-    elif (nbrImgAvg[k] >= 4) and (solC[k6] == 3):
-        QFLAG[k] = 233     
-            
-    ############################################################################################################
-    ############################################################################################################
-        
-    # Derive timestamp information from DOY and year
-    yyyy_doy = str(yyyy) + '+' + k
-    timeStamp = datetime.datetime.strptime(yyyy_doy, "%Y+%j").strftime('%Y-%m-%d')
-    
-    # Writing daily averaged time series metrics for defined ROIs to the text file created earlier
-    f4.write('{} {} {} {} {} {} {} {} {} {} {} {}\n'.format(timeStamp, k, avgR[k2], avgG[k3], \
-    avgB[k4], avgGCC[k], stdGCC[k], avgRCC[k1], stdRCC[k1], nbrImgAvg[k], sElv[k7], QFLAG[k]))
-
-# Check if it is a leap year
-if calendar.isleap(yyyy):
-    nbrDays = 366
-else:
-    nbrDays = 365
-    
-# Check if there are complete annual data. 
-# Write 'NaN' if there are any missing DOYs
-if len(avgGCC) < nbrDays:
-    
-    # Find out the missing DOYs
-    currentDOY = [int(j) for j in sorted(avgGCC.keys())]
-    
-    tempA = [x+1 for x in range(int(datetime.date.max.replace(year = yyyy).strftime('%j')))]
-    currentDOY = set(currentDOY)
-    missedDOY = list(currentDOY ^ set(tempA))
+################################################################################################################
+'''
+Defining quality flagging scheme for each day based on number of images for computing daily average, 
+presence or absence of snow and solar elevation angle. The thresholds are taken from the rules table 
+(SITES_phenoCam_QFLAG_rules.csv) for the cadence of the phenoCam and all days are flagged at once.
+'''
+################################################################################################################
+daily['QFLAG_ROI_1'] = qflag(daily['NO._IMG_AVG'], daily['AGL_SUN_MAX'], snowDay, rule)
 
-    # Update the dictionary with missed DOYs as NaN
-    for mdoy in missedDOY:
-        
-        avgGCC[str(mdoy)]       = np.float64('nan')
-        stdGCC[str(mdoy)]       = np.float64('nan')
-        nbrImgAvg[str(mdoy)]    = np.float64('nan')
-        avgRCC[str(mdoy)]       = np.float64('nan')
-        stdRCC[str(mdoy)]       = np.float64('nan')
-        avgR[str(mdoy)]         = np.float64('nan')
-        avgG[str(mdoy)]         = np.float64('nan')
-        avgB[str(mdoy)]         = np.float64('nan')
-        solC[str(mdoy)]         = np.float64('nan')
-        sElv[str(mdoy)]         = np.float64('nan')
-        
-        # For all no data DOYs update QFLAG with 'NaN'
-        QFLAG[str(mdoy)]        = np.float64('nan')
-        
-        # Derive timestamp information from DOY and year
-        yyyy_doy = str(yyyy) + '+' + str(mdoy)
-        timeStamp = datetime.datetime.strptime(yyyy_doy, "%Y+%j").strftime('%Y-%m-%d')
-        
-        # Writing daily averaged time series metrics for defined ROIs to the text file created earlier
-        f4.write('{} {} {} {} {} {} {} {} {} {} {} {}\n'.format(timeStamp, str(mdoy), avgR[str(mdoy)], \
-        avgG[str(mdoy)], avgB[str(mdoy)], avgGCC[str(mdoy)], stdGCC[str(mdoy)], avgRCC[str(mdoy)], \
-        stdRCC[str(mdoy)], nbrImgAvg[str(mdoy)], sElv[str(mdoy)], QFLAG[str(mdoy)]))
+# Counts and flags as integers, 'NaN' for all no data days
+daily['NO._IMG_AVG'] = daily['NO._IMG_AVG'].astype('Int64')
+daily['QFLAG_ROI_1'] = daily['QFLAG_ROI_1'].astype('Int64')
 
-# Close the file
-f4.close()
+# Derive timestamp and DOY information from the date
+daily.insert(0, 'DOY', daily.index.dayofyear)
+daily.insert(0, 'TIMESTAMP', daily.index.strftime('%Y-%m-%d'))
        
 ################################################################################################################
-# Export .txt file as .csv file with all the information   
+# Export the daily averaged time series metrics as .csv file with all the information   
 ################################################################################################################
 
-# Read the .txt file as a dataframe 
-df = pd.read_table(path_avgGCC, delim_whitespace=True)
-
-# Export the dataframe as a .csv file
+# Export the dataframe as a .csv file with the units as second header line
 temp = 'SITES_' + splitStn[-1] + '-GCC-RCC_' + splitStn[1] + '_' + splitStn[2] + '_' + img1st + '-' + imglst
 fileName = os.path.join(thePath + r'\CSV\{}_L3_daily.csv'.format(temp))
-pd.concat([df[:1], df.iloc[1:].sort_values(by = 'TIMESTAMP')], ignore_index = True, \
-          axis = 0).to_csv(fileName, index=False, na_rep='NaN', date_format='%Y-%m-%d')
+units = pd.DataFrame([header2.split()], columns = header1.split())
+pd.concat([units, daily[header1.split()].astype(object)], ignore_index = True, \
+          axis = 0).to_csv(fileName, index=False, na_rep='NaN')
 
 ################################################################################################################
 # Remove all .txt file in the directory   
@@ -639,42 +493,13 @@ for item in test:
         os.remove(os.path.join(dir_name, item))
 
 ################################################################################################################
-# Plotting time series of daily averaged vegetation indices   
+# Plotting time series of daily averaged vegetation indices (rendered without display, see plotMode)   
 ################################################################################################################
+if plotMode == 'now':
+    plotL3(sortedDF, daily, os.path.join(thePath + r'\Graph\GCC_1Day.jpg'), os.path.join(thePath + r'\Graph\RCC_1Day.jpg'))
 
-# Plotting time series of GCC vegetation index
-plt.figure(1)
-plt.rcParams['figure.figsize'] = (16,8)
-plt.ylim([0.3, 0.50 ]) 
-plt.plot([int(i) for i in DOY], GCC, 'o', color = 'grey', markersize = 4, alpha = 0.1, label = 'All image GCC')
-plt.plot([int(i) for i in doySnow], gccSnow, 'o', color = 'cornflowerblue', markersize = 4, alpha = 0.5, 
-         label = 'Snowy image GCC') 
-plt.plot([int(j) for j in sorted(avgGCC.keys())], [avgGCC[x] for x in sorted(avgGCC.keys())], 
-         'r^', markersize = 6, mfc = 'none', label = 'Daily Average')
-plt.xticks(range(0, 365, 10), rotation = 45, fontsize = 16)
-plt.yticks(fontsize = 16) 
-plt.grid(True, alpha = 0.3)
-plt.xlabel('Day of Year (DOY)', fontsize = 20)
-plt.ylabel('Green Chromatic Coordinate (GCC)', fontsize = 20)
-plt.legend(loc = 'upper left', fontsize = 18)
-plt.savefig(os.path.join(thePath + r'\Graph\GCC_1Day.jpg'))
-
-# Plotting time series of RCC vegetation index
-plt.figure(2)
-plt.rcParams['figure.figsize'] = (16,8)
-#plt.ylim([0.31, 0.38 ]) 
-plt.plot([int(i) for i in DOY], RCC, 'o', color = 'grey', markersize = 4, alpha = 0.1, label = 'All image RCC')
-plt.plot([int(i) for i in doySnow], rccSnow, 'o', color = 'cornflowerblue', markersize = 4, alpha = 0.5, 
-         label = 'Snowy image RCC')
-plt.plot([int(j) for j in sorted(avgRCC.keys())], [avgRCC[x] for x in sorted(avgRCC.keys())], 
-         'ro', markersize = 6, mfc = 'none', label = 'Daily Average')
-plt.xticks(range(0, 365, 10), rotation = 45, fontsize = 16)
-plt.yticks(fontsize = 16) 
-plt.grid(True, alpha = 0.3)
-plt.xlabel('Day of Year (DOY)', fontsize = 20)
-plt.ylabel('Red Chromatic Coordinate (RCC)', fontsize = 20)
-plt.legend(loc = 'upper left', fontsize = 18)
-plt.savefig(os.path.join(thePath + r'\Graph\RCC_1Day.jpg'))
+elif plotMode == 'defer':
+    print ('Plotting is deferred. Run SITES_phenoCam_plotL3.py to plot the time series of {}'.format(fileName))
 
 ################################################################################################################
 ################################################################################################################
@@ -17,6 +17,39 @@ defined path. The daily average images are saved to folders defined by the L2 pr
 The daily averaed L2 image products are RGB, GCC, and RCC and they are exported as a grayscale image in the 
 corresponding folders as shown in the example above.  
 
+Optionally, a per-pixel daily percentile composite (e.g. 90th percentile or median) can be computed instead of 
+the daily mean by setting compositeMethod = 'percentile'. GCC and RCC are then computed per image and the 
+percentile is taken over the chromatic coordinates of all images of the day, which is more robust to haze and 
+shadows than the mean. The folder and file names are appended with the percentile, for example:
+
+    d) 90th percentile GCC: SITES_P01-GCC_RBD_RBD_20220613-20220925_L2_dailyP90
+
+The daily composites can also be appended to a chunked and compressed HDF5 datacube (saveDatacube = True). The
+datacube holds one dataset 'composite' (time x rows x columns x band) with the bands R, G, B, GCC and RCC as 
+uint8 (GCC and RCC scaled by 255 as in the images) and a dataset 'date' (YYYYMMDD) giving the time axis. The 
+chunks are long in time and small in space so that the time series of a pixel or a small ROI is read from a 
+few chunks only. By default the datacube is stored in the folder above the L1 data (e.g. ...\L1\) so that the 
+same file is appended year after year. Days already present in the datacube are skipped. For example, the GCC
+time series of the pixel at row 500 and column 1200:
+
+    with h5py.File(cubePath, 'r') as cube:
+        gcc = cube['composite'][:, 500, 1200, 3] / 255
+        dates = cube['date'][:]
+
+The ROI masks of the ROI registry (SITES_phenoCam_ROIregistry.json) valid for the days of the datacube are
+stored with it, one dataset per ROI version (e.g. 'roi/v2') holding the masks as bits of a uint8 image (bit 0 
+for ROI 1 etc.) and the validity dates and polygons as attributes. For example, the mean GCC of ROI 1:
+
+    with h5py.File(cubePath, 'r') as cube:
+        roi1 = (cube['roi/v2'][:] & 1) > 0
+        rows, cols = np.nonzero(roi1)
+        y0, y1, x0, x1 = rows.min(), rows.max() + 1, cols.min(), cols.max() + 1
+        gcc = cube['composite'][:, y0:y1, x0:x1, 3][:, roi1[y0:y1, x0:x1]].mean(axis = 1) / 255
+
+Only the chunks of the bounding box of the ROI are read (slice the datacube before masking it). The buffer of 
+the datacube (...cube_L2_daily.h5.buffer.npy) is deleted at the end of the run, also when the run stops with an
+error, and a buffer left by a killed run is deleted at the next start.
+
 Note: The script was tested on Windows environment in Python 3.7.6 version only. This script is only for 
       internal use within Swedish Infrastructure for Ecosystem Science (SITES).
       
@@ -25,17 +58,23 @@ Note: The script was tested on Windows environment in Python 3.7.6 version only.
       images but they are not significant.
 
 Instructions for running the script:
-    a) Make sure all the required modules are installed.
+    a) Make sure all the required modules are installed (h5py is needed only if saveDatacube = True).
     b) Images should be in .jpg format.
-    c) Make sure the L1 images are as per the SITES naming convention
+    c) Make sure the L1 images are as per the SITES naming convention (other .jpg files in the folder, e.g. 
+       ROI maps, are ignored).
     d) Run the script and provide path to folder where L1 images are stored.
     e) Daily average of RGB, GCC, and RCC are computed and stored within the same file path.
+    f) Check the parameter setting section to choose between the mean and the percentile composites.
+    g) Defective images listed by SITES_phenoCam_imageCheck.py in a quarantine file and duplicate images 
+       marked in its image catalog are skipped, and images that cannot be read are skipped with a message
+       instead of stopping the run.
     
 Limitations of the script:
     a) Script can only take .jpg images as input.
     b) Script is programmed to process only one year data at a time..
     c) Script doesn't account for the change in camera field of view (FOV).
-    d) Script doesn't take into account the different image sizes if there are any.
+    d) Script doesn't take into account the different image sizes if there are any. In percentile mode, images
+       which do not match the size of the first image of the day are skipped.
     
 For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
                                         lars.eklundh@nateko.lu.se
@@ -48,12 +87,242 @@ For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
 # Moduel Declaration
 ###############################################################################################################
 import os
+import sys
+import atexit
 import cv2
 import glob
+import json
 import shutil
 import numpy as np
 from datetime import datetime
+from collections import deque
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from SITES_phenoCam_utils import roiLabels, imageList
+
+###############################################################################################################
+# Parameter setting section
+# This section decides how the daily composites are computed
+###############################################################################################################
+
+# 'mean' computes the daily average images, 'percentile' computes per-pixel daily percentile composites
+compositeMethod = 'mean'
+
+# Percentile used when compositeMethod = 'percentile' (50 gives the daily median)
+pctValue = 90
+
+# Number of image rows processed at a time in percentile mode. The percentiles of a block of rows take about 
+# 16 bytes x (number of images in the day) x chunkRows x (image width) of memory.
+chunkRows = 32
+
+# Number of days processed in parallel in percentile mode (at most nbrWorkers days are in progress at a time)
+nbrWorkers = min(4, os.cpu_count() or 1)
+
+# Memory (MB) for the decoded image stacks of the days in progress in percentile mode, shared by the workers. 
+# The stack of a day larger than memStackMB / nbrWorkers is written to a memory-mapped file in the folder 
+# 'Temp' instead, so that it is held on disk and read back one block of rows at a time.
+memStackMB = 1024
+
+# Set True to append the daily composites to a chunked HDF5 datacube (time x rows x columns x band)
+saveDatacube = False
+
+# Complete file path of the datacube. Leave empty to store it in the folder above the L1 data.
+cubePath = ''
+
+# Chunk size of the datacube in time (days) and in space (pixels). Days are buffered on disk until a 
+# complete time chunk can be written, so that each chunk is compressed and written only once.
+cubeTimeChunk = 64
+cubeTileSize = 16
+
+###############################################################################################################
+# Function definitions
+###############################################################################################################
+
+def dailyPercentile(dayFiles, dayStack, saveRGB, saveGCC, saveRCC):
+    '''
+    Computes per-pixel percentile composites of RGB, GCC and RCC from all images of one day. The decoded
+    images are stored once in a uint8 stack, held in memory up to memStackMB / nbrWorkers and otherwise 
+    memory-mapped to dayStack on disk, and the percentiles are then computed in blocks of chunkRows rows. The 
+    memory used is the stack (if held in memory), one decoded image and the block being processed (see 
+    chunkRows).
+    '''
+    # Image dimensions of the day are taken from the first readable image
+    for i, file in enumerate(dayFiles):
+        firstImg = cv2.imread(file)
+        if firstImg is not None:
+            break
+    
+    # No readable image in the day
+    if firstImg is None:
+        print ('Skipping {} (no readable image).'.format(os.path.basename(saveRGB)))
+        return None, None, None, None
+    
+    nrows, ncols = firstImg.shape[:2]
+    
+    # Stack of the day in memory, or memory-mapped on disk if it is larger than the share of the worker
+    shape = (len(dayFiles) - i, nrows, ncols, 3)
+    onDisk = np.prod(shape) > memStackMB * 2**20 / nbrWorkers
+    if onDisk:
+        stack = np.lib.format.open_memmap(dayStack, mode = 'w+', dtype = np.uint8, shape = shape)
+    else:
+        stack = np.empty(shape, dtype = np.uint8)
+    
+    # Decode every image once into the stack, starting with the image already read
+    stack[0] = firstImg
+    del firstImg
+    nbrImg = 1
+    for file in dayFiles[i + 1:]:
+        cv_img = cv2.imread(file)
+        
+        # Skip unreadable images and images with deviating dimensions
+        if (cv_img is None) or (cv_img.shape[:2] != (nrows, ncols)):
+            print ('Skipping {} (unreadable or different image size).'.format(os.path.basename(file)))
+            continue
+        
+        stack[nbrImg] = cv_img
+        nbrImg += 1
+    
+    # Empty arrays for the composites (BGR order as in OpenCV)
+    rgbImg = np.zeros((nrows, ncols, 3), dtype = np.uint8)
+    gccImg = np.zeros((nrows, ncols), dtype = np.uint8)
+    rccImg = np.zeros((nrows, ncols), dtype = np.uint8)
+    
+    # Compute the percentiles block by block
+    for r0 in range(0, nrows, chunkRows):
+        r1 = min(r0 + chunkRows, nrows)
+        block = np.asarray(stack[:nbrImg, r0:r1])
+        
+        # Per-pixel percentile of each channel
+        rgbImg[r0:r1] = np.around(np.percentile(block, pctValue, axis = 0))
+        
+        # GCC and RCC per image, with zero where the total DN is zero
+        DNtotal = block.sum(axis = 3, dtype = np.float32)
+        DNtotal[DNtotal == 0] = np.inf
+        gcc = np.percentile(block[..., 1] / DNtotal, pctValue, axis = 0)
+        rcc = np.percentile(block[..., 2] / DNtotal, pctValue, axis = 0)
+        
+        # Converting GCC and RCC to range from 0 - 255 as 'uint8' in the same way as the mean composites
+        gccImg[r0:r1] = (gcc * 255).astype(np.uint8)
+        rccImg[r0:r1] = (rcc * 255).astype(np.uint8)
+    
+    # Release the stack and delete the memory-mapped file
+    del stack
+    if onDisk:
+        os.remove(dayStack)
+    
+    # Save the composites in the defined paths
+    cv2.imwrite(saveRGB, rgbImg)
+    cv2.imwrite(saveGCC, gccImg)
+    cv2.imwrite(saveRCC, rccImg)
+    
+    return saveRGB, rgbImg, gccImg, rccImg
+
+def windowMap(pool, func, argList, window):
+    '''
+    Returns func(*args) for the arguments of argList in order, like pool.map, but with at most window calls 
+    submitted to the pool and not yet returned, so that the days in progress (and their results) are bounded.
+    '''
+    pending = deque()
+    for args in argList:
+        pending.append(pool.submit(func, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    
+    while pending:
+        yield pending.popleft().result()
+
+def addToCube(dayKey, bgrImg, gccImg, rccImg):
+    '''
+    Adds the daily composites of one day to the datacube buffer. The datacube is created (or opened for
+    appending) with the first day, and the buffer is written to the datacube when it reaches the end of a 
+    time chunk.
+    '''
+    global cube, cubeBuffer, cubeDates, cubeExisting
+    
+    nrows, ncols = gccImg.shape
+    dateInt = int(dayKey.split('_')[1])
+    
+    if cube is None:
+        # Create the datacube if it doesn't exist, otherwise open it for appending
+        cube = h5py.File(cubePath, 'a')
+        if 'composite' not in cube:
+            cube.create_dataset('composite', shape = (0, nrows, ncols, 5), maxshape = (None, nrows, ncols, 5), 
+                                dtype = np.uint8, chunks = (cubeTimeChunk, cubeTileSize, cubeTileSize, 5),
+                                compression = 'gzip', compression_opts = 4, shuffle = True)
+            cube.create_dataset('date', shape = (0,), maxshape = (None,), dtype = np.int32, chunks = (1024,))
+            cube['composite'].attrs['bands'] = 'R,G,B,GCC,RCC'
+            cube['composite'].attrs['scale_factor_GCC_RCC'] = 1/255
+            cube['composite'].attrs['composite'] = prodExt.strip('_')
+            cube.attrs['phenoCam'] = os.path.basename(imgList[0]).split('_')[0]
+            
+        elif cube['composite'].shape[1:3] != (nrows, ncols):
+            sys.exit('Warning: Image size {}x{} differs from the datacube {}. Use a new datacube.'.format(
+                     ncols, nrows, cubePath))
+        
+        # Buffer for the days of one time chunk, memory-mapped to keep memory use low (deleted at the end of the
+        # run, also when it stops with an error)
+        cubeBuffer = np.lib.format.open_memmap(cubePath + '.buffer.npy', mode = 'w+', dtype = np.uint8, 
+                                               shape = (cubeTimeChunk, nrows, ncols, 5))
+        atexit.register(removeCubeBuffer)
+        cubeDates = []
+        cubeExisting = set(cube['date'][:].tolist())
+    
+    # ROI masks of the registry valid for the day, stored once per ROI version
+    entry, labels = roiLabels(dayKey, ncols, nrows)
+    if entry is not None and 'roi/v{}'.format(entry['Version']) not in cube:
+        roiSet = cube.create_dataset('roi/v{}'.format(entry['Version']), data = labels, compression = 'gzip')
+        roiSet.attrs['ValidFrom'] = entry['ValidFrom'] or ''
+        roiSet.attrs['ValidTo'] = entry['ValidTo'] or ''
+        roiSet.attrs['ROI'] = json.dumps(entry['ROI'])
+    
+    # Skip days that are already in the datacube (e.g. when reprocessing a year)
+    if (dateInt in cubeExisting) or (dateInt in cubeDates):
+        return
+    
+    # Bands in the order R, G, B, GCC, RCC
+    idx = len(cubeDates)
+    cubeBuffer[idx, :, :, 0] = bgrImg[:, :, 2]
+    cubeBuffer[idx, :, :, 1] = bgrImg[:, :, 1]
+    cubeBuffer[idx, :, :, 2] = bgrImg[:, :, 0]
+    cubeBuffer[idx, :, :, 3] = gccImg
+    cubeBuffer[idx, :, :, 4] = rccImg
+    cubeDates.append(dateInt)
+    
+    # Write the buffer when it reaches the end of the current time chunk of the datacube
+    if (cube['date'].shape[0] + len(cubeDates)) % cubeTimeChunk == 0:
+        flushCube()
+
+def removeCubeBuffer():
+    '''
+    Releases and deletes the memory-mapped buffer of the datacube (if any).
+    '''
+    global cubeBuffer
+    if cubeBuffer is not None:
+        cubeBuffer = None
+        if os.path.exists(cubePath + '.buffer.npy'):
+            os.remove(cubePath + '.buffer.npy')
+
+def flushCube():
+    '''
+    Appends the buffered days to the datacube. The buffer is written in strips of cubeTileSize rows so that 
+    only a small part of the buffer is read into memory at a time.
+    '''
+    global cubeDates
+    
+    nbrDays = len(cubeDates)
+    if nbrDays == 0:
+        return
+    
+    n0 = cube['date'].shape[0]
+    cube['composite'].resize(n0 + nbrDays, axis = 0)
+    cube['date'].resize(n0 + nbrDays, axis = 0)
+    
+    for r0 in range(0, cubeBuffer.shape[1], cubeTileSize):
+        r1 = min(r0 + cubeTileSize, cubeBuffer.shape[1])
+        cube['composite'][n0:, r0:r1] = cubeBuffer[:nbrDays, r0:r1]
+    
+    cube['date'][n0:] = cubeDates
+    cubeDates = []
 
 ###############################################################################################################
 
@@ -68,8 +337,9 @@ doy = []
 # Ask from user to enter file path of L1 datasets
 imgSrc = input("Enter file path to the folder containing L1 data: ")
 
-# Get the first and last image from the file path
-imgList = sorted(glob.glob(os.path.join(imgSrc, '*.jpg')))
+# Get the first and last image from the file path (images as per the naming convention, without the defective 
+# and the duplicate images)
+imgList = imageList(imgSrc, snowy = False)
 img1st = os.path.basename(imgList[0]).split('_')[1]
 imglst = os.path.basename(imgList[-1]).split('_')[1]
 
@@ -78,10 +348,13 @@ tempImg = os.path.basename(imgList[0]).split('-')
 phenCam = tempImg[-1].split('_')[0]
 stn = tempImg[1] + '_' + tempImg[2] + '_'
 
+# Product level extension, the percentile composites are appended with the percentile (e.g. _L2_dailyP90)
+prodExt = '_L2_daily' + ('P{}'.format(pctValue) if compositeMethod == 'percentile' else '')
+
 # Naming convention of folders storing L2 daily data
-dgcc = 'SITES_' + phenCam + '-GCC_' + stn + img1st + '-' + imglst + '_L2_daily'
-drcc = 'SITES_' + phenCam + '-RCC_' + stn + img1st + '-' + imglst + '_L2_daily'
-drgb = 'SITES_' + phenCam + '-RGB_' + stn + img1st + '-' + imglst + '_L2_daily'
+dgcc = 'SITES_' + phenCam + '-GCC_' + stn + img1st + '-' + imglst + prodExt
+drcc = 'SITES_' + phenCam + '-RCC_' + stn + img1st + '-' + imglst + prodExt
+drgb = 'SITES_' + phenCam + '-RGB_' + stn + img1st + '-' + imglst + prodExt
 
 ###############################################################################################################
 # Automatically creating folders in the directory to save results into
@@ -96,146 +369,231 @@ for folder in folders:
         pass
 
 # Path definition for intermediate file storage    
-baseDst = imgSrc + '\Temp'
+baseDst = os.path.join(imgSrc, 'Temp')
+
+# The datacube is opened when the first daily composite is added
+cube = None
+cubeBuffer = None
+if saveDatacube:
+    import h5py
+    
+    # Default datacube in the folder above the L1 data, shared by all years of the phenoCam
+    if not cubePath:
+        cubePath = os.path.join(os.path.dirname(os.path.normpath(imgSrc)), 
+                                'SITES_' + phenCam + '_' + stn + 'cube' + prodExt + '.h5')
+    
+    # Buffer left by a killed run (its days were not written to the datacube and are processed again)
+    if os.path.exists(cubePath + '.buffer.npy'):
+        os.remove(cubePath + '.buffer.npy')
 
 ###############################################################################################################
 ###############################################################################################################
 
-# 1st Part
-# Automatically copy all images and store them in a folder named after DOY  
-# Iterating all images
-for img in sorted(glob.glob(os.path.join(imgSrc, '*.jpg'))):
+if compositeMethod == 'mean':
     
-    # Extracting image file name
-    imgName = os.path.basename(img)
+    # 1st Part
+    # Automatically copy all images and store them in a folder named after DOY  
+    # Iterating all images
+    for img in imgList:
     
-    # Day of Year information (DOY) extraction from image file name
-    dayOfYear = int(imgName.split('_')[2])
+        # Extracting image file name
+        imgName = os.path.basename(img)
     
-    # Check if current DOY is in the list
-    if dayOfYear not in doy:
+        # Day of Year information (DOY) extraction from image file name
+        dayOfYear = int(imgName.split('_')[2])
+    
+        # Check if current DOY is in the list
+        if dayOfYear not in doy:
         
-        # Append the day of year in empty list DOY
-        doy.append(dayOfYear)
+            # Append the day of year in empty list DOY
+            doy.append(dayOfYear)
         
-        # Make a new folder in the given path with the 'doy' as folder name
-        thePath = baseDst
-        folders = [str(dayOfYear)]
+            # Make a new folder in the given path with the 'doy' as folder name
+            thePath = baseDst
+            folders = [str(dayOfYear)]
         
-        # Iterating the folders list to create each DOY as a new folder in given path
-        for folder in folders:
-            # Try-except block is to pass overwrite directories if exists
-            try:
-                os.mkdir(os.path.join(thePath, folder))
-            except:
-                pass
+            # Iterating the folders list to create each DOY as a new folder in given path
+            for folder in folders:
+                # Try-except block is to pass overwrite directories if exists
+                try:
+                    os.mkdir(os.path.join(thePath, folder))
+                except:
+                    pass
         
-        # Copy the image from the source to destination folder
-        imgDst = baseDst + '\\' + folders[0]
+            # Copy the image from the source to destination folder
+            imgDst = baseDst + '\\' + folders[0]
     
-    # If DOY exists in the doy list, copy the source image to the same folder
-    shutil.copy(img, imgDst)
+        # If DOY exists in the doy list, copy the source image to the same folder
+        shutil.copy(img, imgDst)
     
-print ('\n')  
-print ('Finished copying images to respective DOY folders.')
+    print ('\n')  
+    print ('Finished copying images to respective DOY folders.')
    
-###############################################################################################################
-###############################################################################################################
+    ###############################################################################################################
+    ###############################################################################################################
 
-print ('\n')
-print ('Computing daily average images................................................')
+    print ('\n')
+    print ('Computing daily average images................................................')
 
-# 2nd part
-# Compute daily average from all available images for each DOY and export it as a .jpg file
+    # 2nd part
+    # Compute daily average from all available images for each DOY and export it as a .jpg file
 
-# Path definition to save the daily averaged image 
-imgSave = imgSrc + '\{}'.format(drgb)
+    # Path definition to save the daily averaged image 
+    imgSave = imgSrc + '\{}'.format(drgb)
 
-for subdir in os.listdir(baseDst): 
+    for subdir in os.listdir(baseDst): 
     
-    imgDir = baseDst + '\\' + subdir
-
-    # Read all files in a directory as a numpy array
-    # cv2.cvtColor for converting image from BGR to RGB
-    images = [cv2.cvtColor(cv2.imread(file), cv2.COLOR_BGR2RGB) for file in glob.glob(os.path.join(imgDir, '*.jpg'))]
+        imgDir = baseDst + '\\' + subdir
+
+        # Read all files in a directory as a numpy array
+        # cv2.cvtColor for converting image from BGR to RGB
+        images = []
+        for file in glob.glob(os.path.join(imgDir, '*.jpg')):
+            image = cv2.imread(file)
+            
+            # Skip images that cannot be read
+            if image is None:
+                print ('Skipping {} (unreadable image).'.format(os.path.basename(file)))
+                continue
+            
+            images.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        
+        if len(images) == 0:
+            continue
     
-    # Compute element wise daily average
-    avgImg = np.mean(images, axis = 0)
+        # Compute element wise daily average
+        avgImg = np.mean(images, axis = 0)
     
-    # Converting float64 type ndarray to uint8
-    intImage = np.around(avgImg).astype(np.uint8) # Round first and then convert to integer
+        # Converting float64 type ndarray to uint8
+        intImage = np.around(avgImg).astype(np.uint8) # Round first and then convert to integer
     
-    # Saving the daily average as image
-    im = Image.fromarray(intImage)
+        # Saving the daily average as image
+        im = Image.fromarray(intImage)
     
-    # Define path for saving image with given file name 
-    saveDst = imgSave + '\\' + "_".join(os.listdir(imgDir)[0].split("_")[:3]) + '_RGB_L2_daily.jpg'
+        # Define path for saving image with given file name 
+        saveDst = imgSave + '\\' + "_".join(os.listdir(imgDir)[0].split("_")[:3]) + '_RGB_L2_daily.jpg'
     
-    # Save image in the defined path
-    im.save(saveDst)
+        # Save image in the defined path
+        im.save(saveDst)
     
-print ('\n')
-print ('Daily averaged RGB images are computed and stored successfully.')
+    print ('\n')
+    print ('Daily averaged RGB images are computed and stored successfully.')
 
-###############################################################################################################
-###############################################################################################################
+    ###############################################################################################################
+    ###############################################################################################################
     
-# 3rd part
-# Delete pre-created DOY folders and files after finishing the processing  
-shutil.rmtree(baseDst)
+    # 3rd part
+    # Delete pre-created DOY folders and files after finishing the processing  
+    shutil.rmtree(baseDst)
 
-print ('\n')
-print ('Computing daily GCC and RCC images...')
+    print ('\n')
+    print ('Computing daily GCC and RCC images...')
 
-###############################################################################################################
-###############################################################################################################
+    ###############################################################################################################
+    ###############################################################################################################
 
-# 4th part
-# Code to generate daily GCC and RCC as an image
+    # 4th part
+    # Code to generate daily GCC and RCC as an image
 
-# Save daily GCC and RCC image
-gccSave = imgSrc + '\{}'.format(dgcc)
-rccSave = imgSrc + '\{}'.format(drcc)
+    # Save daily GCC and RCC image
+    gccSave = imgSrc + '\{}'.format(dgcc)
+    rccSave = imgSrc + '\{}'.format(drcc)
 
-# Iterating all daily average images to compute GCC and RCC on a pixel by pixel basis
-for img in sorted(glob.glob(os.path.join(imgSave, '*.jpg'))):
+    # Iterating all daily average images to compute GCC and RCC on a pixel by pixel basis
+    for img in sorted(glob.glob(os.path.join(imgSave, '*.jpg'))):
     
-    # Extracting image file name
-    imgName = os.path.basename(img)
+        # Extracting image file name
+        imgName = os.path.basename(img)
 
-    # Reading image one by one
-    cv_img = cv2.imread(img)
+        # Reading image one by one
+        cv_img = cv2.imread(img)
     
-    # Extracting RGB bands as a separate numpy array
-    B = cv_img[:,:,0]
-    G = cv_img[:,:,1]
-    R = cv_img[:,:,2]
+        # Extracting RGB bands as a separate numpy array
+        B = cv_img[:,:,0]
+        G = cv_img[:,:,1]
+        R = cv_img[:,:,2]
       
-    # Element wise addition of BGR array to calculate Total DN values in RGB band (i.e. R+G+B) 
-    DNtotal = cv_img.sum(axis = 2)
+        # Element wise addition of BGR array to calculate Total DN values in RGB band (i.e. R+G+B) 
+        DNtotal = cv_img.sum(axis = 2)
     
-    # Compute pixel wise GCC and RCC from daily average images
-    gcc = np.divide(G, DNtotal)
-    rcc = np.divide(R, DNtotal)
+        # Compute pixel wise GCC and RCC from daily average images
+        gcc = np.divide(G, DNtotal)
+        rcc = np.divide(R, DNtotal)
     
-    # Convert NAN to zero
-    arr1 = np.nan_to_num(gcc, copy=False)
-    arr2 = np.nan_to_num(rcc, copy=False)
+        # Convert NAN to zero
+        arr1 = np.nan_to_num(gcc, copy=False)
+        arr2 = np.nan_to_num(rcc, copy=False)
     
-    # Converting GCC and RCC to smoothly range from 0 - 255 as 'uint8' data type from 'float64'
-    intImage1 = (arr1 * 255).astype(np.uint8) 
-    intImage2 = (arr2 * 255).astype(np.uint8)
+        # Converting GCC and RCC to smoothly range from 0 - 255 as 'uint8' data type from 'float64'
+        intImage1 = (arr1 * 255).astype(np.uint8) 
+        intImage2 = (arr2 * 255).astype(np.uint8)
     
-    # Define path for saving image with given file name 
-    saveGCC = gccSave + '\\' + imgName.replace('RGB','GCC')
-    saveRCC = rccSave + '\\' + imgName.replace('RGB','RCC')
+        # Define path for saving image with given file name 
+        saveGCC = gccSave + '\\' + imgName.replace('RGB','GCC')
+        saveRCC = rccSave + '\\' + imgName.replace('RGB','RCC')
     
-    # Save in the defined path as a grayscale image
-    cv2.imwrite(saveGCC, intImage1)  
-    cv2.imwrite(saveRCC, intImage2)
+        # Save in the defined path as a grayscale image
+        cv2.imwrite(saveGCC, intImage1)  
+        cv2.imwrite(saveRCC, intImage2)
+        
+        # Append the daily composites to the datacube
+        if saveDatacube:
+            addToCube(imgName, cv_img, intImage1, intImage2)
         
+
+else:
+    
+    # Percentile composites
+    # Group the images by acquisition date without copying them to DOY folders
+    dayFiles = {}
+    for img in imgList:
+        dayKey = "_".join(os.path.basename(img).split("_")[:3])
+        dayFiles.setdefault(dayKey, []).append(img)
+    
+    print ('\n')
+    print ('Computing daily {}th percentile images................................................'.format(pctValue))
+    
+    # Path definition to save the daily percentile images
+    rgbSave = os.path.join(imgSrc, drgb)
+    gccSave = os.path.join(imgSrc, dgcc)
+    rccSave = os.path.join(imgSrc, drcc)
+    
+    # Arguments for each day: image list, memory-mapped stack (if needed) and output file names
+    dayArgs = []
+    for dayKey in sorted(dayFiles):
+        dayArgs.append((dayFiles[dayKey], 
+                        os.path.join(baseDst, dayKey + '.npy'),
+                        os.path.join(rgbSave, dayKey + '_RGB' + prodExt + '.jpg'),
+                        os.path.join(gccSave, dayKey + '_GCC' + prodExt + '.jpg'),
+                        os.path.join(rccSave, dayKey + '_RCC' + prodExt + '.jpg')))
+    
+    # Process the days in parallel, at most nbrWorkers days at a time
+    with ThreadPoolExecutor(max_workers = nbrWorkers) as pool:
+        for saved, rgbImg, gccImg, rccImg in windowMap(pool, dailyPercentile, dayArgs, nbrWorkers):
+            if saved is None:
+                continue
+            
+            print ('Saved {}'.format(os.path.basename(saved)))
+            
+            # Append the daily composites to the datacube (in date order)
+            if saveDatacube:
+                addToCube(os.path.basename(saved), rgbImg, gccImg, rccImg)
+    
+    # Delete the folder used for the memory-mapped stacks
+    shutil.rmtree(baseDst)
+    
+# Write the remaining days to the datacube and remove the buffer
+if cube is not None:
+    flushCube()
+    cube.close()
+    removeCubeBuffer()
+    
+    print ('\n')
+    print ('Daily composites are appended to the datacube {}'.format(cubePath))
+    
 print ('\n')
-print ('Daily averaged GCC and RCC images are computed and stored successfully.')
+print ('Daily {} GCC and RCC images are computed and stored successfully.'.format(
+       'averaged' if compositeMethod == 'mean' else '{}th percentile'.format(pctValue)))
 print ('Check the image directory to see the derived products.')
     
 ###############################################################################################################
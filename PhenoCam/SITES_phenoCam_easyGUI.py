@@ -7,7 +7,7 @@ lapse PhenoCam images.
 
 The script will export the results in the same path as that of the original pictures. The time series
 data are exported as .csv file with all the time series metrics within a folder 'CSV'. The plot of the
-VIs are exported as a .png file within a folder called 'Graph'. The user defined ROI will be exported
+VIs are exported as a .jpg file within a folder called 'Graph'. The user defined ROI will be exported
 as a ROI map in the same directory.
 
 Note: The script was tested on Windows environment in Python 3.7.6 version only. This script is only 
@@ -27,9 +27,12 @@ Instructions for running the script:
        For example: SWE-LON-SFA-P01_20220101_001_1020.jpg
        General: Country-Station-Location-PhenoCam_YYMMDD_DOY_HHMM
        
-    d) Make sure the images are of same dimensions (For eg: 3072*2048)
-    e) Create a new folder named 'SnowyImage' within the image directory and move all snowy images to
-       this newly created folder. In case of no snowy images in the year, skip this step.
+    d) Make sure the images are of same dimensions (For eg: 3072*2048). Run SITES_phenoCam_imageCheck.py to
+       find defective (truncated or empty) images before the run; images in its quarantine list are skipped.
+    e) Snowy images are tagged automatically (see SITES_phenoCam_utils.py). To correct the automatic 
+       tagging, list the images in a file 'snowOverride.csv' (columns: Image, Snow with 1 for snow and
+       0 for no snow) within the image directory. Images in an old 'SnowyImage' folder are still used 
+       and tagged as snowy.
     f) Run Anaconda Prompt or general Terminal where you can locate the installed Python.
     g) Use the following command to run (Give complete path to where your script is located):
     
@@ -37,6 +40,15 @@ Instructions for running the script:
                 
     h) Follow the instructions displayed on the Terminal screen once you run the script.
     i) When drawing ROIs left click to draw vertices and right click to complete the ROI.
+    j) With previewMode = True, a provisional time series of GCC and RCC computed from one downscaled image
+       per day (cached in the folder 'Thumbnails', so only the first run reads the images) is shown within
+       seconds after drawing the ROI. Answer 'n' in the Terminal to draw a new ROI, or 'y' to process all 
+       images at full resolution. The images are then processed in a background thread and the preview is
+       refined step by step with the full resolution daily averages (every refreshDays processed days), while 
+       the preview window stays responsive.
+    k) With useRegistryROI = True, the ROI of the phenoCam in the ROI registry (SITES_phenoCam_ROIregistry.json)
+       is used as first ROI, so that drawing is only needed for phenoCams without ROI in the registry or to
+       try a new ROI (answer 'n' to the preview question).
 
 Limitations of the script:
     a) Script can only take .jpg images as input.
@@ -61,17 +73,35 @@ For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
 ###############################################################################################################
 import os
 import cv2
-import glob
+import queue
 import random
 import calendar
 import datetime
 import statistics
+import threading
 import numpy as np
 import pandas as pd
 from roipoly import RoiPoly
 from scipy import stats as s
 from datetime import datetime as dt
 from matplotlib import pyplot as plt
+from SITES_phenoCam_utils import imageList, snowStats, isSnowy, readSnowOverride, plotL3
+from SITES_phenoCam_utils import dailyThumbnails, thumbnailIndices, roiPolygon
+
+###############################################################################################################
+# Parameter setting section
+###############################################################################################################
+# Set True to show a provisional time series of GCC and RCC from daily thumbnails right after drawing the ROI.
+# The full resolution images are then processed in the background and the preview is refined with their daily
+# averages every refreshDays processed days.
+previewMode = True
+
+# Number of processed days between two updates of the preview
+refreshDays = 10
+
+# Set True to start with the ROI of the ROI registry (ROI number roiNbr) instead of drawing one
+useRegistryROI = True
+roiNbr = 1
 
 ###############################################################################################################
 # Get time now. This helps to compute total elapsed time for running the code.
@@ -84,46 +114,97 @@ start = dt.now()
 # Select one random image from the user defined directory
 thePath = input('Enter the path where the PhenoCam images are stored: ')
 
+# All images of the directory (including the images in the old 'SnowyImage' folder)
+imgList = imageList(thePath)
+
 # Random selection of one image from the user defined directory
-roiImg = thePath + '\\' + random.choice(os.listdir(thePath))
+roiImg = random.choice(imgList)
 
 # Extract image name, station name, year
 imName = os.path.basename(roiImg)
 stnName = imName.split('_')[0]
 yyyy = int(imName.split('_')[1][0:4])
 
-# Display image on which you want to draw a region of interest
-im = cv2.imread(roiImg)
-plt.rcParams['figure.figsize'] = (16,8)
-
-# Display the image
-fig = plt.figure()
-plt.imshow(cv2.cvtColor(im, cv2.COLOR_BGR2RGB))
-plt.title("Left click: Line segment     Right click: Complete ROI", fontsize = 20)
-plt.show(block=False)
-
-# Draw a polygon within the displayed image by clicking with the left mouse button to select the 
-# vertices of the polygon. To close the polygon, click with the right mouse button.
-user_roi = RoiPoly(color='r', fig = fig) 
+# One thumbnail per day for the instant preview (cached in the folder 'Thumbnails' of the image directory)
+if previewMode:
+    print('\n')
+    print('Preparing the daily thumbnails for the instant preview......................')
+    thumbs = dailyThumbnails(imgList, thePath)
 
-print('\n')
-print('User input for region of interest (ROI) is completed.')
-
-###############################################################################################################
-# Get ROI coordinates and round off to nearest 10 and use this to extract DN values per channel
-###############################################################################################################
-# Get the ROI coordinates [(x1, y1), (x2, y2), …]
-roi_coordinates = user_roi.get_roi_coordinates()
+# ROI of the registry valid for the date and size of the image (None if there is none)
+im = cv2.imread(roiImg)
+roiList = roiPolygon(imName, im.shape[1], im.shape[0], roiNbr) if useRegistryROI else None
 
-# Empty list to store ROI Coordinates
-roiList = []
+if roiList is not None:
+    print('\n')
+    print('Using ROI {} of the ROI registry for {}.'.format(roiNbr, stnName))
+    roiList = roiList.tolist()
 
-# Iterate through the list of ROI coordinates and round off to nearest 10s
-for tuples in roi_coordinates:
-    tempList = [int(round(x, -1)) for x in tuples]
+# Draw the ROI until the user is satisfied with the preview of the time series
+while True:
+    
+    # Display image on which you want to draw a region of interest
+    im = cv2.imread(roiImg)
+    plt.rcParams['figure.figsize'] = (16,8)
+    
+    # Draw a new ROI if there is none yet (no ROI in the registry or the previous ROI was rejected)
+    if roiList is None:
+        
+        # Display the image
+        fig = plt.figure()
+        plt.imshow(cv2.cvtColor(im, cv2.COLOR_BGR2RGB))
+        plt.title("Left click: Line segment     Right click: Complete ROI", fontsize = 20)
+        plt.show(block=False)
+    
+        # Draw a polygon within the displayed image by clicking with the left mouse button to select the 
+        # vertices of the polygon. To close the polygon, click with the right mouse button.
+        user_roi = RoiPoly(color='r', fig = fig) 
+    
+        print('\n')
+        print('User input for region of interest (ROI) is completed.')
+    
+        #######################################################################################################
+        # Get ROI coordinates and round off to nearest 10 and use this to extract DN values per channel
+        #######################################################################################################
+        # Get the ROI coordinates [(x1, y1), (x2, y2), …]
+        roi_coordinates = user_roi.get_roi_coordinates()
+    
+        # Empty list to store ROI Coordinates
+        roiList = []
+    
+        # Iterate through the list of ROI coordinates and round off to nearest 10s
+        for tuples in roi_coordinates:
+            tempList = [int(round(x, -1)) for x in tuples]
+        
+            # Append the tempList values to roiList
+            roiList.append(tempList)
     
-    # Append the tempList values to roiList
-    roiList.append(tempList)
+    if not previewMode:
+        break
+    
+    ###########################################################################################################
+    # Instant preview: provisional time series of GCC and RCC from the daily thumbnails
+    ###########################################################################################################
+    preview = thumbnailIndices(thumbs, roiList)
+    
+    previewFig, (axGCC, axRCC) = plt.subplots(2, 1, sharex = True)
+    axGCC.plot(preview.index, preview['GCC'], 'o', color = 'grey', markersize = 4, label = 'Preview (thumbnails)')
+    axRCC.plot(preview.index, preview['RCC'], 'o', color = 'grey', markersize = 4, label = 'Preview (thumbnails)')
+    axGCC.set_ylabel('GCC', fontsize = 16)
+    axRCC.set_ylabel('RCC', fontsize = 16)
+    axGCC.legend(loc = 'upper left')
+    axGCC.set_title('Provisional time series of the ROI from daily thumbnails', fontsize = 16)
+    plt.show(block=False)
+    plt.pause(0.1)
+    
+    answer = input('Keep this ROI and start the full resolution processing? (y/n): ')
+    
+    if answer.strip().lower() != 'n':
+        break
+    
+    # Draw a new ROI
+    roiList = None
+    plt.close('all')
 
 ###############################################################################################################
 # Automatically creating folders in the current working directory to save results 
@@ -146,26 +227,16 @@ print('Created new folders to store the vegetation metrics and plots.')
 pts1 = np.array(roiList) 
 cv2.polylines(im, np.int32([pts1]), 1, (0, 0, 255), 5)
     
-# OpenCV represents image in reverse order BGR; so convert it to appear in RGB mode and plot it
-plt.rcParams['figure.figsize'] = (16,8)
-plt.figure(0)
-plt.axis('on')
-plt.imshow(cv2.cvtColor(im, cv2.COLOR_BGR2RGB))
-
 # Saving the user drawn ROI as a map in the current working directory
-plt.savefig(os.path.join(thePath + r'\Graph\ROI_Map.png'), dpi = 300)
+cv2.imwrite(os.path.join(thePath + r'\Graph\ROI_Map.png'), im)
 
 print('\n')
 print('Exported user defined ROI as a ROI map in the newly created folder (i.e. Graphs).')
 
 ###############################################################################################################
-# Empty lists to store the corresponding vegetation indices value
+# Empty dictionaries to store the corresponding vegetation indices value
 ###############################################################################################################
 
-GCC = []
-RCC = []
-DOY = []
-
 # Empty dictionary to store DOY, GCC as key, value pairs
 GCCdict1day = {}
 RCCdict1day = {}
@@ -182,7 +253,7 @@ SnowdictTag = {}
 pathVI = os.path.join(thePath + r'\CSV\VI_allImage.txt')
 
 # Headers definition
-heading = "Image DOY Red_ROI1 Green_ROI1 Blue_ROI1 GCC_ROI1 RCC_ROI1 Snow"
+heading = "Image DOY Red_ROI1 Green_ROI1 Blue_ROI1 GCC_ROI1 RCC_ROI1 Snow SnowFrac_ROI1 SnowFrac_IMG"
 
 # Open a file for storing image metrics
 f1 = open(pathVI, 'w')
@@ -202,159 +273,153 @@ cv2.fillPoly(mask, np.int32([pts1]), (255,255,255))
 print('\n')
 print('Reading images and computing the time series of GCC and RCC......................')
 
-# Iterating through the images
-for img in sorted(glob.glob(os.path.join(thePath, '*.jpg'))):
+###############################################################################################################
+# Full resolution processing of the images
+# With previewMode the images are processed in a worker thread, while the main thread keeps the preview window 
+# responsive and refines the preview with the daily averages sent by the worker
+###############################################################################################################
+previewQueue = queue.Queue()
+
+def previewSeries():
+    '''
+    Returns the dates and the daily averages of GCC and RCC of the full resolution images processed so far.
+    '''
+    days = sorted(GCCdict1day)
+    dates = [dt.strptime('{}+{}'.format(yyyy, k), '%Y+%j') for k in days]
+    return dates, [np.mean(GCCdict1day[k]) for k in days], [np.mean(RCCdict1day[k]) for k in days]
+
+def refreshPreview(series):
+    '''
+    Updates the preview with the daily averages of GCC and RCC of the full resolution images (see previewSeries).
+    Only called from the main thread, which owns the preview window.
+    '''
+    dates, gcc, rcc = series
+    lineGCC.set_data(dates, gcc)
+    lineRCC.set_data(dates, rcc)
+    for ax in (axGCC, axRCC):
+        ax.relim()
+        ax.autoscale_view()
+    previewFig.canvas.draw_idle()
+
+def processImages():
+    '''
+    Computes the ROI means, GCC, RCC and the snow tag of all images, writes them to the text file and collects
+    them per day. With previewMode, the daily averages of the days completed so far are put in previewQueue
+    every refreshDays days.
+    '''
+    # Iterating through the images (including the images in the old 'SnowyImage' folder)
+    for img in imgList:
    
-    # Reading image
-    cv_img = cv2.imread(img)
+        # Reading image
+        cv_img = cv2.imread(img)
     
-    # Extracting image file name
-    imgName = os.path.basename(img)
+        # Extracting image file name
+        imgName = os.path.basename(img)
     
-    # Splitting image name to different components
-    splitted = imgName.split('_')
-       
-    # Image acquisition date (month, day and day of year)
-    mm = int(splitted[1][4:6])
-    dd = int(splitted[1][6:])
-    doy = splitted[2]
+        # Skip images that cannot be read (see SITES_phenoCam_imageCheck.py to find them before the run)
+        if cv_img is None:
+            print('Skipping {} (unreadable image).'.format(imgName))
+            continue
     
-    # Append doy to DOY empty list
-    DOY.append(doy)
+        # Splitting image name to different components
+        splitted = imgName.split('_')
+       
+        # Image acquisition day of year
+        doy = splitted[2]
     
-    # Apply the mask and extract the image data within mask only
-    masked = cv2.bitwise_and(cv_img, mask)
+        # Apply the mask and extract the image data within mask only
+        masked = cv2.bitwise_and(cv_img, mask)
     
-    # Splitting RGB image into separate channels
-    B, G, R = cv2.split(masked)
+        # Splitting RGB image into separate channels
+        B, G, R = cv2.split(masked)
 
-    # Finding out the mean DN of RGB bands within ROI 
-    Rm = np.mean(np.ma.masked_equal(R, 0))
-    Gm = np.mean(np.ma.masked_equal(G, 0))
-    Bm = np.mean(np.ma.masked_equal(B, 0))
+        # Finding out the mean DN of RGB bands within ROI 
+        Rm = np.mean(np.ma.masked_equal(R, 0))
+        Gm = np.mean(np.ma.masked_equal(G, 0))
+        Bm = np.mean(np.ma.masked_equal(B, 0))
 
-    # Total mean DN of ROI 
-    TotalDN_ROI = Rm + Gm + Bm
+        # Total mean DN of ROI 
+        TotalDN_ROI = Rm + Gm + Bm
 
-    # Evaluation of visible band based vegetation indices
-    # Green Chromatic Coordinate (GCC)
-    g = round((Gm/(TotalDN_ROI)), 5)
+        # Evaluation of visible band based vegetation indices
+        # Green Chromatic Coordinate (GCC)
+        g = round((Gm/(TotalDN_ROI)), 5)
     
-    # Red Chromatic Coordinate
-    r = round((Rm/(TotalDN_ROI)), 5)    
+        # Red Chromatic Coordinate
+        r = round((Rm/(TotalDN_ROI)), 5)    
     
-    # Snow tag
-    snow = 200 # Absence of snow
+        # Automatic snow classification from the image already read, unless corrected in the override file
+        stats = snowStats(cv_img, mask)
+        snowy = snowOverride.get(imgName, isSnowy(stats))
     
-    # Appending GCC values
-    GCC.append(g)
-    RCC.append(r)
+        # Snow tag
+        snow = 100 if snowy else 200 # Presence (100) or absence (200) of snow
     
-    # Time series of vegetation indices saved as a text file
-    f1.write('{} {} {} {} {} {} {} {}\n'.format(imgName, doy, Rm, Gm, Bm, g, r, snow))
+        # Time series of vegetation indices saved as a text file
+        f1.write('{} {} {} {} {} {} {} {} {} {}\n'.format(imgName, doy, Rm, Gm, Bm, g, r, snow, 
+                 stats['SnowFrac_ROI'], stats['SnowFrac_IMG']))
     
-    # Update dictionary with DOY and its associated GCC and RCC values
-    if doy in GCCdict1day:
-        GCCdict1day[doy].append(g)
-        RCCdict1day[doy].append(r)
-        Reddict1day[doy].append(Rm)
-        Grndict1day[doy].append(Gm)
-        Bludict1day[doy].append(Bm)
-        SnowdictTag[doy].append(snow)
-        
-    else:
-        GCCdict1day[doy] = [g]
-        RCCdict1day[doy] = [r]
-        Reddict1day[doy] = [Rm]
-        Grndict1day[doy] = [Gm]
-        Bludict1day[doy] = [Bm]
-        SnowdictTag[doy] = [snow]
-    
-###############################################################################################################
-# Script handles the computation of snow covered PhenoCam images separately.
-# The script runs without any problem if there are no any snow covered images
-###############################################################################################################     
-# Empty list to store snow covered image GCC and its respective DOY
-doySnow = []
-gccSnow = []
-rccSnow = []
-solSnow = []
-
-# Folder path definition for snow covered images        
-snowImg = thePath + r'\SnowyImage'
-
-# Iterating through snow covered images
-for img in sorted(glob.glob(os.path.join(snowImg, '*.jpg'))):
-    
-    # Reading image
-    cv_img = cv2.imread(img)
-    
-    # Extracting image file name
-    imgName = os.path.basename(img)
-    
-    # Splitting image name to different components
-    splitted = imgName.split('_')
-       
-    # Image acquisition date (month, day and day of year)
-    mm = int(splitted[1][4:6])
-    dd = int(splitted[1][6:])
-    doy = splitted[2]
+        # Send the full resolution daily averages of the days completed so far to the preview
+        if previewMode and doy not in GCCdict1day and len(GCCdict1day) % refreshDays == 0:
+            previewQueue.put(previewSeries())
     
-    # Append doy to DOY empty list
-    DOY.append(doy)
+        # Update dictionary with DOY and its associated GCC and RCC values
+        if doy in GCCdict1day:
+            GCCdict1day[doy].append(g)
+            RCCdict1day[doy].append(r)
+            Reddict1day[doy].append(Rm)
+            Grndict1day[doy].append(Gm)
+            Bludict1day[doy].append(Bm)
+            SnowdictTag[doy].append(snow)
         
-    # Apply the mask and extract the image data within mask only
-    masked = cv2.bitwise_and(cv_img, mask)
+        else:
+            GCCdict1day[doy] = [g]
+            RCCdict1day[doy] = [r]
+            Reddict1day[doy] = [Rm]
+            Grndict1day[doy] = [Gm]
+            Bludict1day[doy] = [Bm]
+            SnowdictTag[doy] = [snow]
+
+def processWorker(errors):
+    '''
+    Runs processImages in the worker thread and keeps its error (if any) for the main thread.
+    '''
+    try:
+        processImages()
+    except Exception as error:
+        errors.append(error)
+
+# Manual corrections of the automatic snow classification (override files and old 'SnowyImage' folders of
+# the image folders)
+snowOverride = readSnowOverride(imgList, thePath)
+
+if previewMode:
+    lineGCC, = axGCC.plot([], [], 'r^', markersize = 6, mfc = 'none', label = 'Daily Average (full resolution)')
+    lineRCC, = axRCC.plot([], [], 'ro', markersize = 6, mfc = 'none', label = 'Daily Average (full resolution)')
+    axGCC.legend(loc = 'upper left')
     
-    # Splitting RGB image into separate channels
-    B, G, R = cv2.split(masked)
-
-    # Finding out mean DN of RGB bands within ROI 
-    Rm = np.mean(np.ma.masked_equal(R, 0))
-    Gm = np.mean(np.ma.masked_equal(G, 0))
-    Bm = np.mean(np.ma.masked_equal(B, 0))
-
-    # Total mean DN of ROI 
-    TotalDN_ROI = Rm + Gm + Bm
-
-    # Evaluation of visible band based vegetation indices
-    # Green Chromatic Coordinate (GCC)
-    g = round((Gm/(TotalDN_ROI)), 5)
+    # Process the images in the background
+    errors = []
+    worker = threading.Thread(target = processWorker, args = (errors,), daemon = True)
+    worker.start()
     
-    # Red Chromatic Coordinate
-    r = round((Rm/(TotalDN_ROI)), 5)
+    # Handle the events of the preview window and draw the latest daily averages sent by the worker
+    while worker.is_alive():
+        plt.pause(0.2)
+        series = None
+        while not previewQueue.empty():
+            series = previewQueue.get()
+        if series is not None:
+            refreshPreview(series)
     
-    # Snow tag
-    snow = 100 # Presence of snow
+    if errors:
+        raise errors[0]
     
-    # Appending values
-    doySnow.append(doy)
-    gccSnow.append(g)
-    rccSnow.append(r)
-       
-    # Appending GCC and RCC values for the snowy images
-    GCC.append(g)
-    RCC.append(r)
-    
-    # Time series of vegetation indices saved as a text file
-    f1.write('{} {} {} {} {} {} {} {}\n'.format(imgName, doy, Rm, Gm, Bm, g, r, snow))
-    
-    # Update dictionary with DOY and its associated GCC and RCC values
-    if doy in GCCdict1day:
-        GCCdict1day[doy].append(g)
-        RCCdict1day[doy].append(r)
-        Reddict1day[doy].append(Rm)
-        Grndict1day[doy].append(Gm)
-        Bludict1day[doy].append(Bm)
-        SnowdictTag[doy].append(snow)
-        
-    else:
-        GCCdict1day[doy] = [g]
-        RCCdict1day[doy] = [r]
-        Reddict1day[doy] = [Rm]
-        Grndict1day[doy] = [Gm]
-        Bludict1day[doy] = [Bm]
-        SnowdictTag[doy] = [snow]        
+    # Show the full resolution daily averages of all days in the preview
+    refreshPreview(previewSeries())
+    plt.pause(0.001)
+else:
+    processImages()
 
 #Close the file when done 
 f1.close()        
@@ -366,7 +431,7 @@ print('Time series of GCC and RCC computation completed.')
 # Export .txt file as .csv file with all the information   
 ###############################################################################################################
 # Read the .txt file as a dataframe 
-df = pd.read_table(pathVI, delim_whitespace = True)
+df = pd.read_table(pathVI, sep = r'\s+')
 
 # Sort the dataframe in ascending order of DOY
 sortedDF = df.sort_values('Image')
@@ -498,7 +563,7 @@ print('Daily average of GCC and RCC computation completed.')
 # Export .txt file as .csv file with all the information   
 ###############################################################################################################
 # Read the .txt file as a dataframe 
-df = pd.read_table(path_avgGCC, delim_whitespace=True)
+df = pd.read_table(path_avgGCC, sep = r'\s+')
 
 # Export the dataframe as a .csv file
 fileName = os.path.join(thePath + r'\CSV\{}_{}_L3_daily.csv'.format(stnName, yyyy))
@@ -522,43 +587,10 @@ print('\n')
 print('Plotting time series of GCC and RCC.........................................')
 
 ###############################################################################################################
-# Time series of daily averaged vegetation indices plotted against corresponding DOY   
-###############################################################################################################
-# Plotting time series of GCC vegetation index
-plt.figure(1)
-plt.rcParams['figure.figsize'] = (16,8)
-plt.ylim([0.3, 0.45]) 
-plt.plot([int(i) for i in DOY], GCC, 'o', color = 'grey', markersize = 4, alpha = 0.1, 
-         label = 'All image GCC')
-plt.plot([int(i) for i in doySnow], gccSnow, 'o', color = 'cornflowerblue', markersize = 4, alpha = 0.5, 
-         label = 'Snowy image GCC') 
-plt.plot([int(j) for j in sorted(avgGCC.keys())], [avgGCC[x] for x in sorted(avgGCC.keys())], 
-         'r^', markersize = 6, mfc = 'none', label = 'Daily Average')
-plt.xticks(range(0, 365, 10), rotation = 45, fontsize = 16)
-plt.yticks(fontsize = 16) 
-plt.grid(True, alpha = 0.3)
-plt.xlabel('Day of Year (DOY)', fontsize = 20)
-plt.ylabel('Green Chromatic Coordinate (GCC)', fontsize = 20)
-plt.legend(loc = 'upper left', fontsize = 18)
-plt.savefig(os.path.join(thePath + r'\Graph\GCC_daily.jpg'))
-
-# Plotting time series of RCC vegetation index
-plt.figure(2)
-plt.rcParams['figure.figsize'] = (16,8)
-plt.ylim([0.3, 0.45]) 
-plt.plot([int(i) for i in DOY], RCC, 'o', color = 'grey', markersize = 4, alpha = 0.1, 
-         label = 'All image RCC')
-plt.plot([int(i) for i in doySnow], rccSnow, 'o', color = 'cornflowerblue', markersize = 4, alpha = 0.5, 
-         label = 'Snowy image RCC')
-plt.plot([int(j) for j in sorted(avgRCC.keys())], [avgRCC[x] for x in sorted(avgRCC.keys())], 
-         'ro', markersize = 6, mfc = 'none', label = 'Daily Average')
-plt.xticks(range(0, 365, 10), rotation = 45, fontsize = 16)
-plt.yticks(fontsize = 16) 
-plt.grid(True, alpha = 0.3)
-plt.xlabel('Day of Year (DOY)', fontsize = 20)
-plt.ylabel('Red Chromatic Coordinate (RCC)', fontsize = 20)
-plt.legend(loc = 'upper left', fontsize = 18)
-plt.savefig(os.path.join(thePath + r'\Graph\RCC_daily.jpg'))
+# Time series of daily averaged vegetation indices plotted against the date (rendered without display)
+###############################################################################################################
+plotL3(sortedDF, df, os.path.join(thePath + r'\Graph\GCC_daily.jpg'), os.path.join(thePath + r'\Graph\RCC_daily.jpg'), 
+       gccLim = (0.3, 0.45), rccLim = (0.3, 0.45))
 
 print('\n')
 print('Exported GCC and RCC time series data plots to (Graphs) folder in the image directory.')
@@ -578,5 +610,9 @@ print ('\n')
 print ('Total time elapsed: {}'.format(time_taken))
 print ('\n') 
 
+# Keep the preview window open until the user closes it
+if previewMode:
+    plt.show()
+
 ###############################################################################################################
 ###############################################################################################################
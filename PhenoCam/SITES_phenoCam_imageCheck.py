@@ -0,0 +1,225 @@
+"""
+***************************************************************************************************************
+######################################
+Integrity check of PhenoCam images
+
+Created on Wed Oct 21 08:47:15 2026
+######################################
+
+This python script checks all .jpg images below a user defined folder (e.g. the L0 or L1 data of a phenoCam or
+of a whole station) for defective files before they are processed. Truncated or zero byte images are returned
+as None by OpenCV and used to stop the processing steps hours into a run. The files are checked without
+decoding them:
+
+    a) File size    : Zero byte files are defective.
+    b) Markers      : The file must start with the JPEG start of image marker and end with the end of image
+                      marker (truncated files, e.g. from interrupted transfers, have no end of image marker).
+    c) Dimensions   : The image width and height are read from the frame header and must not be zero.
+
+The readable images are then checked for duplicates, i.e. the same frame stored under two names (e.g. by the 
+renaming and copying steps of L0). Duplicates bias the daily averages and cost decoding time:
+
+    d) Exact        : Images with the same content hash (SHA-1 of the file).
+    e) Perceptual   : Images of the same phenoCam and day with (almost) the same difference hash (dHash) of a
+                      downscaled decode and the same small grayscale signature (e.g. the same frame saved
+                      again with other metadata or compression). Nearly uniform images (e.g. dark images) 
+                      are only compared by their content.
+
+Of a group of duplicates, the image first in name order is kept. Two files are written to the checked folder:
+
+    catalog.csv     : One row per image with the folder, file size, modification time, width, height,
+                      status ('OK', 'Empty', 'NotJPEG', 'NoDimensions', 'Truncated' or 'Undecodable'),
+                      content hash, dHash and the name of the kept image for duplicates (column DuplicateOf).
+    quarantine.txt  : The names of all defective images.
+
+The defective and duplicate images are skipped by the L1, L2 and L3 scripts and the easyGUI when the files are
+in the image folder or in a folder above it up to the folder given to the processing step. When the check is
+run on a higher folder (e.g. the whole station), set dataRoot in SITES_phenoCam_utils.py to that folder.
+
+When the check is repeated, only new or modified images (and the other images of their days for perceptual
+duplicates) are checked again. The files are checked in parallel threads (the check is limited by reading from
+the disk).
+
+Note: The script is only for internal use within Swedish Infrastructure for Ecosystem Science (SITES).
+
+Package installations:
+    1) numpy    : pip install numpy
+    2) pandas   : pip install pandas
+    3) Open-CV  : pip install opencv-python
+
+Instructions for running the script:
+    a) Make sure all the required modules are installed.
+    b) Run the script and provide the path to the folder to check (subfolders are checked as well).
+    c) Run the check again after adding new images, before running the processing steps.
+
+Limitations of the script:
+    a) Defects within the compressed image data (e.g. corrupted bytes in the middle of a complete file) are
+       not detected; such images are decoded with artefacts.
+    b) Duplicates with the same name in different folders are not marked, since the images are skipped by
+       name. Process only one of the folders instead.
+
+For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
+                                        lars.eklundh@nateko.lu.se
+
+***************************************************************************************************************
+"""
+###############################################################################################################
+# Module Declaration
+###############################################################################################################
+import os
+import glob
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from SITES_phenoCam_utils import jpegCheck, imageHashes, catalogFile, quarantineFile
+
+###############################################################################################################
+# Parameter setting section
+###############################################################################################################
+
+# Number of parallel threads
+nbrWorkers = 16
+
+# Set True to check the images for duplicates
+findDuplicates = True
+
+# Perceptual duplicates: maximum number of differing dHash bits, maximum mean and maximum absolute difference
+# (DN) of the grayscale signatures, and minimum standard deviation (DN) of the signature to be compared
+dupMaxDistance = 2
+dupMaxMeanDiff = 1.0
+dupMaxDiff = 4
+dupMinContrast = 2.0
+
+###############################################################################################################
+# Get time now. This helps to compute total elapsed time for running the code.
+###############################################################################################################
+start = datetime.now()
+
+# Ask from user the folder to check
+thePath = input('Enter the path of the folder with the images to check: ')
+
+# All images below the folder with their size and modification time
+imgList = sorted(glob.glob(os.path.join(thePath, '**', '*.jpg'), recursive = True))
+files = pd.DataFrame({'Image'   : [os.path.basename(img) for img in imgList],
+                      'Folder'  : [os.path.relpath(os.path.dirname(img), thePath) for img in imgList],
+                      'Bytes'   : [os.path.getsize(img) for img in imgList],
+                      'Modified': [int(os.path.getmtime(img)) for img in imgList]})
+
+###############################################################################################################
+# Reuse the results of the previous check for unchanged images
+###############################################################################################################
+catalogPath = os.path.join(thePath, catalogFile)
+if os.path.exists(catalogPath):
+    previous = pd.read_csv(catalogPath, dtype = {'Folder': str})
+    columns = [col for col in ['Width', 'Height', 'Status', 'SHA1', 'DHash', 'DuplicateOf'] if col in previous]
+    files = files.merge(previous[['Image', 'Folder', 'Bytes', 'Modified'] + columns],
+                        on = ['Image', 'Folder', 'Bytes', 'Modified'], how = 'left')
+
+for col in ['Width', 'Height', 'Status', 'SHA1', 'DHash', 'DuplicateOf']:
+    if col not in files:
+        files[col] = None
+
+toCheck = files.index[files['Status'].isna()]
+
+print ('\n')
+print ('Checking {} of {} images.............'.format(len(toCheck), len(files)))
+
+###############################################################################################################
+# Check the new and modified images in parallel
+###############################################################################################################
+with ThreadPoolExecutor(max_workers = nbrWorkers) as pool:
+    paths = [os.path.join(thePath, files.at[i, 'Folder'], files.at[i, 'Image']) for i in toCheck]
+    results = list(pool.map(jpegCheck, paths))
+
+for i, (nbrBytes, width, height, status) in zip(toCheck, results):
+    files.loc[i, ['Width', 'Height', 'Status']] = [width, height, status]
+
+files['Width'] = files['Width'].astype(int)
+files['Height'] = files['Height'].astype(int)
+
+###############################################################################################################
+# Duplicate images
+###############################################################################################################
+if findDuplicates:
+    
+    # Images of a phenoCam and day (e.g. SWE-RBD-RBD-AGR-P01_20220601), readable images
+    dayKey = files['Image'].str.split('_').str[:2].str.join('_')
+    ok = files['Status'] == 'OK'
+    
+    # Hashes of all images of the days with new or modified images (perceptual duplicates are searched within
+    # a day, so the signatures of the other images of these days are needed as well)
+    newDays = set(dayKey[ok & files['SHA1'].isna()])
+    toHash = files.index[ok & dayKey.isin(newDays)]
+    
+    print ('\n')
+    print ('Computing the hashes of {} images.............'.format(len(toHash)))
+    
+    with ThreadPoolExecutor(max_workers = nbrWorkers) as pool:
+        paths = [os.path.join(thePath, files.at[i, 'Folder'], files.at[i, 'Image']) for i in toHash]
+        hashes = list(pool.map(imageHashes, paths))
+    
+    signatures = {}
+    for i, (sha1, dHash, signature) in zip(toHash, hashes):
+        # Images that cannot be decoded are defective (quarantined like the failed file checks)
+        if sha1 is None:
+            files.at[i, 'Status'] = 'Undecodable'
+            continue
+        
+        files.loc[i, ['SHA1', 'DHash']] = [sha1, dHash]
+        signatures[i] = signature
+    ok = files['Status'] == 'OK'
+    
+    # Perceptual duplicates of the other days are kept from the previous check
+    files['DuplicateOf'] = files['DuplicateOf'].where(files['DuplicateOf'].notna() & ~dayKey.isin(newDays), '')
+    
+    # Exact duplicates: the image first in name order is kept
+    order = files[ok].sort_values(['Image', 'Folder'])
+    kept = order.groupby('SHA1')['Image'].transform('first')
+    exact = kept[kept != order['Image']]
+    files.loc[exact.index, 'DuplicateOf'] = exact
+    
+    # Perceptual duplicates within each new day
+    for day in sorted(newDays):
+        idx = [i for i in order.index if i in signatures and dayKey[i] == day]
+        for n, i in enumerate(idx):
+            if files.at[i, 'DuplicateOf'] or signatures[i].std() < dupMinContrast:
+                continue
+            
+            for j in idx[n + 1:]:
+                if files.at[j, 'DuplicateOf'] or files.at[j, 'Image'] == files.at[i, 'Image']:
+                    continue
+                
+                distance = bin(int(files.at[i, 'DHash'], 16) ^ int(files.at[j, 'DHash'], 16)).count('1')
+                diff = np.abs(signatures[i].astype(np.int16) - signatures[j])
+                if distance <= dupMaxDistance and diff.mean() <= dupMaxMeanDiff and diff.max() <= dupMaxDiff:
+                    files.at[j, 'DuplicateOf'] = files.at[i, 'Image']
+    
+    print ('{} duplicate images are marked in the catalog'.format((files['DuplicateOf'] != '').sum()))
+
+###############################################################################################################
+# Export the catalog and the quarantine list
+###############################################################################################################
+files.to_csv(catalogPath, index = False)
+
+defective = files[files['Status'] != 'OK']
+with open(os.path.join(thePath, quarantineFile), 'w') as f:
+    for imgName in defective['Image']:
+        f.write(imgName + '\n')
+
+print ('\n')
+print ('Status of the images:')
+print (files['Status'].value_counts().to_string())
+print ('\n')
+print ('{} defective images are listed in {}'.format(len(defective), os.path.join(thePath, quarantineFile)))
+
+###############################################################################################################
+# Display total elapsed time
+###############################################################################################################
+end = datetime.now()
+
+print ('\n')
+print ('Time elapsed: {}'.format(end - start))
+
+###############################################################################################################
+###############################################################################################################
@@ -0,0 +1,325 @@
+"""
+***************************************************************************************************************
+######################################
+Phenophase extraction from PhenoCam L3 data
+
+Created on Mon Oct 19 14:25:07 2026
+######################################
+
+This python script smooths the daily GCC time series of all L3 .csv files found below a user defined folder
+(every station, phenoCam, ROI and year) and extracts the following phenophase dates for each series:
+
+    a) SOS  : Start of season, when GCC rises above the base value + sosThres * amplitude
+    b) POS  : Peak of season, day of maximum GCC
+    c) EOS  : End of season, when GCC falls below the base value + eosThres * amplitude
+
+The series are smoothed with a Whittaker smoother (a discrete smoothing spline with second order differences)
+where missing days (NaN) and optionally snow covered days (QFLAG 100) get zero weight. All series are smoothed
+together, as one array operation over the series, so that the multi-year history of all phenoCams is processed
+in one run. The uncertainty of the dates is estimated with a residual bootstrap: the residuals of each series
+are resampled nbrBootstrap times, the resampled series are smoothed again and the standard deviation of the
+dates over the bootstrap series is reported (e.g. SOS_SD).
+
+The phenophase dates (day of year) of all series are exported to a single .csv file in the user defined folder:
+
+    SITES_phenoCam_phenophases_L3.csv
+
+Optionally, the smoothed GCC series are exported to SITES_phenoCam_smoothedGCC_L3.csv in the same folder.
+
+Note: The script is only for internal use within Swedish Infrastructure for Ecosystem Science (SITES).
+
+Package installations:
+    1) numpy    : pip install numpy
+    2) pandas   : pip install pandas
+
+Instructions for running the script:
+    a) Make sure all the required modules are installed.
+    b) Make sure the L3 .csv files are named as per the SITES standard and end with '_L3_daily.csv'.
+    c) Check the parameter setting section for the smoothing, the season thresholds and the bootstrap.
+    d) Run the script and provide the path to the folder containing the L3 data (subfolders are searched).
+
+Limitations of the script:
+    a) Script extracts only one growing season per calendar year.
+    b) Series with fewer than minValidDays valid days are not processed.
+
+For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
+                                        lars.eklundh@nateko.lu.se
+
+***************************************************************************************************************
+"""
+###############################################################################################################
+# Module Declaration
+###############################################################################################################
+import os
+import re
+import glob
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+###############################################################################################################
+# Parameter setting section
+###############################################################################################################
+
+# Smoothing parameter of the Whittaker smoother (higher values give smoother curves)
+smoothLambda = 1000
+
+# Fraction of the amplitude defining start and end of season
+sosThres = 0.25
+eosThres = 0.15
+
+# Minimum number of days with valid GCC for a series to be processed
+minValidDays = 60
+
+# Set True to give zero weight to snow covered days (QFLAG 100)
+excludeSnow = True
+
+# Number of bootstrap series for the uncertainty of the dates (0 skips the uncertainty estimation)
+nbrBootstrap = 100
+
+# Number of bootstrap series smoothed together per series (limits the memory use)
+bootstrapBatch = 20
+
+# Set True to export the smoothed GCC series
+saveSmoothed = True
+
+###############################################################################################################
+# Function definitions
+###############################################################################################################
+
+def whittakerSmooth(y, w, lam):
+    '''
+    Whittaker smoother with second order differences for many series at once. Solves (W + lam*D'D) z = W y
+    for every row of y (series x days) with a banded Cholesky decomposition, looping over the days and
+    operating on all series together. Weights w are zero for missing days.
+    '''
+    nbrSeries, n = y.shape
+
+    # Diagonals of D'D for second order differences
+    d0 = np.full(n, 6.0)
+    d0[[0, -1]] = 1
+    d0[[1, -2]] = 5
+    d1 = np.full(n - 1, -4.0)
+    d1[[0, -1]] = -2
+
+    a0 = w + lam * d0
+    a1 = lam * d1
+    a2 = lam
+
+    # Banded Cholesky decomposition: diagonal (l0) and the two sub-diagonals (l1, l2) of L
+    l0 = np.zeros((nbrSeries, n))
+    l1 = np.zeros((nbrSeries, n))
+    l2 = np.zeros((nbrSeries, n))
+    for i in range(n):
+        v = a0[:, i] - (l1[:, i - 1]**2 if i >= 1 else 0) - (l2[:, i - 2]**2 if i >= 2 else 0)
+        l0[:, i] = np.sqrt(v)
+        if i < n - 1:
+            l1[:, i] = (a1[i] - (l2[:, i - 1] * l1[:, i - 1] if i >= 1 else 0)) / l0[:, i]
+        if i < n - 2:
+            l2[:, i] = a2 / l0[:, i]
+
+    # Forward substitution (L u = W y)
+    b = w * np.nan_to_num(y)
+    u = np.zeros((nbrSeries, n))
+    for i in range(n):
+        u[:, i] = (b[:, i] - (l1[:, i - 1] * u[:, i - 1] if i >= 1 else 0)
+                   - (l2[:, i - 2] * u[:, i - 2] if i >= 2 else 0)) / l0[:, i]
+
+    # Backward substitution (L' z = u)
+    z = np.zeros((nbrSeries, n))
+    for i in range(n - 1, -1, -1):
+        z[:, i] = (u[:, i] - (l1[:, i] * z[:, i + 1] if i < n - 1 else 0)
+                   - (l2[:, i] * z[:, i + 2] if i < n - 2 else 0)) / l0[:, i]
+
+    return z
+
+def phenophases(z, w):
+    '''
+    Extracts start, peak and end of season (0-based day index) and the maximum and the amplitude from the
+    smoothed series z (series x days). Only the period between the first and the last day with non-zero 
+    weight w is used, so that the extrapolated ends of the smoothed series don't affect the base values.
+    '''
+    days = np.arange(z.shape[1])[np.newaxis, :]
+    firstIdx = np.argmax(w > 0, axis = 1)[:, np.newaxis]
+    lastIdx = z.shape[1] - 1 - np.argmax(w[:, ::-1] > 0, axis = 1)[:, np.newaxis]
+    inYear = (days >= firstIdx) & (days <= lastIdx)
+
+    # Peak and base values on both sides of the peak
+    maxIdx = np.argmax(np.where(inYear, z, -np.inf), axis = 1)[:, np.newaxis]
+    maxVal = np.take_along_axis(z, maxIdx, axis = 1)
+    leftZ = np.where(inYear & (days <= maxIdx), z, np.inf)
+    rightZ = np.where(inYear & (days >= maxIdx), z, np.inf)
+    leftMin = leftZ.min(axis = 1, keepdims = True)
+    rightMin = rightZ.min(axis = 1, keepdims = True)
+    leftMinIdx = leftZ.argmin(axis = 1)[:, np.newaxis]
+    rightMinIdx = rightZ.argmin(axis = 1)[:, np.newaxis]
+
+    # Start of season: first day between the left minimum and the peak above the threshold
+    sosMask = (days >= leftMinIdx) & (days <= maxIdx) & (z >= leftMin + sosThres * (maxVal - leftMin))
+    sosIdx = np.argmax(sosMask, axis = 1)
+
+    # End of season: last day between the peak and the right minimum above the threshold
+    eosMask = (days >= maxIdx) & (days <= rightMinIdx) & (z >= rightMin + eosThres * (maxVal - rightMin))
+    eosIdx = z.shape[1] - 1 - np.argmax(eosMask[:, ::-1], axis = 1)
+
+    return sosIdx, maxIdx[:, 0], eosIdx, maxVal[:, 0], (maxVal - (leftMin + rightMin) / 2)[:, 0]
+
+def seriesInfo(fileName):
+    '''
+    Returns station, location and phenoCam from L3 file names such as
+    SITES_P01-GCC-RCC_RBD_RBD_20220101-20221231_L3_daily.csv or SWE-RBD-RBD-AGR-P01_2022_L3_daily.csv
+    '''
+    splitted = os.path.basename(fileName).split('_')
+    if splitted[0] == 'SITES':
+        return splitted[2], splitted[3], splitted[1].split('-')[0]
+    else:
+        splitStn = splitted[0].split('-')
+        return splitStn[1], splitStn[2], splitStn[-1]
+
+###############################################################################################################
+# Get time now. This helps to compute total elapsed time for running the code.
+###############################################################################################################
+start = datetime.now()
+
+# Define file path of the folder containing the L3 data
+thePath = input('Enter the path where the L3 .csv files are stored: ')
+
+###############################################################################################################
+# Read all L3 files and arrange the GCC series (per ROI and year) as rows of one array
+###############################################################################################################
+l3Files = sorted(glob.glob(os.path.join(thePath, '**', '*_L3_daily.csv'), recursive = True))
+
+print ('\n')
+print ('Found {} L3 files. Reading the GCC time series.....................'.format(len(l3Files)))
+
+# Series information, GCC and weights for all series (366 days per series)
+info = []
+gccAll = []
+wgtAll = []
+
+for file in l3Files:
+
+    # Read the L3 file and remove the row with units if there is any
+    df = pd.read_csv(file, na_values = ['NaN'])
+    df = df[df['TIMESTAMP'] != 'YYYY-MM-DD']
+    df['TIMESTAMP'] = pd.to_datetime(df['TIMESTAMP'])
+
+    stn, loc, cam = seriesInfo(file)
+
+    # All ROIs in the file
+    rois = [re.match(r'GCC_ROI_(\d+)$', col).group(1) for col in df.columns if re.match(r'GCC_ROI_(\d+)$', col)]
+
+    # Each calendar year is one series
+    for yyyy, dfYear in df.groupby(df['TIMESTAMP'].dt.year):
+
+        doy = dfYear['TIMESTAMP'].dt.dayofyear.values - 1
+
+        for roi in rois:
+            gcc = np.full(366, np.nan)
+            gcc[doy] = pd.to_numeric(dfYear['GCC_ROI_' + roi], errors = 'coerce').values
+
+            # Zero weight for missing days and optionally for snow covered days
+            wgt = (~np.isnan(gcc)).astype(float)
+            if excludeSnow and ('QFLAG_ROI_' + roi) in dfYear:
+                wgt[doy[pd.to_numeric(dfYear['QFLAG_ROI_' + roi], errors = 'coerce').values == 100]] = 0
+
+            if wgt.sum() < minValidDays:
+                print ('Skipping {} ROI {} {} (only {} valid days).'.format(os.path.basename(file), roi, yyyy, int(wgt.sum())))
+                continue
+
+            info.append({'File': os.path.basename(file), 'Station': stn, 'Location': loc, 'PhenoCam': cam,
+                         'ROI': int(roi), 'Year': yyyy, 'NOBS': int(wgt.sum()),
+                         'NbrDays': 366 if pd.Timestamp(yyyy, 12, 31).dayofyear == 366 else 365})
+            gccAll.append(gcc)
+            wgtAll.append(wgt)
+
+if not info:
+    raise SystemExit('No L3 series with enough valid days found in {}'.format(thePath))
+
+gccAll = np.array(gccAll)
+wgtAll = np.array(wgtAll)
+
+###############################################################################################################
+# Smoothing and phenophase extraction for all series
+###############################################################################################################
+print ('\n')
+print ('Smoothing {} GCC series and extracting phenophases.....................'.format(len(info)))
+
+smooth = whittakerSmooth(gccAll, wgtAll, smoothLambda)
+sosIdx, posIdx, eosIdx, maxVal, ampl = phenophases(smooth, wgtAll)
+
+resDF = pd.DataFrame(info).drop(columns = 'NbrDays')
+resDF['SOS'] = sosIdx + 1
+resDF['POS'] = posIdx + 1
+resDF['EOS'] = eosIdx + 1
+resDF['GCC_MAX'] = np.round(maxVal, 5)
+resDF['GCC_AMPL'] = np.round(ampl, 5)
+
+###############################################################################################################
+# Uncertainty of the phenophase dates with residual bootstrap
+###############################################################################################################
+if nbrBootstrap > 0:
+
+    print ('\n')
+    print ('Estimating uncertainty with {} bootstrap series per series.............'.format(nbrBootstrap))
+
+    rng = np.random.default_rng(0)
+    valid = wgtAll > 0
+    nbrValid = valid.sum(axis = 1)
+
+    # Residuals of the valid days moved to the start of each row for resampling
+    resid = np.where(valid, gccAll - smooth, 0)
+    order = np.argsort(~valid, axis = 1, kind = 'stable')
+    residPacked = np.take_along_axis(resid, order, axis = 1)
+
+    bootDates = {'SOS': [], 'POS': [], 'EOS': []}
+    for b0 in range(0, nbrBootstrap, bootstrapBatch):
+        nbrB = min(bootstrapBatch, nbrBootstrap - b0)
+
+        # Resample the residuals of each series and add them to the smoothed series
+        pick = (rng.random((nbrB,) + gccAll.shape) * nbrValid[:, np.newaxis]).astype(int)
+        yBoot = smooth + np.take_along_axis(np.broadcast_to(residPacked, pick.shape), pick, axis = 2)
+
+        wBoot = np.tile(wgtAll, (nbrB, 1))
+        zBoot = whittakerSmooth(yBoot.reshape(-1, 366), wBoot, smoothLambda)
+        sosB, posB, eosB, _, _ = phenophases(zBoot, wBoot)
+
+        bootDates['SOS'].append(sosB.reshape(nbrB, -1))
+        bootDates['POS'].append(posB.reshape(nbrB, -1))
+        bootDates['EOS'].append(eosB.reshape(nbrB, -1))
+
+    for key in bootDates:
+        resDF[key + '_SD'] = np.round(np.concatenate(bootDates[key]).std(axis = 0), 1)
+
+    # Same column order as the dates
+    resDF = resDF[list(resDF.columns[:7]) + ['SOS', 'SOS_SD', 'POS', 'POS_SD', 'EOS', 'EOS_SD', 'GCC_MAX', 'GCC_AMPL']]
+
+###############################################################################################################
+# Export the phenophase dates and optionally the smoothed series
+###############################################################################################################
+fileName = os.path.join(thePath, 'SITES_phenoCam_phenophases_L3.csv')
+resDF.to_csv(fileName, index = False)
+
+if saveSmoothed:
+    smoothDF = []
+    for idx, i in enumerate(info):
+        dates = pd.date_range('{}-01-01'.format(i['Year']), periods = i['NbrDays'])
+        smoothDF.append(pd.DataFrame({'File': i['File'], 'ROI': i['ROI'], 'TIMESTAMP': dates.strftime('%Y-%m-%d'),
+                                      'GCC': gccAll[idx, :i['NbrDays']],
+                                      'GCC_SMOOTH': np.round(smooth[idx, :i['NbrDays']], 5)}))
+
+    pd.concat(smoothDF).to_csv(os.path.join(thePath, 'SITES_phenoCam_smoothedGCC_L3.csv'), index = False, na_rep = 'NaN')
+
+print ('\n')
+print ('Phenophase dates of {} series are exported to {}'.format(len(resDF), fileName))
+
+###############################################################################################################
+# Display total elapsed time
+###############################################################################################################
+end = datetime.now()
+
+print ('\n')
+print ('Time elapsed: {}'.format(end - start))
+
+###############################################################################################################
+###############################################################################################################
@@ -0,0 +1,268 @@
+"""
+***************************************************************************************************************
+######################################
+Per-pixel phenology from PhenoCam L2 data
+
+Created on Mon Oct 19 09:12:40 2026
+######################################
+
+This python script derives per-pixel phenology metrics from the daily GCC composites stored in the L2 datacube
+(see saveDatacube in SITES_phenoCam_dailyAvg_L2.py). For a chosen year, the daily GCC time series of every
+pixel is gap filled, smoothed with a Savitzky-Golay filter and the following metrics are extracted:
+
+    a) SOSD : Start of season date, when GCC rises above the base value + sosThres * amplitude
+    b) EOSD : End of season date, when GCC falls below the base value + eosThres * amplitude
+    c) MAXD : Date of the maximum (peak) GCC
+    d) MAXV : Maximum (peak) GCC value
+    e) AMPL : Seasonal amplitude of GCC (maximum - base value)
+    f) NOBS : Number of days with valid GCC in the year
+
+The metric names, the amplitude thresholds and the date encoding (YYDOY, e.g. 22135 for DOY 135 in 2022, with
+0 as no data) follow the Copernicus HR-VPP seasonal trajectory products (SOSD, EOSD, MAXD, MAXV, AMPL), so that
+the PhenoCam metrics can be directly compared with the HR-VPP layers downloaded for the station. The metrics
+are exported as single band .tif files in the image (camera) coordinates of the phenoCam, in a folder named
+'Phenology' next to the datacube. For example:
+
+    SITES_P01-SOSD_RBD_RBD_2022_pixel.tif
+
+The image is processed in blocks of rows in parallel processes, and every block is handled as one array
+operation over all its pixels. The number of rows in each block is derived from the memory per process
+(blockMemory) and the number of processes is limited (nbrWorkers), so that the memory use stays within that of
+an ordinary station PC.
+
+Note: The script is only for internal use within Swedish Infrastructure for Ecosystem Science (SITES).
+
+Package installations:
+    1) h5py     : pip install h5py
+    2) scipy    : pip install scipy
+    3) numpy    : pip install numpy
+    4) Open-CV  : pip install opencv-python
+
+Instructions for running the script:
+    a) Make sure all the required modules are installed.
+    b) Run SITES_phenoCam_dailyAvg_L2.py with saveDatacube = True for the year(s) of interest.
+    c) Check the parameter setting section for the smoothing and the season thresholds.
+    d) Run the script from the Terminal and provide the path to the datacube and the year to process.
+
+Limitations of the script:
+    a) Script extracts only one growing season per year.
+    b) Script doesn't account for the change in camera field of view (FOV).
+    c) Pixels with fewer than minValidDays valid days are set to no data.
+
+Important information:
+    a) Read more about the HR-VPP seasonal trajectories and phenology parameters:
+       https://land.copernicus.eu/user-corner/technical-library/product-user-manual-of-seasonal-trajectories/
+
+For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
+                                        lars.eklundh@nateko.lu.se
+
+***************************************************************************************************************
+"""
+###############################################################################################################
+# Module Declaration
+###############################################################################################################
+import os
+import cv2
+import h5py
+import datetime
+import numpy as np
+from scipy.signal import savgol_filter
+from concurrent.futures import ProcessPoolExecutor
+
+###############################################################################################################
+# Parameter setting section
+###############################################################################################################
+
+# Savitzky-Golay smoothing window (days, odd number) and polynomial order
+sgWindow = 31
+sgOrder = 2
+
+# Fraction of the amplitude defining start and end of season (as for HR-VPP SOSD and EOSD)
+sosThres = 0.25
+eosThres = 0.15
+
+# Minimum number of days with valid GCC for a pixel to be processed
+minValidDays = 60
+
+# Memory (MB) used by each parallel process for a block of rows (the number of rows in each block is derived
+# from it) and number of parallel processes. Each process holds a full width block over all days of the year.
+blockMemory = 512
+nbrWorkers = min(8, os.cpu_count() or 1)
+
+# Approximate peak memory (bytes) of the block computation per pixel and day
+bytesPerPixelDay = 40
+
+###############################################################################################################
+# Function definitions
+###############################################################################################################
+
+def fillGaps(data):
+    '''
+    Linear interpolation of NaN values along the time axis (axis 0) for all pixels at once. Values before
+    the first and after the last valid day are set to the nearest valid value.
+    '''
+    nbrDays = data.shape[0]
+    valid = ~np.isnan(data)
+
+    # Day indices as int16 (at most 366 days) to keep the full size index arrays small
+    days = np.arange(nbrDays, dtype = np.int16).reshape((-1,) + (1,) * (data.ndim - 1))
+
+    # Index of the previous and the next valid day for every day
+    prevIdx = np.maximum.accumulate(np.where(valid, days, np.int16(0)), axis = 0)
+    nextIdx = np.flip(np.minimum.accumulate(np.flip(np.where(valid, days, np.int16(nbrDays - 1)), axis = 0), axis = 0), axis = 0)
+
+    # Use the first (last) valid day before (after) the valid period
+    firstIdx = np.argmax(valid, axis = 0).astype(np.int16)
+    lastIdx = (nbrDays - 1 - np.argmax(np.flip(valid, axis = 0), axis = 0)).astype(np.int16)
+    prevIdx = np.where(days < firstIdx, firstIdx, prevIdx)
+    nextIdx = np.where(days > lastIdx, lastIdx, nextIdx)
+
+    prevVal = np.take_along_axis(data, prevIdx, axis = 0)
+    nextVal = np.take_along_axis(data, nextIdx, axis = 0)
+
+    # Linear weight between the previous and the next valid day
+    span = (nextIdx - prevIdx).astype(np.float32)
+    weight = np.divide(days - prevIdx, span, out = np.zeros(span.shape, dtype = np.float32), where = span > 0)
+
+    return np.where(valid, data, prevVal + weight * (nextVal - prevVal))
+
+def phenologyBlock(cubePath, dayIdx, doyIdx, nbrDays, r0, r1):
+    '''
+    Computes the phenology metrics for image rows r0 to r1. GCC of the datacube entries dayIdx is placed at
+    the day of year positions doyIdx of a daily series with nbrDays days.
+    '''
+    # Read GCC of the year for the block (only the chunks of these rows are read)
+    with h5py.File(cubePath, 'r') as cube:
+        gccBlock = cube['composite'][dayIdx[0]:dayIdx[-1] + 1, r0:r1, :, 3]
+
+    # Daily series with NaN for missing days, zero GCC is no data
+    gcc = np.full((nbrDays,) + gccBlock.shape[1:], np.nan, dtype = np.float32)
+    gcc[doyIdx] = gccBlock[dayIdx - dayIdx[0]] / np.float32(255)
+    gcc[gcc == 0] = np.nan
+
+    nobs = np.sum(~np.isnan(gcc), axis = 0)
+    valid = nobs >= minValidDays
+
+    # Gap filling and smoothing of all pixel series of the block
+    gcc[:, ~valid] = 0
+    smooth = savgol_filter(fillGaps(gcc), sgWindow, sgOrder, axis = 0)
+
+    # Peak and base values on both sides of the peak
+    days = np.arange(nbrDays).reshape(-1, 1, 1)
+    maxIdx = np.argmax(smooth, axis = 0)
+    maxVal = np.max(smooth, axis = 0)
+    leftSeries = np.where(days <= maxIdx, smooth, np.float32(np.inf))
+    leftMin = np.min(leftSeries, axis = 0)
+    leftMinIdx = np.argmin(leftSeries, axis = 0)
+    del leftSeries
+    rightSeries = np.where(days >= maxIdx, smooth, np.float32(np.inf))
+    rightMin = np.min(rightSeries, axis = 0)
+    rightMinIdx = np.argmin(rightSeries, axis = 0)
+    del rightSeries
+
+    # Start of season: first day between the left minimum and the peak above the threshold
+    sosMask = (days >= leftMinIdx) & (days <= maxIdx) & (smooth >= leftMin + sosThres * (maxVal - leftMin))
+    sosIdx = np.argmax(sosMask, axis = 0)
+
+    # End of season: last day between the peak and the right minimum above the threshold
+    eosMask = (days >= maxIdx) & (days <= rightMinIdx) & (smooth >= rightMin + eosThres * (maxVal - rightMin))
+    eosIdx = nbrDays - 1 - np.argmax(np.flip(eosMask, axis = 0), axis = 0)
+
+    # Amplitude relative to the mean of the two base values (as for HR-VPP AMPL)
+    ampl = maxVal - (leftMin + rightMin) / 2
+
+    # No data for pixels with too few observations or without a season
+    noSeason = ~valid | (ampl <= 0)
+    metrics = {'SOSD': np.where(noSeason, -1, sosIdx),
+               'EOSD': np.where(noSeason, -1, eosIdx),
+               'MAXD': np.where(noSeason, -1, maxIdx),
+               'MAXV': np.where(noSeason, np.nan, maxVal).astype(np.float32),
+               'AMPL': np.where(noSeason, np.nan, ampl).astype(np.float32),
+               'NOBS': nobs.astype(np.uint16)}
+
+    return r0, r1, metrics
+
+###############################################################################################################
+# Main program
+# The guard is needed since the worker processes import this script on Windows
+###############################################################################################################
+if __name__ == '__main__':
+
+    # Get time now. This helps to compute total elapsed time for running the code.
+    start = datetime.datetime.now()
+
+    # Ask from user the datacube and the year to process
+    cubePath = input('Enter complete file path of the L2 datacube (.h5): ')
+    yyyy = int(input('Enter the year to compute the phenology metrics for: '))
+
+    # Datacube information
+    with h5py.File(cubePath, 'r') as cube:
+        dates = cube['date'][:]
+        nrows, ncols = cube['composite'].shape[1:3]
+        camName = cube.attrs['phenoCam']
+
+    # Datacube entries of the chosen year and their day of year positions
+    dayIdx = np.where(dates // 10000 == yyyy)[0]
+    if len(dayIdx) == 0:
+        raise SystemExit('No daily composites for {} in {}'.format(yyyy, cubePath))
+
+    doyIdx = np.array([datetime.datetime.strptime(str(d), '%Y%m%d').timetuple().tm_yday - 1 for d in dates[dayIdx]])
+    nbrDays = 366 if (yyyy % 4 == 0 and yyyy % 100 != 0) or yyyy % 400 == 0 else 365
+
+    # Rows in each block so that a block fits in the memory of a process
+    blockRows = int(max(1, min(nrows, blockMemory * 2**20 // (bytesPerPixelDay * nbrDays * ncols))))
+
+    print ('\n')
+    print ('Found {} daily composites for {}. Computing per-pixel phenology metrics.............'.format(len(dayIdx), yyyy))
+
+    # Empty rasters for the metrics
+    metrics = {'SOSD': np.zeros((nrows, ncols), dtype = np.uint16),
+               'EOSD': np.zeros((nrows, ncols), dtype = np.uint16),
+               'MAXD': np.zeros((nrows, ncols), dtype = np.uint16),
+               'MAXV': np.zeros((nrows, ncols), dtype = np.float32),
+               'AMPL': np.zeros((nrows, ncols), dtype = np.float32),
+               'NOBS': np.zeros((nrows, ncols), dtype = np.uint16)}
+
+    # Process blocks of rows in parallel
+    with ProcessPoolExecutor(max_workers = nbrWorkers) as pool:
+        jobs = [pool.submit(phenologyBlock, cubePath, dayIdx, doyIdx, nbrDays, r0, min(r0 + blockRows, nrows))
+                for r0 in range(0, nrows, blockRows)]
+
+        for job in jobs:
+            r0, r1, blockMetrics = job.result()
+
+            # Dates encoded as YYDOY with 0 as no data (as for the HR-VPP products)
+            for key in ['SOSD', 'EOSD', 'MAXD']:
+                metrics[key][r0:r1] = np.where(blockMetrics[key] < 0, 0, (yyyy % 100) * 1000 + blockMetrics[key] + 1)
+
+            for key in ['MAXV', 'AMPL', 'NOBS']:
+                metrics[key][r0:r1] = blockMetrics[key]
+
+    ###########################################################################################################
+    # Export the metrics as .tif files in the 'Phenology' folder next to the datacube
+    ###########################################################################################################
+    outDir = os.path.join(os.path.dirname(cubePath), 'Phenology')
+    try:
+        os.mkdir(outDir)
+    except:
+        pass
+
+    # Naming convention similar to the L2 products, e.g. SITES_P01-SOSD_RBD_RBD_2022_pixel.tif
+    splitStn = camName.split('-')
+    for key in metrics:
+        fileName = 'SITES_{}-{}_{}_{}_{}_pixel.tif'.format(splitStn[-1], key, splitStn[1], splitStn[2], yyyy)
+        cv2.imwrite(os.path.join(outDir, fileName), metrics[key])
+
+    print ('\n')
+    print ('Per-pixel phenology metrics are exported to {}'.format(outDir))
+
+    ###########################################################################################################
+    # Display total elapsed time
+    ###########################################################################################################
+    end = datetime.datetime.now()
+
+    print ('\n')
+    print ('Time elapsed: {}'.format(end - start))
+
+###############################################################################################################
+###############################################################################################################
@@ -0,0 +1,139 @@
+"""
+***************************************************************************************************************
+######################################
+Plotting of PhenoCam L3 data
+
+Created on Tue Oct 20 09:41:18 2026
+######################################
+
+This python script plots the time series of GCC and RCC for all L3 .csv files found below a user defined folder
+(e.g. the L3 data of all stations). It is the deferred plotting step of SITES_phenoCam_dailyAvgCSV_L3.py
+(plotMode = 'defer') and can be run at any time after the L3 data are created. For each L3 .csv file within a
+folder 'CSV', the per-image metrics are taken from the corresponding allImages .csv file in the same folder
+and the plots are exported to the folder 'Graph' next to the folder 'CSV'. For example:
+
+    CSV\\SITES_P01-GCC-RCC_RBD_RBD_20220101-20221231_L3_daily.csv
+    Graph\\SITES_P01-GCC-RCC_RBD_RBD_20220101-20221231_GCC.jpg
+    Graph\\SITES_P01-GCC-RCC_RBD_RBD_20220101-20221231_RCC.jpg
+
+The figures are rendered without a display (Agg canvas) and the figures of the different L3 files are rendered
+in parallel processes. Dense image layers are decimated (see maxPlotPoints in SITES_phenoCam_utils.py).
+
+Note: The script is only for internal use within Swedish Infrastructure for Ecosystem Science (SITES).
+
+Package installations:
+    1) pandas       : pip install pandas
+    2) matplotlib   : pip install matplotlib
+
+Instructions for running the script:
+    a) Make sure all the required modules are installed.
+    b) Run SITES_phenoCam_dailyAvgCSV_L3.py (or SITES_phenoCam_easyGUI.py) for the data of interest.
+    c) Run the script and provide the path to the folder containing the L3 data (subfolders are searched).
+
+Limitations of the script:
+    a) L3 .csv files without a corresponding allImages .csv file are skipped.
+
+For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
+                                        lars.eklundh@nateko.lu.se
+
+***************************************************************************************************************
+"""
+###############################################################################################################
+# Module Declaration
+###############################################################################################################
+import os
+import glob
+import pandas as pd
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from SITES_phenoCam_utils import plotL3
+
+###############################################################################################################
+# Parameter setting section
+###############################################################################################################
+
+# Number of parallel processes
+nbrWorkers = os.cpu_count() or 1
+
+###############################################################################################################
+# Function definitions
+###############################################################################################################
+
+def allImagesFile(dailyFile):
+    '''
+    Returns the allImages .csv file corresponding to the L3 .csv file, or None if there is none. The GUI
+    names both files after the phenoCam and year (e.g. SWE-RBD-RBD-AGR-P01_2022_L3_daily.csv), L3 names the
+    daily file after the product and date range (e.g. SITES_P01-GCC-RCC_RBD_RBD_20220101-20221231_L3_daily.csv)
+    and the allImages file after the phenoCam and the years (e.g. SWE-RBD-RBD-AGR-P01_2022_allImages.csv).
+    '''
+    csvDir = os.path.dirname(dailyFile)
+    base = os.path.basename(dailyFile)[:-len('_L3_daily.csv')]
+
+    # GUI naming
+    if os.path.exists(os.path.join(csvDir, base + '_allImages.csv')):
+        return os.path.join(csvDir, base + '_allImages.csv')
+
+    # L3 naming
+    parts = base.split('_')
+    if len(parts) != 5 or parts[0] != 'SITES':
+        return None
+
+    camera, stn, loc, dates = parts[1].split('-')[0], parts[2], parts[3], parts[4]
+    years = dates[:4] if dates[:4] == dates[9:13] else dates[:4] + '-' + dates[9:13]
+    candidates = glob.glob(os.path.join(csvDir, '*-{}-{}-*-{}_{}_allImages.csv'.format(stn, loc, camera, years)))
+
+    return candidates[0] if candidates else None
+
+def plotFile(dailyFile):
+    '''
+    Plots the GCC and RCC time series of one L3 .csv file to the folder 'Graph' next to the folder 'CSV'.
+    '''
+    imgFile = allImagesFile(dailyFile)
+    if imgFile is None:
+        return dailyFile, False
+
+    graphDir = os.path.join(os.path.dirname(os.path.dirname(dailyFile)), 'Graph')
+    try:
+        os.mkdir(graphDir)
+    except:
+        pass
+
+    base = os.path.basename(dailyFile)[:-len('_L3_daily.csv')]
+    imgDF = pd.read_csv(imgFile)
+    dailyDF = pd.read_csv(dailyFile, dtype = {'TIMESTAMP': str})
+    plotL3(imgDF, dailyDF, os.path.join(graphDir, base + '_GCC.jpg'), os.path.join(graphDir, base + '_RCC.jpg'))
+
+    return dailyFile, True
+
+###############################################################################################################
+# Main program
+# The guard is needed since the worker processes import this script on Windows
+###############################################################################################################
+if __name__ == '__main__':
+
+    # Get time now. This helps to compute total elapsed time for running the code.
+    start = datetime.now()
+
+    # Ask from user the folder containing the L3 data
+    thePath = input('Enter the path where the L3 data are stored: ')
+    dailyFiles = sorted(glob.glob(os.path.join(thePath, '**', '*_L3_daily.csv'), recursive = True))
+
+    print ('\n')
+    print ('Plotting the time series of {} L3 files.............'.format(len(dailyFiles)))
+
+    # Render the figures of the L3 files in parallel
+    with ProcessPoolExecutor(max_workers = nbrWorkers) as pool:
+        for dailyFile, done in pool.map(plotFile, dailyFiles):
+            if not done:
+                print ('Skipped {} (no allImages .csv file found)'.format(os.path.basename(dailyFile)))
+
+    ###########################################################################################################
+    # Display total elapsed time
+    ###########################################################################################################
+    end = datetime.now()
+
+    print ('\n')
+    print ('Time elapsed: {}'.format(end - start))
+
+###############################################################################################################
+###############################################################################################################
@@ -0,0 +1,234 @@
+"""
+***************************************************************************************************************
+######################################
+Quicklooks of PhenoCam L2 data
+
+Created on Wed Oct 21 14:20:06 2026
+######################################
+
+This python script creates quicklooks of the daily L2 composites (see SITES_phenoCam_dailyAvg_L2.py) for the
+SITES data portal and station reports. All RGB and GCC product folders found below a user defined folder (e.g.
+the L2 data of all phenoCams and years) are processed, and for each product folder the following quicklooks
+are exported to a folder 'Quicklook' next to it:
+
+    a) Thumbnails   : One resized image per day with the date, e.g.
+                      Quicklook\\SITES_P01-RGB_RBD_RBD_20220101-20221231_L2_daily\\SWE-RBD-RBD-AGR-P01_20220613_164.jpg
+    b) Timelapse    : A video of the thumbnails of the year, e.g.
+                      Quicklook\\SITES_P01-RGB_RBD_RBD_20220101-20221231_L2_daily_timelapse.mp4
+    c) Mosaic       : One image with one thumbnail per week, e.g.
+                      Quicklook\\SITES_P01-RGB_RBD_RBD_20220101-20221231_L2_daily_mosaic.jpg
+
+GCC composites are shown with a colour map over the range gccRange. The composites are decoded directly at a
+reduced size (the largest JPEG reduction that is still larger than the thumbnail) and resized in parallel
+threads, while the frames are written to the video in date order as they become ready. Only a few frames are
+held in memory at a time, so the memory use doesn't grow with the length of the time series. Product folders
+whose quicklooks already exist are skipped, so the script can be run after every L2 run.
+
+Note: The script is only for internal use within Swedish Infrastructure for Ecosystem Science (SITES).
+
+Package installations:
+    1) numpy    : pip install numpy
+    2) Open-CV  : pip install opencv-python
+
+Instructions for running the script:
+    a) Make sure all the required modules are installed.
+    b) Run SITES_phenoCam_dailyAvg_L2.py for the data of interest.
+    c) Check the parameter setting section for the thumbnail size, the frame rate and the mosaic layout.
+    d) Run the script and provide the path to the folder containing the L2 data (subfolders are searched).
+
+Limitations of the script:
+    a) The video codec (mp4v) must be available in the OpenCV installation.
+    b) RCC product folders are not processed.
+
+For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
+                                        lars.eklundh@nateko.lu.se
+
+***************************************************************************************************************
+"""
+###############################################################################################################
+# Module Declaration
+###############################################################################################################
+import os
+import cv2
+import glob
+import numpy as np
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from SITES_phenoCam_utils import jpegCheck
+
+###############################################################################################################
+# Parameter setting section
+###############################################################################################################
+
+# Width (pixels) of the thumbnails and of the timelapse
+thumbWidth = 640
+
+# Frames per second of the timelapse
+fps = 10
+
+# Mosaic: one tile every mosaicStep days, number of tile columns and tile width (pixels)
+mosaicStep = 7
+mosaicCols = 13
+mosaicTile = 240
+
+# GCC range shown by the colour map of the GCC quicklooks
+gccRange = (0.30, 0.50)
+
+# Set True to create the quicklooks again even if they already exist
+overwrite = False
+
+# Number of parallel threads
+nbrWorkers = min(8, os.cpu_count() or 1)
+
+###############################################################################################################
+# Function definitions
+###############################################################################################################
+
+def thumbnail(imgPath, isGCC, thumbDir):
+    '''
+    Reads a daily composite at a reduced size, resizes it to thumbWidth, labels it with the date and saves it
+    in thumbDir. GCC composites are shown with a colour map over gccRange.
+    '''
+    # Largest JPEG reduction (2, 4 or 8) that still gives an image wider than the thumbnail
+    width = jpegCheck(imgPath)[1]
+    reduce = max([r for r in (1, 2, 4, 8) if width // r >= thumbWidth] or [1])
+    if isGCC:
+        flags = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}[reduce]
+    else:
+        flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                 8: cv2.IMREAD_REDUCED_COLOR_8}[reduce]
+
+    img = cv2.imread(imgPath, flags)
+    if img is None:
+        return None
+
+    thumb = cv2.resize(img, (thumbWidth, round(img.shape[0] * thumbWidth / img.shape[1])), interpolation = cv2.INTER_AREA)
+
+    # GCC (scaled by 255 in the composites) stretched over gccRange and shown with a colour map
+    if isGCC:
+        gcc = (thumb.astype(np.float32) / 255 - gccRange[0]) / (gccRange[1] - gccRange[0])
+        thumb = cv2.applyColorMap(np.clip(gcc * 255, 0, 255).astype(np.uint8), cv2.COLORMAP_VIRIDIS)
+
+    # Date label, e.g. 2022-06-13
+    dateStr = os.path.basename(imgPath).split('_')[1]
+    label = '{}-{}-{}'.format(dateStr[:4], dateStr[4:6], dateStr[6:8])
+    cv2.putText(thumb, label, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 0), 4, cv2.LINE_AA)
+    cv2.putText(thumb, label, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 255, 255), 2, cv2.LINE_AA)
+
+    cv2.imwrite(os.path.join(thumbDir, '_'.join(os.path.basename(imgPath).split('_')[:3]) + '.jpg'), thumb)
+
+    return thumb
+
+def orderedMap(pool, func, items):
+    '''
+    Like pool.map, but keeps at most a few results ahead of the consumer so that the memory use is bounded.
+    '''
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(func, *item))
+        if len(pending) >= 2 * nbrWorkers:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+def tileKey(imgPath):
+    '''
+    Mosaic tile of a daily composite as (year, period of mosaicStep days within the year).
+    '''
+    parts = os.path.basename(imgPath).split('_')
+
+    return parts[1][:4], (int(parts[2]) - 1) // mosaicStep
+
+def quicklooks(productDir, pool):
+    '''
+    Creates the thumbnails, the timelapse and the mosaic of one L2 product folder.
+    '''
+    product = os.path.basename(productDir)
+    isGCC = '-GCC_' in product
+    imgList = sorted(glob.glob(os.path.join(productDir, '*.jpg')), key = os.path.basename)
+
+    outDir = os.path.join(os.path.dirname(productDir), 'Quicklook')
+    thumbDir = os.path.join(outDir, product)
+    for folder in [outDir, thumbDir]:
+        try:
+            os.mkdir(folder)
+        except:
+            pass
+
+    # Mosaic tiles: first day of every mosaicStep days of each year
+    tileKeys = sorted(set(tileKey(img) for img in imgList))
+    mosaic = None
+    video = None
+
+    for img, thumb in zip(imgList, orderedMap(pool, thumbnail, [(img, isGCC, thumbDir) for img in imgList])):
+        if thumb is None:
+            print ('Skipping {} (unreadable image).'.format(os.path.basename(img)))
+            continue
+
+        # Frames of the timelapse have the size of the first frame
+        if video is None:
+            frameSize = (thumb.shape[1], thumb.shape[0])
+            video = cv2.VideoWriter(os.path.join(outDir, product + '_timelapse.mp4'),
+                                    cv2.VideoWriter_fourcc(*'mp4v'), fps, frameSize)
+
+            tileSize = (mosaicTile, round(mosaicTile * frameSize[1] / frameSize[0]))
+            nbrRows = -(-len(tileKeys) // mosaicCols)
+            mosaic = np.zeros((nbrRows * tileSize[1], mosaicCols * tileSize[0], 3), dtype = np.uint8)
+            tilesDone = set()
+
+        if (thumb.shape[1], thumb.shape[0]) != frameSize:
+            thumb = cv2.resize(thumb, frameSize, interpolation = cv2.INTER_AREA)
+        video.write(thumb)
+
+        # First thumbnail of each mosaic tile
+        key = tileKey(img)
+        if key not in tilesDone:
+            row, col = divmod(tileKeys.index(key), mosaicCols)
+            mosaic[row * tileSize[1]:(row + 1) * tileSize[1], col * tileSize[0]:(col + 1) * tileSize[0]] = \
+                cv2.resize(thumb, tileSize, interpolation = cv2.INTER_AREA)
+            tilesDone.add(key)
+
+    if video is not None:
+        video.release()
+        cv2.imwrite(os.path.join(outDir, product + '_mosaic.jpg'), mosaic)
+
+###############################################################################################################
+# Get time now. This helps to compute total elapsed time for running the code.
+###############################################################################################################
+start = datetime.now()
+
+# Ask from user the folder containing the L2 data
+thePath = input('Enter the path where the L2 data are stored: ')
+
+# RGB and GCC product folders, e.g. SITES_P01-RGB_RBD_RBD_20220101-20221231_L2_daily (but not the thumbnail
+# folders of the quicklooks with the same names)
+productDirs = sorted(d for d in glob.glob(os.path.join(thePath, '**', 'SITES_*_L2_daily*'), recursive = True)
+                     if os.path.isdir(d) and ('-RGB_' in os.path.basename(d) or '-GCC_' in os.path.basename(d))
+                     and os.path.basename(os.path.dirname(d)) != 'Quicklook')
+
+with ThreadPoolExecutor(max_workers = nbrWorkers) as pool:
+    for productDir in productDirs:
+        product = os.path.basename(productDir)
+        videoPath = os.path.join(os.path.dirname(productDir), 'Quicklook', product + '_timelapse.mp4')
+
+        # Skip product folders with quicklooks
+        if os.path.exists(videoPath) and not overwrite:
+            print ('Skipping {} (quicklooks exist).'.format(product))
+            continue
+
+        print ('Creating the quicklooks of {}.............'.format(product))
+        quicklooks(productDir, pool)
+
+###############################################################################################################
+# Display total elapsed time
+###############################################################################################################
+end = datetime.now()
+
+print ('\n')
+print ('Time elapsed: {}'.format(end - start))
+
+###############################################################################################################
+###############################################################################################################
@@ -30,6 +30,8 @@ Limitations of the script:
     a) Script can only take .jpg images as input.
     b) Script filters out the image based on timestamp information available in image names.
     c) Low quality images are to be filtered out manually. 
+    d) Defective images (truncated or empty files) listed by SITES_phenoCam_imageCheck.py in a quarantine 
+       file and duplicate images marked in its image catalog are not copied.
     
 For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
                                         lars.eklundh@nateko.lu.se
@@ -46,6 +48,7 @@ import glob
 import shutil
 import random
 from datetime import datetime
+from SITES_phenoCam_utils import readQuarantine, readDuplicates
 
 ###############################################################################################################
 # Get time now. This computes total elapsed time for running the code.
@@ -84,11 +87,18 @@ print ('\n')
 print ('Filtering out images acquired between 10:00 - 14:00..................')
 print ('This might take between 5-10 minutes depending on the temporal resolution of the data.')
 
+# Defective images listed in the quarantine file(s) and duplicate images marked in the image catalog(s)
+skipList = readQuarantine(imgSrc) | readDuplicates(imgSrc)
+
 # Iterating all images and copying it to a new folder
 for img in sorted(glob.glob(os.path.join(imgSrc, '*.jpg'))):
     
     # Extracting image file name
     dt_info = os.path.basename(img)
+    
+    # Skip defective and duplicate images
+    if dt_info in skipList:
+        continue
      
     # Day of Year information (DOY) extraction from image file name
     ymdt = dt_info.split('_')[-1]
@@ -0,0 +1,844 @@
+"""
+***************************************************************************************************************
+######################################
+Shared functions for the PhenoCam processing scripts
+
+Created on Mon Oct 19 16:02:31 2026
+######################################
+
+This python module collects functions that are used by more than one of the PhenoCam processing scripts
+(e.g. SITES_phenoCam_dailyAvgCSV_L3.py and SITES_phenoCam_easyGUI.py). It is not run on its own, but imported
+by the scripts placed in the same folder.
+
+    a) Snow classification : Tags snow presence per image from cheap colour statistics of a downscaled copy
+                             of the image (fraction of white or bluish-white pixels within the ROI and within
+                             the whole frame). The statistics are computed from the image already read for
+                             the ROI extraction, so no extra pass over the images is needed.
+    b) Snow override       : Manual corrections of the snow classification read from the file
+                             'snowOverride.csv' in the image directory or a folder above it (columns: Image,
+                             Snow with 1 for snow and 0 for no snow). Images in an old 'SnowyImage' folder
+                             (e.g. of each year folder) are still accepted and are tagged as snowy.
+    c) Image quality       : Fraction of the ROI pixels that are neither saturated nor dark.
+    d) Image metrics store : Appends the per-image metrics to a Parquet dataset partitioned by station, phenoCam
+                             and year, and reads it back with filters on the partitions and columns.
+    e) Plotting            : Time series plots of the L3 data rendered without a display (Agg canvas) and with
+                             decimated and rasterized image layers, from the L3 data in memory or from the
+                             L3 .csv files (see SITES_phenoCam_plotL3.py).
+    f) Thumbnail cache     : One downscaled image per day (nearest to noon) cached as .png files, used for a fast
+                             provisional GCC and RCC time series (e.g. the preview in SITES_phenoCam_easyGUI.py).
+    g) Quality flagging    : Daily quality flags (QFLAG) from the number of images, the maximum solar elevation
+                             and snow presence of each day, evaluated for all days at once. The thresholds
+                             are read from the rules table 'SITES_phenoCam_QFLAG_rules.csv' (one row per
+                             image cadence) placed next to this module.
+    h) ROI registry        : ROI polygons of all phenoCams in 'SITES_phenoCam_ROIregistry.json' (next to this
+                             module), keyed by phenoCam with image size and date validity per ROI version.
+                             The rasterised ROI masks are built once per phenoCam, ROI version and image size
+                             and cached as .png files in the folder 'ROImasks' next to the registry.
+    i) Image registration  : Transform (translation, rotation or affine) of each image against a reference
+                             image of the phenoCam, estimated on downscaled grayscale images with the ECC
+                             algorithm and cached in the file 'registration.csv' in the image directory. The
+                             ROI masks are warped with the transform to follow small camera movements.
+    j) Image integrity     : Fast check of the .jpg files (file size, start and end of image markers and the
+                             image dimensions in the header) without decoding them, and the quarantine list
+                             of defective images written by SITES_phenoCam_imageCheck.py, which all
+                             processing steps skip. The lists are searched in the image folder and the
+                             folders above it up to the folder given to the processing step (or dataRoot).
+    k) Duplicate images    : Content hash (SHA-1) and perceptual hash (dHash) of the images from one read of
+                             the file and a downscaled decode, and the duplicates marked in the image catalog
+                             (column DuplicateOf), which all processing steps skip as well.
+
+Note: The module is only for internal use within Swedish Infrastructure for Ecosystem Science (SITES).
+
+Package installations:
+    1) numpy    : pip install numpy
+    2) pandas   : pip install pandas
+    3) Open-CV  : pip install opencv-python
+    4) pyarrow  : pip install pyarrow (only needed for the image metrics store)
+    5) matplotlib : pip install matplotlib
+
+Limitations of the module:
+    a) Snow classification thresholds are tuned for daylight images (solar elevation above ~10 degree).
+    b) Thin or patchy snow below the ROI fraction threshold isn't tagged; use the override file for these.
+
+For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
+                                        lars.eklundh@nateko.lu.se
+
+***************************************************************************************************************
+"""
+###############################################################################################################
+# Module Declaration
+###############################################################################################################
+import os
+import re
+import cv2
+import glob
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+###############################################################################################################
+# Parameter setting section
+###############################################################################################################
+
+# Scale factor of the downscaled image used for the snow statistics
+snowScale = 0.125
+
+# Snow pixels in HSV (0-255): bright and unsaturated (white) or less bright, slightly saturated and
+# blue dominated (snow in shadow or under overcast sky)
+whiteMinV = 160
+whiteMaxS = 40
+blueMinV = 110
+blueMaxS = 90
+
+# Fraction of snow pixels within the ROI for tagging an image as snowy. Images with a lower ROI fraction
+# (but at least snowRoiFracLow) are tagged as snowy if the whole frame is covered by snow.
+snowRoiFrac = 0.4
+snowRoiFracLow = 0.2
+snowImgFrac = 0.4
+
+# Name of the override file and of the old folder with manually selected snowy images
+snowOverrideFile = 'snowOverride.csv'
+snowFolder = 'SnowyImage'
+
+# ROI pixels with any channel at or above satLimit are saturated, pixels with all channels at or below
+# darkLimit are dark
+satLimit = 250
+darkLimit = 10
+
+# Partitions of the image metrics store
+storePartitions = ['Station', 'PhenoCam', 'Year']
+
+# SITES image naming convention (Country-Station-Location-PhenoCam_YYYYMMDD_DOY_HHMM.jpg)
+imgNamePattern = re.compile(r'^[A-Z]{3}(-[A-Z0-9]+)+_\d{8}_\d{3}_\d{4}\.jpg$')
+
+# Size (inches) and resolution of the time series plots, and maximum number of image points per plot layer 
+# (denser layers are decimated)
+figSize = (16, 8)
+figDpi = 100
+maxPlotPoints = 5000
+
+# Folder of the thumbnail cache within the image directory and size reduction of the thumbnails (2, 4 or 8). 
+# The .jpg images are decoded directly at the reduced size, which is much faster than decoding them fully.
+thumbFolder = 'Thumbnails'
+thumbReduce = 8
+
+# Rules table of the quality flagging
+qflagRulesFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SITES_phenoCam_QFLAG_rules.csv')
+
+# ROI registry and the folder of the cached ROI masks
+roiRegistryFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SITES_phenoCam_ROIregistry.json')
+roiMaskFolder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ROImasks')
+
+# Image registration: scale of the downscaled grayscale images, motion model ('translation', 'euclidean' or 
+# 'affine'), maximum number of ECC iterations and convergence limit, and minimum correlation coefficient of a 
+# valid transform (images below it are not warped)
+regScale = 0.125
+regMotion = 'euclidean'
+regIterations = 50
+regEps = 1e-4
+regMinCC = 0.7
+
+# Cache file of the transforms in the image directory
+regFile = 'registration.csv'
+
+# Image catalog and quarantine list written by SITES_phenoCam_imageCheck.py in the checked folder
+catalogFile = 'catalog.csv'
+quarantineFile = 'quarantine.txt'
+
+# Highest folder searched for quarantine lists and image catalogs above the image folders (e.g. the station
+# folder when the check is run on the whole station). Empty searches up to the folder given to the processing 
+# step only, so that unrelated files higher up are never used.
+dataRoot = ''
+
+# Quarantine lists, image catalogs and snow override files already read in this run (per folder)
+sidecarCache = {}
+
+# Bytes at the end of a .jpg file searched for the end of image marker (some cameras pad the files)
+eoiSearchBytes = 1024
+
+# Size (pixels) of the grayscale signature compared for perceptual duplicates
+dupSignatureSize = 32
+
+###############################################################################################################
+# Snow classification
+###############################################################################################################
+
+def snowStats(cv_img, mask):
+    '''
+    Computes the snow statistics of an image (BGR) for the ROI given by mask (same size as the image,
+    non-zero within the ROI). Returns the fraction of snow pixels within the ROI and the whole frame, and
+    the mean brightness and saturation (0-255) within the ROI.
+    '''
+    # Downscaled image and ROI mask
+    small = cv2.resize(cv_img, None, fx = snowScale, fy = snowScale, interpolation = cv2.INTER_AREA)
+    if mask.ndim == 3:
+        mask = mask[:, :, 0]
+    roi = cv2.resize(mask, (small.shape[1], small.shape[0]), interpolation = cv2.INTER_NEAREST) > 0
+
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    S = hsv[:, :, 1]
+    V = hsv[:, :, 2]
+    B, G, R = cv2.split(small)
+
+    # White and bluish-white pixels
+    white = (V >= whiteMinV) & (S <= whiteMaxS)
+    blue = (V >= blueMinV) & (S <= blueMaxS) & (B >= G) & (B > R)
+    snowPix = white | blue
+
+    return {'SnowFrac_ROI': round(float(snowPix[roi].mean()), 3) if roi.any() else 0.0,
+            'SnowFrac_IMG': round(float(snowPix.mean()), 3),
+            'Bright_ROI': round(float(V[roi].mean()), 1) if roi.any() else 0.0,
+            'Sat_ROI': round(float(S[roi].mean()), 1) if roi.any() else 0.0}
+
+def isSnowy(stats):
+    '''
+    Snow classification of an image from its snow statistics (see snowStats).
+    '''
+    return (stats['SnowFrac_ROI'] >= snowRoiFrac) or \
+           (stats['SnowFrac_ROI'] >= snowRoiFracLow and stats['SnowFrac_IMG'] >= snowImgFrac)
+
+def folderOverride(folder):
+    '''
+    Returns {image name: True/False} of the override file of folder (read once per run).
+    '''
+    key = ('override', folder)
+    if key not in sidecarCache:
+        override = {}
+        overridePath = os.path.join(folder, snowOverrideFile)
+        if os.path.exists(overridePath):
+            df = pd.read_csv(overridePath)
+            for imgName, snow in zip(df['Image'], df['Snow']):
+                override[str(imgName).strip()] = int(snow) == 1
+        sidecarCache[key] = override
+
+    return sidecarCache[key]
+
+def readSnowOverride(imgList, rootPath):
+    '''
+    Returns a dictionary {image name: True/False} of manual snow corrections for the images of imgList (complete
+    file paths, e.g. of several year folders below rootPath). Images in an old 'SnowyImage' folder are snowy, and
+    the override files of the image folder and of the folders above it up to rootPath take precedence (the file
+    nearest to the image first). Images not in the dictionary use the classification.
+    '''
+    override = {}
+    for img in imgList:
+        folder = os.path.dirname(os.path.abspath(img))
+        imgName = os.path.basename(img)
+
+        # Images moved by hand to a 'SnowyImage' folder are snowy
+        snowy = True if os.path.basename(folder) == snowFolder else None
+
+        # Corrections in the override files, from the highest folder down to the image folder
+        for overrideFolder in reversed(sidecarFolders(folder, rootPath)):
+            snowy = folderOverride(overrideFolder).get(imgName, snowy)
+
+        if snowy is not None:
+            override[imgName] = snowy
+
+    return override
+
+def imageList(thePath, subfolders = False, startDate = None, endDate = None, snowy = True):
+    '''
+    Returns all .jpg images in thePath and in the old 'SnowyImage' folder (unless snowy is False), sorted by
+    image name (i.e. by date and time). With subfolders, the images of all folders below thePath (e.g. one
+    folder per year) are returned, and an image found in several folders is returned once, from the folder
+    nearest to thePath. Only images named as per the SITES naming convention and acquired between startDate
+    and endDate (YYYYMMDD, both included) are returned.
+    '''
+    if subfolders:
+        imgList = glob.glob(os.path.join(thePath, '**', '*.jpg'), recursive = True)
+    else:
+        imgList = glob.glob(os.path.join(thePath, '*.jpg'))
+        if snowy:
+            imgList += glob.glob(os.path.join(thePath, snowFolder, '*.jpg'))
+
+    # Images as per the naming convention, e.g. SWE-LON-SFA-AGR-P01_20220101_001_1020.jpg
+    imgList = [img for img in imgList if imgNamePattern.match(os.path.basename(img))]
+
+    # Images in the quarantine lists and duplicate images in the image catalogs of their own folder (e.g. the
+    # year folder) and of the folders above it up to thePath are skipped
+    skipLists = {}
+    for folder in set(os.path.dirname(os.path.abspath(img)) for img in imgList):
+        skipLists[folder] = readQuarantine(folder, thePath) | readDuplicates(folder, thePath)
+    imgList = [img for img in imgList if os.path.basename(img) not in skipLists[os.path.dirname(os.path.abspath(img))]]
+
+    # Images with the same name in several folders (e.g. L0 images and their L1 copies in the year folder, or 
+    # the copies in the 'Temp' folder of an interrupted L2 run) are used once, from the folder nearest to thePath
+    imgPaths = {}
+    for img in sorted(imgList, key = lambda img: (os.path.abspath(img).count(os.sep), img)):
+        imgPaths.setdefault(os.path.basename(img), img)
+    if len(imgPaths) < len(imgList):
+        print('Warning: {} images found in more than one folder below {} are used once only.'.format(
+              len(imgList) - len(imgPaths), thePath))
+    imgList = list(imgPaths.values())
+
+    # Images within the date range
+    if startDate:
+        imgList = [img for img in imgList if os.path.basename(img).split('_')[1] >= startDate]
+    if endDate:
+        imgList = [img for img in imgList if os.path.basename(img).split('_')[1] <= endDate]
+
+    return sorted(imgList, key = os.path.basename)
+
+###############################################################################################################
+# Image quality and image metrics store
+###############################################################################################################
+
+def qualityScore(roiPixels):
+    '''
+    Fraction of the ROI pixels (N x 3 array of the pixels within the ROI) that are neither saturated nor dark.
+    '''
+    if len(roiPixels) == 0:
+        return 0.0
+
+    saturated = (roiPixels >= satLimit).any(axis = 1)
+    dark = (roiPixels <= darkLimit).all(axis = 1)
+
+    return round(1 - float(np.mean(saturated | dark)), 4)
+
+def writeImageMetrics(df, storePath, runName):
+    '''
+    Appends the per-image metrics df to the Parquet dataset at storePath, partitioned by station, phenoCam and
+    year (e.g. storePath/Station=RBD/PhenoCam=SWE-RBD-RBD-AGR-P01/Year=2022/). The files are named after
+    runName (e.g. the date range of the run), so that rerunning the same range replaces its files instead of
+    adding the same images twice. The rows are sorted by time so that the row group statistics allow skipping
+    row groups when filtering on time.
+    '''
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    table = pa.Table.from_pandas(df.sort_values('Timestamp'), preserve_index = False)
+    ds.write_dataset(table, storePath, format = 'parquet', partitioning = storePartitions, 
+                     partitioning_flavor = 'hive', basename_template = runName + '-{i}.parquet', 
+                     existing_data_behavior = 'overwrite_or_ignore')
+
+def readImageMetrics(storePath, columns = None, filters = None):
+    '''
+    Reads the per-image metrics from the Parquet dataset at storePath. Only the partitions and row groups 
+    matching the filters and the given columns are read, e.g.:
+
+        readImageMetrics(storePath, columns = ['Timestamp', 'GCC_ROI1', 'Quality_ROI1'], 
+                         filters = [('Station', '=', 'RBD'), ('Year', '>=', 2020), ('Snow', '=', 2)])
+    '''
+    return pd.read_parquet(storePath, engine = 'pyarrow', columns = columns, filters = filters)
+
+###############################################################################################################
+# Plotting
+###############################################################################################################
+
+def imageTime(imgNames):
+    '''
+    Acquisition time of the images from the image names (pandas Series), e.g. 2022-01-01 10:20 for
+    SWE-LON-SFA-AGR-P01_20220101_001_1020.jpg.
+    '''
+    imgParts = imgNames.str.split('_')
+
+    return pd.to_datetime(imgParts.str[1] + imgParts.str[3].str[:4], format = '%Y%m%d%H%M')
+
+def decimate(x, y):
+    '''
+    Every n-th point of x and y so that at most maxPlotPoints points are plotted.
+    '''
+    step = int(np.ceil(len(x) / maxPlotPoints)) if len(x) > maxPlotPoints else 1
+
+    return x[::step], y[::step]
+
+def plotIndex(outPath, imgDF, dailyDF, index, ylim = None, marker = 'r^'):
+    '''
+    Plots the time series of one index (GCC or RCC) of all images (grey), of the snowy images (blue) and of
+    the daily averages (red) and saves it to outPath. imgDF holds the columns Timestamp, Snow (snowy if 1 or
+    100) and e.g. GCC_ROI1, dailyDF the columns TIMESTAMP and e.g. GCC_ROI_1. The figure is rendered on the 
+    Agg canvas, so no display is needed.
+    '''
+    labels = {'GCC': 'Green Chromatic Coordinate (GCC)', 'RCC': 'Red Chromatic Coordinate (RCC)'}
+    snowy = imgDF['Snow'].isin([1, 100]).to_numpy()
+    imgTime = imgDF['Timestamp'].to_numpy()
+    imgVal = imgDF[index + '_ROI1'].to_numpy()
+
+    fig = Figure(figsize = figSize)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+
+    # Dense image layers are decimated and rasterized
+    ax.plot(*decimate(imgTime, imgVal), 'o', color = 'grey', markersize = 4, alpha = 0.1, rasterized = True,
+            label = 'All image {}'.format(index))
+    ax.plot(*decimate(imgTime[snowy], imgVal[snowy]), 'o', color = 'cornflowerblue', markersize = 4, alpha = 0.5, 
+            rasterized = True, label = 'Snowy image {}'.format(index))
+    ax.plot(pd.to_datetime(dailyDF['TIMESTAMP']), dailyDF[index + '_ROI_1'].astype(float), marker, 
+            markersize = 6, mfc = 'none', label = 'Daily Average')
+
+    if ylim:
+        ax.set_ylim(ylim)
+    ax.tick_params(axis = 'x', labelrotation = 45, labelsize = 16)
+    ax.tick_params(axis = 'y', labelsize = 16)
+    ax.grid(True, alpha = 0.3)
+    ax.set_xlabel('Date', fontsize = 20)
+    ax.set_ylabel(labels[index], fontsize = 20)
+    ax.legend(loc = 'upper left', fontsize = 18)
+    fig.tight_layout()
+    fig.savefig(outPath, dpi = figDpi)
+
+def plotL3(imgDF, dailyDF, gccPath, rccPath, gccLim = (0.3, 0.5), rccLim = None):
+    '''
+    Plots the GCC and RCC time series of the per-image metrics imgDF (as in the allImages .csv file) and the 
+    daily averages dailyDF (as in the L3 .csv file, an units row is dropped).
+    '''
+    imgDF = imgDF.assign(Timestamp = imageTime(imgDF['Image']))
+    dailyDF = dailyDF[dailyDF['TIMESTAMP'] != 'YYYY-MM-DD']
+
+    plotIndex(gccPath, imgDF, dailyDF, 'GCC', gccLim, 'r^')
+    plotIndex(rccPath, imgDF, dailyDF, 'RCC', rccLim, 'ro')
+
+###############################################################################################################
+# Thumbnail cache
+###############################################################################################################
+
+def noonImages(imgList):
+    '''
+    Returns {date (YYYYMMDD): image} with the image of each day nearest to noon.
+    '''
+    noonImg = {}
+    for img in imgList:
+        parts = os.path.basename(img).split('_')
+        minutes = abs(int(parts[3][:2]) * 60 + int(parts[3][2:4]) - 720)
+        if parts[1] not in noonImg or minutes < noonImg[parts[1]][0]:
+            noonImg[parts[1]] = (minutes, img)
+
+    return {day: img for day, (minutes, img) in noonImg.items()}
+
+def dailyThumbnails(imgList, thePath, nbrWorkers = 4):
+    '''
+    Returns {date (YYYYMMDD): thumbnail (BGR)} with one thumbnail per day made from the image of the day
+    nearest to noon. The thumbnails are cached as .png files in the folder 'Thumbnails' within thePath, so
+    that only the images of new days are read.
+    '''
+    noonImg = noonImages(imgList)
+
+    cacheDir = os.path.join(thePath, thumbFolder)
+    try:
+        os.mkdir(cacheDir)
+    except:
+        pass
+
+    readFlag = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}[thumbReduce]
+
+    def thumbnail(img):
+        thumbPath = os.path.join(cacheDir, os.path.basename(img)[:-4] + '.png')
+        thumb = cv2.imread(thumbPath) if os.path.exists(thumbPath) else None
+        if thumb is None:
+            thumb = cv2.imread(img, readFlag)
+            if thumb is not None:
+                cv2.imwrite(thumbPath, thumb)
+        return thumb
+
+    # Images are decoded in parallel threads (OpenCV releases the GIL while decoding)
+    days = sorted(noonImg)
+    with ThreadPoolExecutor(max_workers = nbrWorkers) as pool:
+        thumbs = list(pool.map(thumbnail, [noonImg[day] for day in days]))
+
+    return {day: thumb for day, thumb in zip(days, thumbs) if thumb is not None}
+
+def thumbnailIndices(thumbs, pts):
+    '''
+    Provisional daily GCC and RCC (pandas DataFrame indexed by date) of the ROI polygon pts (full size image
+    coordinates) from the daily thumbnails (see dailyThumbnails).
+    '''
+    masks = {}
+    rows = []
+    for day, thumb in thumbs.items():
+
+        # ROI mask at the thumbnail size
+        if thumb.shape not in masks:
+            masks[thumb.shape] = np.zeros(thumb.shape[:2], dtype = np.uint8)
+            cv2.fillPoly(masks[thumb.shape], np.int32([np.asarray(pts) / thumbReduce]), 255)
+
+        Bm, Gm, Rm = cv2.mean(thumb, mask = masks[thumb.shape])[:3]
+        total = Rm + Gm + Bm
+        rows.append((pd.Timestamp(day), Gm / total if total > 0 else np.nan, Rm / total if total > 0 else np.nan))
+
+    return pd.DataFrame(rows, columns = ['Date', 'GCC', 'RCC']).set_index('Date')
+
+###############################################################################################################
+# Quality flagging (QFLAG)
+# Read more about this here: SITES Spectral – Data Quality Flagging (QFLAG) Documentation
+###############################################################################################################
+
+def readQflagRules(cadence = None, timeStamps = None):
+    '''
+    Returns the row of the QFLAG rules table for the given cadence (e.g. 'hourly'). Without a cadence, the
+    cadence is detected from the image timestamps (datetime values) as the row whose interval is closest to 
+    the median interval between consecutive images of the same day.
+    '''
+    rules = pd.read_csv(qflagRulesFile).set_index('Cadence')
+
+    if cadence is None:
+        times = pd.Series(pd.to_datetime(timeStamps)).sort_values()
+        steps = times.diff()[times.dt.date.eq(times.dt.date.shift())].dt.total_seconds() / 60
+        
+        # Only one image per day: use the longest interval of the table
+        interval = steps.median() if len(steps) > 0 else rules['Interval_Min'].max()
+        cadence = (rules['Interval_Min'] - interval).abs().idxmin()
+
+    rule = rules.loc[cadence].copy()
+    rule['Cadence'] = cadence
+
+    return rule
+
+def solarClass(sunElevation, rule):
+    '''
+    Solar elevation class (1: low, 2: medium, 3: high) of the solar elevation angles (degree).
+    '''
+    sunElevation = np.asarray(sunElevation, dtype = float)
+
+    return np.select([sunElevation < rule['SolarAngle_Low'], sunElevation <= rule['SolarAngle_High']], [1, 2], 3)
+
+def qflag(nbrImg, sunMax, snow, rule):
+    '''
+    Daily quality flags for all days at once from the number of images used for the daily average, the 
+    maximum solar elevation and the snow presence (True/False) of the days. Snowy days get the snow flag
+    (100), other days 2XY where X is the image count class and Y the solar elevation class (e.g. 233).
+    Days without images (nbrImg NaN or 0) get NaN.
+    '''
+    nbrImg = np.asarray(nbrImg, dtype = float)
+    imgClass = np.select([nbrImg < rule['ImgCount_Low'], nbrImg < rule['ImgCount_High']], [1, 2], 3)
+
+    flag = np.where(np.asarray(snow, dtype = bool), rule['Snow_QFLAG'], 200 + 10 * imgClass + solarClass(sunMax, rule))
+
+    return np.where(np.isnan(nbrImg) | (nbrImg == 0), np.nan, flag)
+
+###############################################################################################################
+# ROI registry
+###############################################################################################################
+
+# Registry and ROI masks already loaded in this run
+roiCache = {}
+
+def readROIRegistry():
+    '''
+    Returns the ROI registry {phenoCam: [ROI versions]}. Each ROI version has the keys Version, ValidFrom and
+    ValidTo (YYYY-MM-DD or None for open ended), Width and Height (pixels or None for any image size), Note 
+    and ROI (list of polygons, each a list of [x, y] image coordinates).
+    '''
+    if 'registry' not in roiCache:
+        with open(roiRegistryFile, encoding = 'utf-8') as f:
+            roiCache['registry'] = json.load(f)
+
+    return roiCache['registry']
+
+def roiEntry(imgName, width, height):
+    '''
+    Returns the ROI version of the registry valid for the image (SITES image name) and its size, or None if
+    the registry has no ROI for it. If several versions are valid, the highest version is used.
+    '''
+    parts = os.path.basename(imgName).split('_')
+    imgDate = '{}-{}-{}'.format(parts[1][:4], parts[1][4:6], parts[1][6:8])
+
+    valid = [entry for entry in readROIRegistry().get(parts[0], [])
+             if (entry['ValidFrom'] is None or entry['ValidFrom'] <= imgDate) and
+                (entry['ValidTo'] is None or imgDate <= entry['ValidTo']) and
+                (entry['Width'] is None or entry['Width'] == width) and
+                (entry['Height'] is None or entry['Height'] == height)]
+
+    return max(valid, key = lambda entry: entry['Version']) if valid else None
+
+def roiPolygon(imgName, width, height, roiNbr = 1):
+    '''
+    Returns the polygon (numpy array of [x, y]) of ROI number roiNbr (1, 2, ...) valid for the image and its
+    size, or None if the registry has no such ROI.
+    '''
+    entry = roiEntry(imgName, width, height)
+    if entry is None or roiNbr > len(entry['ROI']):
+        return None
+
+    return np.array(entry['ROI'][roiNbr - 1])
+
+def roiLabels(imgName, width, height):
+    '''
+    Returns the ROI version valid for the image and its size together with its masks (uint8) stored as bits
+    of one image (bit 0 for ROI 1 etc., up to 8 ROIs), or (None, None) if the registry has no ROI for the
+    image. The masks are cached as a .png file in the folder 'ROImasks', built on first use and rebuilt when
+    the registry is newer than the file.
+    '''
+    camera = os.path.basename(imgName).split('_')[0]
+    entry = roiEntry(imgName, width, height)
+    if entry is None:
+        return None, None
+
+    key = (camera, entry['Version'], width, height)
+    if key not in roiCache:
+        maskPath = os.path.join(roiMaskFolder, '{}_v{}_{}x{}.png'.format(*key))
+
+        labels = None
+        if os.path.exists(maskPath) and os.path.getmtime(maskPath) >= os.path.getmtime(roiRegistryFile):
+            labels = cv2.imread(maskPath, cv2.IMREAD_UNCHANGED)
+
+        if labels is None:
+            labels = np.zeros((height, width), dtype = np.uint8)
+            for i, pts in enumerate(entry['ROI'][:8]):
+                roi = np.zeros((height, width), dtype = np.uint8)
+                cv2.fillPoly(roi, np.int32([pts]), 1)
+                labels |= roi << i
+
+            try:
+                os.mkdir(roiMaskFolder)
+            except:
+                pass
+
+            # Written under a temporary name first, so that parallel runs never read a partial file
+            tmpPath = maskPath[:-4] + '.{}.png'.format(os.getpid())
+            cv2.imwrite(tmpPath, labels)
+            os.replace(tmpPath, maskPath)
+
+        roiCache[key] = labels
+
+    return entry, roiCache[key]
+
+def roiMask(imgName, width, height, roiNbr = 1):
+    '''
+    Returns the mask (uint8, 255 within the ROI) of ROI number roiNbr valid for the image and its size, or
+    None if the registry has no such ROI. The mask is shared by all images of the same ROI version and size
+    and must not be modified.
+    '''
+    entry, labels = roiLabels(imgName, width, height)
+    if entry is None or roiNbr > min(len(entry['ROI']), 8):
+        return None
+
+    key = (os.path.basename(imgName).split('_')[0], entry['Version'], width, height, roiNbr)
+    if key not in roiCache:
+        roiCache[key] = np.where(labels & (1 << (roiNbr - 1)), 255, 0).astype(np.uint8)
+
+    return roiCache[key]
+
+###############################################################################################################
+# Image registration
+###############################################################################################################
+
+def regImage(cv_img):
+    '''
+    Downscaled and slightly smoothed grayscale image (float32) of an image (BGR) for the registration, or None
+    for an unreadable image (None as returned by cv2.imread).
+    '''
+    if cv_img is None:
+        return None
+
+    small = cv2.resize(cv_img, None, fx = regScale, fy = regScale, interpolation = cv2.INTER_AREA)
+
+    return cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32), (5, 5), 0)
+
+def estimateTransform(refSmall, imgSmall):
+    '''
+    Returns the transform (2x3 matrix in full size image coordinates) mapping the reference image onto the
+    image, and the ECC correlation coefficient, from their downscaled images (see regImage). The identity is
+    returned if the ECC algorithm doesn't converge or the correlation is below regMinCC, and with a NaN
+    correlation if one of the images is missing (None) or the images differ in size.
+    '''
+    if refSmall is None or imgSmall is None or refSmall.shape != imgSmall.shape:
+        return np.eye(2, 3), np.nan
+
+    motion = {'translation': cv2.MOTION_TRANSLATION, 'euclidean': cv2.MOTION_EUCLIDEAN, 
+              'affine': cv2.MOTION_AFFINE}[regMotion]
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, regIterations, regEps)
+
+    try:
+        cc, warp = cv2.findTransformECC(refSmall, imgSmall, np.eye(2, 3, dtype = np.float32), motion, criteria, None, 5)
+    except cv2.error:
+        return np.eye(2, 3), np.nan
+
+    if cc < regMinCC:
+        return np.eye(2, 3), round(cc, 4)
+
+    # From downscaled to full size pixel coordinates (pixel centres at (x + 0.5) * regScale - 0.5)
+    A = warp[:, :2].astype(float)
+    c = 0.5 * regScale - 0.5
+    t = (warp[:, 2] + (A - np.eye(2)) @ np.array([c, c])) / regScale
+
+    return np.hstack([A, t.reshape(2, 1)]), round(cc, 4)
+
+def readRegistration(thePath):
+    '''
+    Returns the cached transforms {image name: (reference image name, transform, correlation)} from the file
+    'registration.csv' in thePath.
+    '''
+    regPath = os.path.join(thePath, regFile)
+    if not os.path.exists(regPath):
+        return {}
+
+    df = pd.read_csv(regPath)
+    M = df[['M11', 'M12', 'M13', 'M21', 'M22', 'M23']].to_numpy().reshape(-1, 2, 3)
+
+    return {imgName: (ref, m, cc) for imgName, ref, m, cc in zip(df['Image'], df['Reference'], M, df['CC'])}
+
+def writeRegistration(thePath, transforms):
+    '''
+    Writes the transforms {image name: (reference image name, transform, correlation)} to the file
+    'registration.csv' in thePath.
+    '''
+    names = sorted(transforms)
+    M = np.array([transforms[name][1] for name in names]).reshape(-1, 6)
+    df = pd.DataFrame(np.round(M, 6), columns = ['M11', 'M12', 'M13', 'M21', 'M22', 'M23'])
+    df.insert(0, 'Reference', [transforms[name][0] for name in names])
+    df.insert(0, 'Image', names)
+    df['CC'] = [transforms[name][2] for name in names]
+
+    df.to_csv(os.path.join(thePath, regFile), index = False)
+
+def warpMask(mask, M):
+    '''
+    Warps a mask (drawn on the reference image) with the transform M onto the image. The mask is returned
+    unchanged if no pixel moves by half a pixel or more.
+    '''
+    height, width = mask.shape[:2]
+    if np.abs(M[:, :2] - np.eye(2)).max() * max(height, width) + np.abs(M[:, 2]).max() < 0.5:
+        return mask
+
+    return cv2.warpAffine(mask, M, (width, height), flags = cv2.INTER_NEAREST)
+
+###############################################################################################################
+# Image integrity
+###############################################################################################################
+
+def jpegCheck(imgPath):
+    '''
+    Checks a .jpg file without decoding it. Returns (file size in bytes, width, height, status) where the
+    status is 'OK', 'Empty' (zero bytes), 'NotJPEG' (no start of image marker), 'NoDimensions' (no frame
+    header or zero width or height) or 'Truncated' (no end of image marker).
+    '''
+    nbrBytes = os.path.getsize(imgPath)
+    if nbrBytes == 0:
+        return nbrBytes, 0, 0, 'Empty'
+
+    width = height = 0
+    with open(imgPath, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return nbrBytes, 0, 0, 'NotJPEG'
+
+        # Walk through the header segments up to the frame header (SOF) holding the image dimensions
+        while True:
+            segment = f.read(4)
+            if len(segment) < 4 or segment[0] != 0xFF:
+                break
+
+            marker = segment[1]
+            if marker == 0xFF:
+                f.seek(-3, 1)
+                continue
+
+            if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+                frame = f.read(5)
+                if len(frame) == 5:
+                    height = int.from_bytes(frame[1:3], 'big')
+                    width = int.from_bytes(frame[3:5], 'big')
+                break
+
+            # Start of scan without frame header
+            if marker == 0xDA:
+                break
+
+            f.seek(int.from_bytes(segment[2:4], 'big') - 2, 1)
+
+        if width == 0 or height == 0:
+            return nbrBytes, width, height, 'NoDimensions'
+
+        # End of image marker within the last bytes of the file
+        f.seek(max(0, nbrBytes - eoiSearchBytes))
+        if f.read().rfind(b'\xff\xd9') < 0:
+            return nbrBytes, width, height, 'Truncated'
+
+    return nbrBytes, width, height, 'OK'
+
+def sidecarFolders(folder, rootPath = None):
+    '''
+    Returns the folders searched for the quarantine lists, image catalogs and snow override files of the images
+    in folder: the folder itself and the folders above it up to rootPath (e.g. the path given to the processing
+    step), or up to dataRoot if it is set and above the folder. The search never goes above these folders.
+    '''
+    folder = os.path.abspath(folder)
+    stops = [os.path.abspath(path) for path in (dataRoot, rootPath) if path]
+
+    # Highest of the stop folders that is the folder itself or above it
+    stops = [stop for stop in stops if os.path.normcase(folder + os.sep).startswith(os.path.normcase(stop.rstrip(os.sep) + os.sep))]
+    stop = min(stops, key = len) if stops else folder
+
+    folders = [folder]
+    while folder != stop:
+        folder = os.path.dirname(folder)
+        folders.append(folder)
+
+    return folders
+
+def folderQuarantine(folder):
+    '''
+    Returns the names of the images listed in the quarantine file of folder (read once per run).
+    '''
+    key = ('quarantine', folder)
+    if key not in sidecarCache:
+        quarantine = set()
+        listPath = os.path.join(folder, quarantineFile)
+        if os.path.exists(listPath):
+            with open(listPath) as f:
+                quarantine.update(line.strip() for line in f if line.strip())
+        sidecarCache[key] = quarantine
+
+    return sidecarCache[key]
+
+def readQuarantine(thePath, rootPath = None):
+    '''
+    Returns the names of the images listed in the quarantine files of thePath and of the folders above it up
+    to rootPath or dataRoot (the check may have been run on a station or phenoCam folder holding several 
+    levels or years, see sidecarFolders).
+    '''
+    return set().union(*[folderQuarantine(folder) for folder in sidecarFolders(thePath, rootPath)])
+
+def imageHashes(imgPath):
+    '''
+    Returns the content hash (SHA-1, hex), the perceptual difference hash (dHash, 64 bits as hex) and a
+    small grayscale signature (dupSignatureSize x dupSignatureSize, uint8) of an image. The file is read
+    once and decoded at 1/8 of its size only. All three are None if the image cannot be decoded.
+    '''
+    with open(imgPath, 'rb') as f:
+        data = f.read()
+
+    small = cv2.imdecode(np.frombuffer(data, dtype = np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+
+    # Images that cannot be decoded have no hashes (they are quarantined by SITES_phenoCam_imageCheck.py)
+    if small is None:
+        return None, None, None
+
+    # Difference hash: sign of the horizontal gradients of a 9x8 image
+    tiny = cv2.resize(small, (9, 8), interpolation = cv2.INTER_AREA).astype(np.int16)
+    bits = (tiny[:, 1:] > tiny[:, :-1]).flatten()
+    dHash = '{:016x}'.format(int(''.join('1' if bit else '0' for bit in bits), 2))
+
+    signature = cv2.resize(small, (dupSignatureSize, dupSignatureSize), interpolation = cv2.INTER_AREA)
+
+    return hashlib.sha1(data).hexdigest(), dHash, signature
+
+def folderDuplicates(folder):
+    '''
+    Returns the names of the images marked as duplicates in the image catalog of folder (read once per run).
+    '''
+    key = ('duplicates', folder)
+    if key not in sidecarCache:
+        duplicates = set()
+        catalogPath = os.path.join(folder, catalogFile)
+        if os.path.exists(catalogPath):
+            df = pd.read_csv(catalogPath, usecols = lambda col: col in ('Image', 'DuplicateOf'))
+            if 'DuplicateOf' in df:
+                duplicates.update(df.loc[df['DuplicateOf'].notna(), 'Image'])
+        sidecarCache[key] = duplicates
+
+    return sidecarCache[key]
+
+def readDuplicates(thePath, rootPath = None):
+    '''
+    Returns the names of the images marked as duplicates (column DuplicateOf) in the image catalogs of thePath
+    and of the folders above it up to rootPath or dataRoot (see sidecarFolders).
+    '''
+    return set().union(*[folderDuplicates(folder) for folder in sidecarFolders(thePath, rootPath)])
+
+###############################################################################################################
+###############################################################################################################
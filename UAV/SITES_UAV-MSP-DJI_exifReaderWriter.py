@@ -13,6 +13,10 @@ it's necessary to check the variation of sunshine sensor irradiance data before
 helps to extract key metadata parameters such as image name, geolocation information, irradiance data recorded
 by sunshine sensor and roll, yaw and pitch angle.
 
+All EXIF and XMP tags of the flight images are read in one exiftool session and kept in a metadata cache next
+to the flight folder (see SITES_UAV_utils.py), e.g. ...SWE-LON-SFAB-AGR-msp-210604-U01_metadata.sqlite. The
+later steps read their tags from the cache instead of running exiftool over the flight again.
+
 Note: The script was tested on windows environment in Python 3.7.6 version only. This script is only for 
       the internal use within SITES.
 
@@ -28,6 +32,7 @@ Instructions for running the script:
            
     b) Run the script and follow the instructions displayed.
     c) Once finished, there should be a .xlsx sheet with irradiance data per band for the flight.
+    d) SITES_UAV_utils.py must be placed in the same folder as this script.
     
 Limitations of the script:
     a) Script works only with DJI P4 Multispectral images and is programmed to extract only fews EXIF data.
@@ -52,8 +57,8 @@ For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
 # Importing required modules
 ################################################################################################################
 import os
-import exiftool
 import xlsxwriter
+from SITES_UAV_utils import readMetadata
 
 ################################################################################################################  
 # Creating and writing data to excel sheet  
@@ -118,16 +123,15 @@ files = pathFileList
 
 irrBandDict = {band:[] for band in ['Blue', 'Green', 'Red', 'RedEdge', 'NIR']}
 
-with exiftool.ExifTool() as et:
-    # Gets metadata as a list of dictionaries
-    metadata = et.get_tags_batch(mtags, files)
-    
-    for idx, file_metadata in enumerate(metadata):
+# Gets metadata as a list of dictionaries (from the metadata cache of the flight)
+metadata = readMetadata(files, mtags)
+
+for idx, file_metadata in enumerate(metadata):
 
-        irrData = [fileList[idx], file_metadata[irr_tag], file_metadata[lat_tag], file_metadata[lon_tag], 
-                   float(file_metadata[alt_tag]), float(file_metadata[roll_tag]), float(file_metadata[yaw_tag]), 
-                   float(file_metadata[pitch_tag])]
-        irrBandDict[file_metadata[bandName_tag]].append(irrData)
+    irrData = [fileList[idx], file_metadata[irr_tag], file_metadata[lat_tag], file_metadata[lon_tag], 
+               float(file_metadata[alt_tag]), float(file_metadata[roll_tag]), float(file_metadata[yaw_tag]), 
+               float(file_metadata[pitch_tag])]
+    irrBandDict[file_metadata[bandName_tag]].append(irrData)
 
 ################################################################################################################ 
 # Writing to Excel sheet     
@@ -10,9 +10,35 @@ Created on Wed Aug 18 12:07:53 2021
 This Python Script performs exposure and vignetting compensation and optionally compensates for differences in
 irradiance according to normalized sunshine sensor irradiance data from step 2. Finally, the normalized images
 are exported as .TIF files and also copies the metadata from original images to the normalized images. 
-Additionally, there are also image mask for the saturated pixels in each flight images. The output of 
-this script i.e. both the normalized images and image masks are used for further processing into the
-image processing softwares like Metashape/Pix4D or OpenDroneMap.
+Additionally, there are also image mask for the saturated pixels (at or above the saturation threshold) in
+each flight images, saved as compressed 1-bit .TIF files. The output of this script i.e. both the normalized
+images and image masks are used for further processing into the image processing softwares like
+Metashape/Pix4D or OpenDroneMap.
+
+The normalized images are exported in a single pass over the flight images, either as float32 .TIF files
+(outFloat32 = True) or stretched to the full range of uint16 .TIF files (default). For the uint16 output, the 
+corrected images of a band are kept in a temporary float32 memory-mapped file until the maximum value of the 
+band is known, and are then stretched and exported. The maximum value and the uint16 stretch factor of each 
+band are saved in a .csv file next to the output folder, e.g. ...-U01_irrGDAL_SAT_64.0_NO_SSensor_VIG_v2_bandMax.csv,
+so that the float32 images can be converted to the same uint16 values later.
+
+The images are handled in parallel by worker processes (nbrWorkers). The correction maps of each band (black 
+level and vignetting factors) are computed once and given to each worker when it starts, and the max values of
+the images are returned in image order and reduced to the max value of the band.
+
+Optionally (alignBands = True), the five band images of each capture are also aligned to the NIR band and 
+saved as one 5-band float32 .TIF file (Blue, Green, Red, RedEdge, NIR) together with the NDVI of the capture,
+for quick checks of the flight in the field without a photogrammetry run. The alignment uses remap grids
+built once per band from the XMP tags RelativeOpticalCenterX/Y (optical centre relative to the NIR band) and,
+where present, DewarpData (distortion model of the band). The 5-band images are saved in a folder next to the
+output folder with the extension _stack, e.g. DJI_0011_stack.tif and DJI_0011_NDVI.tif. The images of a 
+complete capture are then handled together in one pass (each image is read and adjusted once), and the
+temporary stacks of all five bands exist at the same time.
+
+The EXIF and XMP tags of the images are read from the metadata cache of the flight (see SITES_UAV_utils.py), 
+which is created by Step 1 or, if missing, in one exiftool session for all bands.
+The EXIF and XMP data of the original images are copied to the normalized images at the end with one exiftool
+command for all images (each normalized image is rewritten once).
 
 Note: The script was tested on windows environment in Python 3.7.6 version only. This script is only for the 
       internal use within SITES.
@@ -23,6 +49,7 @@ Package installation:
     c) exiftool
     d) PyExifTool
     e) Matplotlib
+    f) Open-CV (opencv-python)
 
 Instructions for running the script:
     a) Make sure all the required modules are installed.
@@ -38,11 +65,18 @@ Instructions for running the script:
     e) Check all the normalized images in the same file path as the original multispectral 
        images once the script is successfully completed. This images will be used for L2 & 
        L3 data creation. 
+    f) SITES_UAV_utils.py must be placed in the same folder as this script.
+    g) The uint16 output needs temporary disk space for one band of float32 images (about twice the size
+       of the original images of the band) in the output folder.
     
 Limitations of the script:
     a) Script is programmed to handle DJI P4 multispectral images only.
     b) Users must have good knowledge of sunshine sensor data, radiometry, as well as the
        threshold values for the saturated pixels.
+    c) Plotting the images (plotImages = True) handles the images one at a time.
+    d) The aligned 5-band images are not reflectance calibrated and the NDVI is computed from the normalized
+       camera values, i.e. they are meant for quick checks only. Use the original band images in 
+       Metashape/Pix4D for the data products.
     
 Important information:
     a) DJI Image Processing Guide:
@@ -71,19 +105,13 @@ For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
 import os
 import sys
 import math
-import exiftool
+import cv2
 import numpy as np
 import pandas as pd
 from osgeo import gdal
 import matplotlib.pyplot as plt
-
-################################################################################################################
-# Get file paths to the multispectral UAV flight images
-################################################################################################################
-directory = input("Enter file path to the folder containing multispectral DJI P4 images: ") 
-
-# Path to .xlsx sheet with normalised sunshine sensor data 
-sunshineSensorFittedExcel = input("Enter file path to .xlsx file containing normalizing factors: ")[1:-1]
+from concurrent.futures import ProcessPoolExecutor
+from SITES_UAV_utils import readMetadata, updateMetadataCache, copyMetadata
 
 ################################################################################################################
 # Paramter setting section
@@ -96,7 +124,7 @@ splTrend = False # True means the spline trend is used, False uses the polynomia
 # True means vignetting compensation is performed
 vigComp = True
 
-# True means images are plotted, both original and adjusted
+# True means images are plotted, both original and adjusted (the images are then handled one at a time)
 plotImages = False
 
 # Set verbose to True for printouts of some steps
@@ -105,13 +133,28 @@ verbose = False
 # Set saveAdjImg = True if saving the adjusted images
 saveAdjImg = True
 
+# True saves the adjusted images as float32 .TIF files, False stretches them to the full range of uint16
+outFloat32 = False
+
 # Handling saturated pixels or not + threshold setting for defining saturated pixels
 checkSaturated = True # Set True to save masks per image for importing in Metashape 
 satThres = 64000 # This threshold values should be set with care
 
+# Masks of the saturated pixels are saved DEFLATE compressed as 1-bit (0/1) or byte (0/255) .TIF files
+maskNbits = 1 # 1 or 8
+maskOptions = ['COMPRESS=DEFLATE'] + ['NBITS=1']*(maskNbits == 1)
+
 # Set to true to copy EXIF (and XMP) data from original to adjsuted images
 copyEXIF = True # True means EXIF (and XMP) data will be copied
 
+# Set alignBands = True to also save the five bands of each capture aligned to the NIR band as 5-band .TIF
+# files (and saveNDVI = True for the NDVI of each capture), for quick checks without photogrammetry
+alignBands = False
+saveNDVI = True
+
+# Number of parallel processes (1 handles the images one at a time without worker processes)
+nbrWorkers = 1 if plotImages else (os.cpu_count() or 1)
+
 # Extension of the directory to save the adjusted images
 # Naming convention:
 # _irrGDAL_SAT_XX_NO_SSensor
@@ -120,8 +163,9 @@ copyEXIF = True # True means EXIF (and XMP) data will be copied
 # NO states if SSensor (sunshine sensor data are used to normalize for changing light conditions)
 # VIG states if vignetting compensation is done
 outDirExt = '_irrGDAL' + '_SAT'*checkSaturated + '_'*checkSaturated + str(satThres/1000)*checkSaturated + \
-            '_NO'*(adjustSunshineSensorDataFitted==False) + '_SSensor' + '_VIG'*vigComp + '_v2'
+            '_NO'*(adjustSunshineSensorDataFitted==False) + '_SSensor' + '_VIG'*vigComp + '_float32'*outFloat32 + '_v2'
 outDirExtMask = outDirExt  + '_mask'
+outDirExtStack = outDirExt  + '_stack'
         
 ################################################################################################################
 # Creating variables for tags and placing tags of interest in a list
@@ -139,39 +183,12 @@ calOpticalCenterY = 'XMP:CalibratedOpticalCenterY'  # Y-axis coordinate of the d
 sensorGainAdjustment = 'XMP:SensorGainAdjustment'   # Parameter for individual difference correction
 
 vignettingList = 'XMP:VignettingData'               # Coefficients for vignetting calibration
+dewarpData = 'XMP:DewarpData'                       # Distortion model of each band
 exposureTime   = 'XMP:ExposureTime'                 # Exposure time for each band
 
 # Tags to read from the EXIF
 tags = [irradiance, imgName_tag, opticalCenterRelX, opticalCenterRelY, calOpticalCenterX, calOpticalCenterY, 
-        blackLevel, vignettingList, sensorGain, exposureTime, sensorGainAdjustment]
-
-################################################################################################################
-# Creating path of directory for output
-outDir = directory + outDirExt + '\\'
-
-if saveAdjImg:
-    # Creating directory if it does not exist
-    if not os.path.isdir(outDir):
-        os.mkdir(outDir)
-    else:
-        sys.exit('Warning: Directory {} exists. Make sure you are not overwriting files in output directory'.format(outDir))
-
-if checkSaturated:   
-    # Directory for masks    
-    outDirMask = directory + outDirExtMask + '\\'   
-    if not os.path.isdir(outDirMask):
-        os.mkdir(outDirMask)
-    else:
-        sys.exit('Warning: Directory {} exists. Make sure you are not overwriting files in output directory'.format(outDirMask))
-
-# Opening file with trend if compensating for changing light conditions
-if adjustSunshineSensorDataFitted:
-    sunshineSensorTrend = pd.ExcelFile(sunshineSensorFittedExcel)
-    
-################################################################################################################
-# Getting a list of the files in the directory
-fileList = os.listdir(directory)
-fileList.sort(key = lambda x: int(x.split('_')[1])) #Sort based on image number in image name string
+        blackLevel, vignettingList, sensorGain, exposureTime, sensorGainAdjustment, dewarpData]
 
 # Bands of the camera to extract EXIF data for
 djiBandList = ['Blue', 'Green', 'Red', 'RedEdge', 'NIR']
@@ -179,225 +196,476 @@ djiBandList = ['Blue', 'Green', 'Red', 'RedEdge', 'NIR']
 # Band abbreviation for each individual band
 djiBandAbb = {'Blue': 'BLU', 'Green': 'GRE', 'Red': 'RED', 'RedEdge': 'REG', 'NIR': 'NIR'}
 
-# Empty dictionary for saving max reflectance per band
-reflMaxDict = {} 
-
 ################################################################################################################
-# Exposure compensation, Vignetting Correction and Irradiance Normalization
+# Function definitions
 ################################################################################################################
+
+def writeTIFF(outImg, imarray, dataType, options = []):
+    '''
+    Saves a 1-band image as .TIF file with GDAL (options are GTiff creation options, e.g. compression).
+    '''
+    nrows, ncols = np.shape(imarray)
+    
+    driver = gdal.GetDriverByName('Gtiff')
+    dataset = driver.Create(outImg, ncols, nrows, 1, dataType, options)
+    dataset.GetRasterBand(1).WriteArray(imarray)
+    dataset = None # "Closing" the driver
+
+def toUint16(imarray, scaleFactor):
+    '''
+    Stretches an adjusted image with the band scale factor and converts it to uint16. 
+    NB!!!! GDAL sets float values <0 to max in uint16
+    '''
+    # Need to remove negative values otherwise GDAL sets them to max. 
+    imarray = imarray * scaleFactor
+    imarray[np.isnan(imarray)] = 65535 # uint cannot handle nan so setting to max value
+    imarray[imarray < 0] = 0
     
-for djiBand in djiBandList:
+    return imarray.astype(np.uint16)
 
-    if verbose:
-        print ('Currently handling band: {}'.format(djiBand))
+def vignettingMap(poly_coeff, CenterX, CenterY, nrows, ncols):
+    '''
+    Vignetting factor for each pixel (x,y) of a band (the same for all images of the band).
+    '''
+    # Define variables for polynomial coefficients
+    k0, k1, k2, k3, k4, k5 = poly_coeff
+    
+    # Compute distance between pixel (x, y) and the center of the vignette in pixels
+    # Equation 9 from the referred document
+    y, x = np.mgrid[0:nrows, 0:ncols].astype(np.float32)
+    r = np.sqrt((x - CenterX)**2 + (y - CenterY)**2)
+    
+    # Computing vignetting factor
+    return (k5*r**6 + k4*r**5 + k3*r**4 + k2*r**3 + k1*r**2 + k0*r + 1.0).astype(np.float32)
+
+def remapGrid(relX, relY, dewarpData, CenterX, CenterY, nrows, ncols):
+    '''
+    Remap grid of a band aligning its images to the NIR band, from the optical centre of the band relative to
+    the NIR band (pixels) and optionally the distortion model of the band (DewarpData: fx, fy, cx, cy, k1, k2,
+    p1, p2, k3 with cx, cy relative to the calibrated optical centre). Pixel (x, y) of the aligned image is
+    taken from (x + relX, y + relY) of the (undistorted) band image.
+    '''
+    if dewarpData:
+        fx, fy, cx, cy, k1, k2, p1, p2, k3 = [float(val) for val in str(dewarpData).split(';')[-1].split(',')]
+        cameraMatrix = np.array([[fx, 0, CenterX + cx], [0, fy, CenterY + cy], [0, 0, 1]])
         
-    if adjustSunshineSensorDataFitted:
-        # Reading the normalised trend (and also image names for safety)
-        bandSheet = pd.read_excel(sunshineSensorTrend, djiBand)
-        if splTrend:
-            irrTrendNorm = bandSheet['Spline norm']
-            imgTrendName = bandSheet['Img']
-        else:            
-            irrTrendNorm = bandSheet['Norm trend']
-            imgTrendName = bandSheet['Img']
+        # Shifting the principal point of the undistorted image by the relative optical centre
+        newMatrix = cameraMatrix.copy()
+        newMatrix[0, 2] -= relX
+        newMatrix[1, 2] -= relY
+        
+        return cv2.initUndistortRectifyMap(cameraMatrix, np.array([k1, k2, p1, p2, k3]), None, newMatrix, 
+                                           (ncols, nrows), cv2.CV_16SC2)
     
-    # Empty list for saving file names    
-    files = []     
+    y, x = np.mgrid[0:nrows, 0:ncols].astype(np.float32)
     
-    maxRefl = 0 # To save max reflectance for a band to convert to uint16 later
+    # Fixed point grids are smaller and faster to remap with
+    return cv2.convertMaps(x + np.float32(relX), y + np.float32(relY), cv2.CV_16SC2)
+
+def initWorker(maps, dirs):
+    '''
+    Makes the read-only correction maps (black level, vignetting factors and remap grid per band) and the
+    output directories available to a worker process. Called once per worker instead of sending the maps
+    with every image.
+    '''
+    global bandMaps, outDir, outDirMask, outDirStack
+    bandMaps = maps
+    outDir, outDirMask, outDirStack = dirs
+
+def adjustImage(imgFile, djiBand, irrNorm, valGain, valExptime):
+    '''
+    Exposure, vignetting and optionally irradiance compensation of one image. Saves the mask of saturated
+    pixels and returns the adjusted image as float32 array with saturated pixels = np.nan.
+    '''
+    black_level, correction, grid = bandMaps[djiBand]
     
-    # Removing files that are not image files and selecting files per band
-    arr = []
-    for f in fileList:
-        if ('TIF' in f) and djiBandAbb[djiBand] in f and not '.enp' in f: # checking not enp (Envi file)
-            arr.append(f)
+    # Read image as a numpy array
+    imarray = plt.imread(imgFile) 
     
-    files = [os.path.join(directory, f) for f in arr] 
-
+    # Get the size of the image
+    nrows, ncols = np.shape(imarray) 
+    
+    # Normalized raw pixel value and normalized black level value.
+    # Normalization here is to simply divide the original number by 65535 as P4 multispectral images are 16bit.
+    # The adjusted images are computed in float32 (the precision of the output images) and the steps below
+    # are done in place to avoid full size temporary arrays
+    imgAdj = imarray.astype(np.float32)
+    imgAdj /= np.float32(65535.0)
+    Ibl = np.float32(black_level/65535.0)
+    
+    # Subtract the normalized raw pixelvalue from normalized dark level value
+    imgAdj -= Ibl
+    
+    # Get the basename of the images from a given path
+    imgName = os.path.basename(imgFile)
+            
+    # Irradiance normalization of the images using sunshine sensor fitted data
+    if irrNorm is not None:
+        imgAdj /= irrNorm
+            
     ############################################################################################################
-    # Reading EXIF data from the image
+    # Sets saturated pixels to np.nan
+    # Saturated pixels are assigned the value 65535
     ############################################################################################################
-    with exiftool.ExifTool() as et:
-        metadata_ALL = et.get_tags_batch(tags, files)
-                          
+            
+    if checkSaturated:
+        # Gives a boolean matrix with valid pixels = True (below the threshold) and saturated pixels = False
+        valid = imarray < satThres
+        
+        # Saves the mask for import in Agisoft (0 = saturated)
+        # 1-bit masks are written from the boolean matrix directly (True = 1), byte masks with 0-255
+        mask = valid.view(np.uint8) if maskNbits == 1 else valid * np.uint8(255)
+        writeTIFF(outDirMask + imgName.split('.')[0] +'_mask.tif', mask, gdal.GDT_Byte, maskOptions)
+        
+        # Setting saturated pixels to nan in the adjusted image.
+        # When saved to tiff nan are replaced with max value of uint16
+        np.copyto(imgAdj, np.nan, where = ~valid)
+    
+    if plotImages:        
+        plt.imshow(imgAdj)
+        plt.colorbar()
+        plt.title('Before vignetting')
+        plt.show()
+        
     ############################################################################################################
-    # Extract various metadata tags for vignetting correction
-    ############################################################################################################ 
-    # Polynomial coefficients are defined as a unicode string of six coefficients separated by comma.
-    poly_coeff = [float(unicodeVal) for unicodeVal in metadata_ALL[0]['XMP:VignettingData'].split(u',')]
-
-    # Define variables for polynomial coefficients
-    k0, k1, k2, k3, k4, k5 = poly_coeff
+    # Vignetting and Exposure Correction
+    ############################################################################################################
+    # Normalized camera value for each band. X refers to each band (e.g. NIR, Red, Red Edge, Green, Blue)
+    # Equation 7 from the referred document
+    imgAdj *= correction
+    imgAdj /= valGain * (valExptime/1e6)
     
-    # Extract black level tag
-    black_level = metadata_ALL[0]['EXIF:BlackLevel']
+    return imgAdj
+
+def correctImage(imgFile, djiBand, idx, irrNorm, valGain, valExptime, stackFile):
+    '''
+    Adjusts one image and saves the adjusted image (float32 .TIF file, or row idx of the memory-mapped stack
+    of the band for the uint16 output). Returns the max value of the adjusted image.
+    '''
+    Xcamera = adjustImage(imgFile, djiBand, irrNorm, valGain, valExptime)
     
-    # Extract the X and Y coordinates of center of vignette in pixels
-    CenterX = metadata_ALL[0]['XMP:CalibratedOpticalCenterX']
-    CenterY = metadata_ALL[0]['XMP:CalibratedOpticalCenterY']
+    return saveImage(Xcamera, imgFile, idx, stackFile)
+
+def correctCapture(captureJobs):
+    '''
+    Adjusts and saves the five band images of one capture as correctImage does, and aligns the adjusted images 
+    to the NIR band with stackCapture, so that each image is read and adjusted once. Returns the max values of 
+    the adjusted images in band order.
+    '''
+    maxRefl = []
+    bands = []
+    for imgFile, djiBand, idx, irrNorm, valGain, valExptime, stackFile in captureJobs:
+        Xcamera = adjustImage(imgFile, djiBand, irrNorm, valGain, valExptime)
+        maxRefl.append(saveImage(Xcamera, imgFile, idx, stackFile))
+        bands.append(Xcamera)
     
-    # Iterate through metadata of all images per band
-    for idx, metadata in enumerate(metadata_ALL):
+    stackCapture(captureJobs, bands)
+    
+    return maxRefl
+
+def saveImage(Xcamera, imgFile, idx, stackFile):
+    '''
+    Saves the adjusted image Xcamera of imgFile (float32 .TIF file, or row idx of the memory-mapped stack of 
+    the band for the uint16 output). Returns the max value of the adjusted image.
+    '''
+    imgName = os.path.basename(imgFile)
+    
+    # To get max reflectance to convert to uint16 later
+    maxRefl = 0
+    if not np.isnan(Xcamera).all():
+        maxRefl = float(np.nanmax(Xcamera))
+            
+    ############################################################################################################
+    # Export the corrected images
+    ############################################################################################################              
+    if saveAdjImg:
+        # Define name of output file. 
+        fn = imgName.split('.')[0]
         
-        # Read image as a numpy array
-        imarray = plt.imread(files[idx]) 
+        if outFloat32:
+            # Saving the final version directly
+            writeTIFF(outDir + fn + '.tif', Xcamera, gdal.GDT_Float32)
+        else:
+            # NB, since the stretch must be performed before converting to
+            # uint16 all images of the band must be handled first. The images
+            # are kept in a float32 memory-mapped file until then.
+            stack = np.load(stackFile, mmap_mode = 'r+')
+            stack[idx] = Xcamera
+            stack.flush()
+            
+    if plotImages:
+        plt.imshow(Xcamera)
+        plt.colorbar()
+        plt.show()
+    
+    return maxRefl
+
+def stackCapture(captureJobs, adjusted):
+    '''
+    Aligns the adjusted images of the five bands of one capture (captureJobs as for correctImage) to the NIR 
+    band with the remap grids and saves them as a 5-band float32 .TIF file (Blue, Green, Red, RedEdge, NIR), 
+    and optionally the NDVI as a 1-band float32 .TIF file. The files are named after the first image of the 
+    capture, e.g. DJI_0011_stack.tif.
+    '''
+    bands = []
+    for job, Xcamera in zip(captureJobs, adjusted):
         
-        # Get the size of the image
-        nrows, ncols = np.shape(imarray) 
+        # Pixels mapped from outside the image (or from saturated pixels) are set to np.nan
+        map1, map2 = bandMaps[job[1]][2]
+        bands.append(cv2.remap(Xcamera, map1, map2, cv2.INTER_LINEAR, borderMode = cv2.BORDER_CONSTANT, 
+                               borderValue = np.nan))
+    
+    fn = '_'.join(os.path.basename(captureJobs[0][0]).split('_')[:2])
+    nrows, ncols = np.shape(bands[0])
+    
+    driver = gdal.GetDriverByName('Gtiff')
+    dataset = driver.Create(outDirStack + fn + '_stack.tif', ncols, nrows, len(bands), gdal.GDT_Float32, 
+                            ['COMPRESS=DEFLATE', 'PREDICTOR=3', 'INTERLEAVE=BAND'])
+    for b, band in enumerate(bands):
+        dataset.GetRasterBand(b + 1).WriteArray(band)
+    dataset = None # "Closing" the driver
+    
+    if saveNDVI:
+        red, nir = bands[djiBandList.index('Red')], bands[djiBandList.index('NIR')]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            ndvi = (nir - red) / (nir + red)
+        writeTIFF(outDirStack + fn + '_NDVI.tif', ndvi, gdal.GDT_Float32, ['COMPRESS=DEFLATE', 'PREDICTOR=3'])
+
+def stackToUint16(stackFile, idx, outImg, scaleFactor):
+    '''
+    Converts row idx of the memory-mapped stack of a band to uint16 and saves it as .TIF file.
+    '''
+    stack = np.load(stackFile, mmap_mode = 'r')
+    writeTIFF(outImg, toUint16(stack[idx], scaleFactor), gdal.GDT_UInt16)
+
+################################################################################################################
+# Main program
+# The guard is needed since the worker processes import this script on Windows
+################################################################################################################
+if __name__ == '__main__':
+
+    ############################################################################################################
+    # Get file paths to the multispectral UAV flight images
+    ############################################################################################################
+    directory = input("Enter file path to the folder containing multispectral DJI P4 images: ") 
+    
+    # Path to .xlsx sheet with normalised sunshine sensor data 
+    sunshineSensorFittedExcel = input("Enter file path to .xlsx file containing normalizing factors: ")[1:-1]
+    
+    ############################################################################################################
+    # Creating path of directory for output
+    outDir = directory + outDirExt + '\\'
+    outDirMask = directory + outDirExtMask + '\\'   
+    outDirStack = directory + outDirExtStack + '\\'
+    
+    if saveAdjImg:
+        # Creating directory if it does not exist
+        if not os.path.isdir(outDir):
+            os.mkdir(outDir)
+        else:
+            sys.exit('Warning: Directory {} exists. Make sure you are not overwriting files in output directory'.format(outDir))
+    
+    if checkSaturated:   
+        # Directory for masks    
+        if not os.path.isdir(outDirMask):
+            os.mkdir(outDirMask)
+        else:
+            sys.exit('Warning: Directory {} exists. Make sure you are not overwriting files in output directory'.format(outDirMask))
+    
+    if alignBands:   
+        # Directory for aligned 5-band images
+        if not os.path.isdir(outDirStack):
+            os.mkdir(outDirStack)
+        else:
+            sys.exit('Warning: Directory {} exists. Make sure you are not overwriting files in output directory'.format(outDirStack))
+    
+    # Opening file with trend if compensating for changing light conditions
+    if adjustSunshineSensorDataFitted:
+        sunshineSensorTrend = pd.ExcelFile(sunshineSensorFittedExcel)
         
-        #print np.max(imarray)
-        # Normalized raw pixel value and normalized black level value.
-        # Normalization here is to simply divide the original number by 65535 as P4 multispectral images are 16bit.
-        Ix = imarray/65535.0
-        Ibl = black_level/65535.0
+    ############################################################################################################
+    # Getting a list of the files in the directory
+    fileList = os.listdir(directory)
+    fileList.sort(key = lambda x: int(x.split('_')[1])) #Sort based on image number in image name string
+    
+    # Empty dictionaries for saving max reflectance and the uint16 conversion factor per band
+    reflMaxDict = {} 
+    scaleDict = {}
+    
+    # Reading EXIF data of all bands into the metadata cache of the flight (if not already cached)
+    updateMetadataCache([os.path.join(directory, f) for f in fileList if 'TIF' in f and not '.enp' in f])
+    
+    # Images, their parameters, the correction maps and the size of the temporary stack per band
+    bandJobs = {}
+    bandMaps = {}
+    stackShape = {}
+    
+    ############################################################################################################
+    # Reading EXIF data and computing the correction maps of each band
+    ############################################################################################################
+    for djiBand in djiBandList:
         
-        # Subtract the normalized raw pixelvalue from normalized dark level value
-        imgAdj = Ix - Ibl
+        # Removing files that are not image files and selecting files per band
+        arr = []
+        for f in fileList:
+            if ('TIF' in f) and djiBandAbb[djiBand] in f and not '.enp' in f: # checking not enp (Envi file)
+                arr.append(f)
+        
+        files = [os.path.join(directory, f) for f in arr] 
         
-        # Get the basename of the images from a given path
-        imgName = os.path.basename(files[idx])
-                
-        # Irradiance normalization of the images using sunshine sensor fitted data
         if adjustSunshineSensorDataFitted:
-            assert imgTrendName[idx] == imgName
-            imgAdj = imgAdj/irrTrendNorm[idx]
-                
-        ############################################################################################################
-        # Sets saturated pixels to np.nan
-        # Saturated pixels are assigned the value 65535
-        ############################################################################################################
-                
-        if checkSaturated:
-            # Gives a binary matrix with saturated values = 0 and
-            # all other values = 1
-            imarray[imarray < satThres] = 255
-            imarray[imarray > satThres] = 0 
-            
-            # Saves the mask for import in Agisoft
-            driver = gdal.GetDriverByName('Gtiff')
-            # uint8 not available with the driver byte but gives 0-255
-            dataset = driver.Create(outDirMask + imgName.split('.')[0] +'_mask.tif', ncols, nrows, 1, gdal.GDT_Byte)
-            dataset.GetRasterBand(1).WriteArray(imarray)
-            dataset = None # "Closing" the driver
+            # Reading the normalised trend (and also image names for safety)
+            bandSheet = pd.read_excel(sunshineSensorTrend, djiBand)
+            if splTrend:
+                irrTrendNorm = bandSheet['Spline norm']
+                imgTrendName = bandSheet['Img']
+            else:            
+                irrTrendNorm = bandSheet['Norm trend']
+                imgTrendName = bandSheet['Img']
             
-            # Setting saturated pixels to nan in the adjusted image.
-            # When saved to tiff nan are replaced with max value of uint16
-            imarray[imarray > 0] = 1
-            imgAdj = imgAdj*imarray
-            imgAdj[imgAdj == 0] = np.nan 
+            for idx, f in enumerate(arr):
+                assert imgTrendName[idx] == f
         
-        if plotImages:        
-            plt.imshow(imgAdj)
-            plt.colorbar()
-            plt.title('Before vignetting')
-            plt.show()
-            
-        ############################################################################################################
-        # Vignetting and Exposure Correction
-        ############################################################################################################
-        # Empty matrix with vignetting factor for each pixels (x,y)
-        r = np.ones((nrows, ncols), dtype=np.float32)
+        ########################################################################################################
+        # Reading EXIF data from the image (from the metadata cache)
+        ########################################################################################################
+        metadata_ALL = readMetadata(files, tags)
+                              
+        ########################################################################################################
+        # Extract various metadata tags for vignetting correction
+        ######################################################################################################## 
+        # Polynomial coefficients are defined as a unicode string of six coefficients separated by comma.
+        poly_coeff = [float(unicodeVal) for unicodeVal in metadata_ALL[0]['XMP:VignettingData'].split(u',')]
         
-        # Compute distance between pixel (x, y) and the center of the vignette in pixels
-        for y in range(0, nrows):
-            for x in range(0, ncols):
-                # Equation 9 from the referred document
-                r[y, x] = math.sqrt(pow((x - CenterX), 2) + pow((y - CenterY), 2))  
+        # Extract black level tag
+        black_level = metadata_ALL[0]['EXIF:BlackLevel']
         
-        # Computing vignetting factor for each image
-        correction = k5*r**6 + k4*r**5 + k3*r**4 + k2*r**3 + k1*r**2 + k0*r + 1.0
+        # Extract the X and Y coordinates of center of vignette in pixels
+        CenterX = metadata_ALL[0]['XMP:CalibratedOpticalCenterX']
+        CenterY = metadata_ALL[0]['XMP:CalibratedOpticalCenterY']
         
-        # Extract sensor gain setting and camera exposure time for each image
-        valGain = metadata['XMP:SensorGain']
-        valExptime = metadata['XMP:ExposureTime']
+        # Vignetting factor for each pixel, computed once per band (all images of a band have the same size)
+        nrows, ncols = np.shape(plt.imread(files[0]))
+        if vigComp:
+            correction = vignettingMap(poly_coeff, CenterX, CenterY, nrows, ncols)
+        else:
+            correction = np.ones((nrows, ncols), dtype=np.float32)
         
-        # Normalized camera value for each band. X refers to each band (e.g. NIR, Red, Red Edge, Green, Blue)
-        # Equation 7 from the referred document
-        Xcamera = imgAdj * correction / (valGain * (valExptime/1e6))   
+        # Remap grid aligning the band to the NIR band (the same for all images of the camera and band)
+        grid = None
+        if alignBands:
+            grid = remapGrid(metadata_ALL[0]['XMP:RelativeOpticalCenterX'], metadata_ALL[0]['XMP:RelativeOpticalCenterY'],
+                             metadata_ALL[0].get(dewarpData), CenterX, CenterY, nrows, ncols)
         
-        # To get max reflectance to convert to uint16 later
-        if np.amax(Xcamera[~np.isnan(Xcamera)]) > maxRefl:
-            maxRefl = np.amax(Xcamera[~np.isnan(Xcamera)])
-                
-        ############################################################################################################
-        # Export the corrected images
-        ############################################################################################################              
-        if saveAdjImg:
-            # Define name of output file. 
-            # Removing .TIF extension since matplotlib does not handle 1-band tiffs
-            fn = files[idx].split('\\')[-1].split('.')[0]
-            outImg = outDir + fn
+        bandMaps[djiBand] = (black_level, correction, grid)
         
-            # Matplotlib imsave gives 3-band tiffs.
-            # Instead saving temporary as npy files.
-            # NB, since the stretch must be performed before converting to
-            # uint16 all images must be handled first i.e. it is not possible
-            # to save final version already here
-
-            np.save(outImg, Xcamera)
-                
-        if plotImages:
-            plt.imshow(Xcamera)
-            plt.colorbar()
-            plt.show()
+        # Temporary memory-mapped float32 stack of the adjusted images of the band (uint16 output only), created
+        # when the band is processed so that only the stack of one band exists at a time (the stacks of all bands
+        # with alignBands, since the images of a capture are handled together)
+        stackFile = None
+        if saveAdjImg and not outFloat32:
+            stackFile = outDir + '_stack_' + djiBandAbb[djiBand] + '.npy'
+            stackShape[djiBand] = (len(files), nrows, ncols)
+        
+        # Extract sensor gain setting and camera exposure time for each image
+        bandJobs[djiBand] = [(files[idx], djiBand, idx, irrTrendNorm[idx] if adjustSunshineSensorDataFitted else None,
+                              metadata['XMP:SensorGain'], metadata['XMP:ExposureTime'], stackFile) 
+                             for idx, metadata in enumerate(metadata_ALL)]
     
-    # Store maximum reflectance per band
-    reflMaxDict[djiBand] = maxRefl
-
-################################################################################################################
-# Converting images from float to uint16 and stretching to get full range
-# NB!!!! GDAL sets float values <0 to max in uint16
-################################################################################################################
-# To get conversion factor from float -> uint16
-for key in reflMaxDict:
-    # Rounding down to nearest ones
-    reflMaxDict[key] = math.floor(satThres/(reflMaxDict[key]*1.0))*1
-       
-imgFileList = os.listdir(outDir)
-imgFileList.sort(key = lambda x: int(x.split('_')[1]))
-
-for im in imgFileList:
+    ############################################################################################################
+    # Exposure compensation, Vignetting Correction and Irradiance Normalization
+    # The images are handled in parallel by worker processes, the results are returned in image order
+    ############################################################################################################
+    if nbrWorkers > 1:
+        pool = ProcessPoolExecutor(max_workers = nbrWorkers, initializer = initWorker, initargs = (bandMaps, (outDir, outDirMask, outDirStack)))
+        mapper = lambda func, *args: pool.map(func, *args, chunksize = 4)
+    else:
+        initWorker(bandMaps, (outDir, outDirMask, outDirStack))
+        mapper = map
     
-    # Reading and converting image to uint16
-    imarray = np.load(outDir + im) 
-    tempExt = im.split('.')[0].split('_')[-1] # To get band (BLU, GRE, RED, REG, NIR)
+    ############################################################################################################
+    # Aligned 5-band images (and NDVI) of each capture
+    # The images of complete captures are adjusted, saved and aligned in one pass, capture by capture
+    ############################################################################################################
+    captureMax = {djiBand: [] for djiBand in djiBandList}
+    inCapture = set()
+    if alignBands:
+        # Images of a capture have consecutive numbers, e.g. DJI_0011_BLU, DJI_0012_GRE, ..., DJI_0015_NIR
+        jobNumbers = {int(os.path.basename(job[0]).split('_')[1]): job for djiBand in djiBandList for job in bandJobs[djiBand]}
+        
+        captures = []
+        for job in bandJobs[djiBandList[0]]:
+            number = int(os.path.basename(job[0]).split('_')[1])
+            jobs = [jobNumbers.get(number + b) for b in range(len(djiBandList))]
+            if None in jobs or [job[1] for job in jobs] != djiBandList:
+                print ('Skipping the aligned images of {} (images of the capture are missing)'.format(os.path.basename(job[0])))
+                continue
+            captures.append(jobs)
+        inCapture = set(job[0] for jobs in captures for job in jobs)
+        
+        # The temporary stacks of all bands are filled at the same time
+        if saveAdjImg and not outFloat32:
+            for djiBand in djiBandList:
+                np.lib.format.open_memmap(bandJobs[djiBand][0][-1], mode = 'w+', dtype = np.float32, shape = stackShape[djiBand])
+        
+        for maxList in mapper(correctCapture, captures):
+            for djiBand, maxRefl in zip(djiBandList, maxList):
+                captureMax[djiBand].append(maxRefl)
     
-    # Need to remove negative values otherwise GDAL sets them to max. 
-    imarray = imarray * reflMaxDict[list(djiBandAbb.keys())[list(djiBandAbb.values()).index(tempExt)]]
-    imarray[np.isnan(imarray)] = 65535 # uint cannot handle nan so setting to max value
-    imarray[imarray < 0] = 0
-    imarray = imarray.astype(np.uint16)
+    for djiBand in djiBandList:
+        
+        if verbose:
+            print ('Currently handling band: {}'.format(djiBand))
+        
+        jobs = bandJobs[djiBand]
+        
+        # Creating the temporary stack of the band
+        if saveAdjImg and not outFloat32 and not alignBands:
+            np.lib.format.open_memmap(jobs[0][-1], mode = 'w+', dtype = np.float32, shape = stackShape[djiBand])
+        
+        # Images not already handled with their capture
+        otherJobs = [job for job in jobs if job[0] not in inCapture]
+        
+        # Max reflectance of the band (reduced over the max values of all images)
+        maxRefl = max((list(mapper(correctImage, *zip(*otherJobs))) if otherJobs else []) + captureMax[djiBand] + [0])
+        
+        # Store maximum reflectance per band and the conversion factor from float -> uint16
+        # Rounding down to nearest ones
+        reflMaxDict[djiBand] = maxRefl
+        scaleDict[djiBand] = math.floor(satThres/(maxRefl*1.0))*1 if maxRefl > 0 else 1
     
-    os.remove(outDir + im) # Removing old version of file
-    im = im.split('.')[0]  # To remove the .npy extension
+        ########################################################################################################
+        # Converting images of the band from float to uint16 and stretching to get full range
+        ########################################################################################################
+        if saveAdjImg and not outFloat32:
+            stackFile = jobs[0][-1]
+            outImgs = [outDir + os.path.basename(job[0]).split('.')[0] + '.tif' for job in jobs]
+            list(mapper(stackToUint16, [stackFile]*len(jobs), range(len(jobs)), outImgs, [scaleDict[djiBand]]*len(jobs)))
+            
+            # Removing the temporary file
+            os.remove(stackFile)
     
-    # GDAL version saving directly to tiff
-    nrows, ncols = np.shape(imarray)
+    if nbrWorkers > 1:
+        pool.shutdown()
     
-    driver = gdal.GetDriverByName('Gtiff')
-    dataset = driver.Create(outDir + im +'.tif', ncols, nrows, 1, gdal.GDT_UInt16)
-
-    dataset.GetRasterBand(1).WriteArray(imarray)
+    ############################################################################################################
+    # Save the max reflectance and the uint16 conversion factor per band
+    ############################################################################################################
+    bandMax = pd.DataFrame({'Band': djiBandList, 
+                            'MaxValue': [reflMaxDict[band] for band in djiBandList], 
+                            'ScaleFactor': [scaleDict[band] for band in djiBandList]})
+    bandMax.to_csv(directory + outDirExt + '_bandMax.csv', index = False)
+            
+    ############################################################################################################
+    # Copy the EXIF file from original to adjusted images   
+    ############################################################################################################         
+    if copyEXIF and saveAdjImg:
+        # EXIF and XMP data are copied in one exiftool command, i.e. each adjusted image is rewritten once
+        outImgs = [outDir + os.path.basename(job[0]).split('.')[0] + '.tif' for djiBand in djiBandList for job in bandJobs[djiBand]]
+        copyMetadata(directory, outImgs)
     
-    dataset = None # "Closing" the driver
-        
-################################################################################################################
-# Copy the EXIF file from original to adjusted images   
-################################################################################################################         
-if copyEXIF:
-    # Exiftool commands
-    exifArgEXIF = 'exiftool -tagsFromFile ' + directory + '\\' + '%f.tif' + ' -all:all ' + outDir
-    exifArgXMP = 'exiftool -tagsFromFile ' + directory + '\\' + '%f.tif' + ' -xmp ' + outDir
-    
-    exifArgEXIFList = ['exiftool', '-tagsFromFile', directory + '\\' + '%f.tif', '-all:all ' + outDir]
-    exifArgXMPList = ['exiftool', '-tagsFromFile', directory + '\\' + '%f.tif', '-xmp ' + outDir]
-    
-    # Run the command line scripts in the terminal
-    os.system(exifArgEXIF)
-    os.system(exifArgXMP)  
-
-print ('Finished exposure, vignetting compensation and irradiance normalization (optionally).')
-print ('Check the newly created folders with normalized images and image mask for saturated pixels.')
+    print ('Finished exposure, vignetting compensation and irradiance normalization (optionally).')
+    print ('Check the newly created folders with normalized images and image mask for saturated pixels.')
        
 ################################################################################################################
 ################################################################################################################
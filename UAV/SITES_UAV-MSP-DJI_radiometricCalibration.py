@@ -10,23 +10,65 @@ This Python script is used to apply empirical line correction for radiometric ca
 UAV orthomosaic. Finally, the reflectance map and computed Normalized Difference Vegetation Index (NDVI) layer
 are exported as .TIF files to the same file path as the original orthomosaic. 
 
+The orthomosaic is calibrated block by block (blockRows rows at a time), so the memory use does not depend on
+the size of the orthomosaic. Spectral indices (e.g. NDVI, NDRE, GNDVI, OSAVI) are computed in the same pass from
+the reflectance of each block, in float32, and every index is exported as a compressed float32 .TIF file, e.g.
+...orthomosaic_NDVI.tif. The indices are given as expressions of the band reflectances in the parameter
+setting section (see SITES_UAV_utils.py), so adding an index doesn't need another read of the orthomosaic.
+
+The reflectance image and the spectral indices are exported as Cloud Optimized GeoTIFFs (tiled, compressed and
+with overviews) with the georeferencing of the orthomosaic embedded, so no .tfw files are needed.
+
+Several flights (e.g. a whole season of all stations) can be calibrated in one run with a manifest, a .csv file
+with one row per flight and the columns:
+
+    Mosaic      : File path of the orthomosaic
+    PanelDN     : File path of the .xlsx file with the mean DN values of the panels (avg4cal.xlsx)
+    PanelType   : Reflectance panels used during the flight (1 = Spectralon; 2 = MosaicMill)
+    Sensor      : Sensor of the orthomosaic (MSP = DJI P4 Multispectral; RGB = DJI RGB camera)
+
+Relative file paths are relative to the folder of the manifest. The orthomosaics are calibrated in parallel by
+worker processes (nbrWorkers), and the gain (slope) and offset (intercept) of the empirical line of each band are
+saved in a .csv file next to the manifest, e.g. ...manifest_empLine.csv, with the status of each flight (OK or
+the error of a failed flight). Failed flights are listed at the end, and the script then exits with an error.
+The empirical line is fitted in closed form (least squares). The reflectance of the panels is read once from
+SITES_UAV_panelReflectance.csv (one row per sensor, panel type, panel and band). The Cloud Optimized GeoTIFFs are
+compressed in parallel threads, shared by the worker processes.
+
+Orthomosaics of the DJI RGB camera (SITES_UAV-RGB-DJI_MeanDN-RefPanels.py for the mean DN values of the panels) 
+are calibrated with the same block by block path. The bands of the RGB orthomosaic (RED, GRE, BLU) are calibrated
+with the panel reflectances of the RGB sensor, and the reflectance is saved as a 3-band uint16 image (reflectance
+* 10000, as for the multispectral orthomosaics, also when the orthomosaic is 8-bit). The indices of each sensor
+are set in indexList, e.g. the Green and Red Chromatic Coordinate (GCC, RCC) for RGB. Pixels outside the
+orthomosaic (alpha band or nodata of the orthomosaic) are set to 0 in the reflectance image and NaN in the indices.
+
 Note: The script was tested on windows environment in Python 3.7.6 version only. This script is only for the 
       internal use within SITES.
 
 Package installation:
     a) gdal    
     b) pandas
+    c) Matplotlib
     
 Instructions for running the script:
     a) Make sure all the required modules are installed.
-    b) Change panelType based on the panels used during the flight.
-    b) Run the script and follow the instructions displayed. Provide complete file path to
+    b) Change panelType based on the panels used during the flight (not needed for a manifest).
+    c) Set the spectral indices to compute in indexList.
+    d) SITES_UAV_utils.py and SITES_UAV_panelReflectance.csv must be placed in the same folder as this script.
+    e) Run the script and follow the instructions displayed. Provide complete file path to
        multispectral UAV orthomosaic as well as to the .xlsx file containing mean DN values
-       for radiometric calibration.
+       for radiometric calibration, or the complete file path to a manifest of flights (.csv).
 
 Limitations of the script:
-    a) Script is programmed to handle UAV orthomosaics with 5 bands that follows DJI P4 specification.
-    b) Fails if the computer configuration is not sufficient for handling large data.
+    a) Script is programmed to handle UAV orthomosaics with 5 bands that follows DJI P4 specification, and RGB 
+       orthomosaics (red, green and blue band, optionally followed by an alpha band) of the DJI RGB camera.
+    b) GDAL 3.1 or newer is needed for the Cloud Optimized GeoTIFFs.
+    c) Bands with less than two valid panel values are not calibrated. Their original values are kept in the
+       reflectance image, and indices using them are set to NaN.
+    d) The images are only plotted (plotImages = True) for a single orthomosaic, not for a manifest.
+    e) SITES_UAV_panelReflectance.csv holds no panel reflectances of the RGB sensor yet, so RGB flights stop with
+       an error. Add the panel reflectances measured for the spectral response of the RGB camera as rows with
+       the sensor RGB and the bands RED, GRE and BLU (the P4 Multispectral values don't apply to its broad bands).
     
 For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
                                         per-ola.olsson@nateko.lu.se
@@ -40,208 +82,351 @@ For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
 # Importing required modules
 ################################################################################################################
 import os
-import copy
+import sys
 import numpy as np
 import pandas as pd
 from osgeo import gdal
 import matplotlib.pyplot as plt
-from sklearn.linear_model import LinearRegression
+from concurrent.futures import ProcessPoolExecutor
+from SITES_UAV_utils import indexDict, parseIndex, evalIndex, tempGeoTIFF, writeCOG
 
 ################################################################################################################
 # Paths and parameters to set
 ################################################################################################################
 
-# Define file path for orthophoto to be corrected for radiometry
-orgImg = input("Enter full file path of the multispectral orthomosaic: ") 
-
 # Name appended to reflectance orthophoto (after empirical line)
 ReflImgExt = '_refl'
 
-# Number of bands in reflectance image to save (5 is with spectral bands only)
-nbrBands = 5
-
-# Excel sheet with mean DN values for the reflectance panels in the orthophoto to calcualte reflectance for
-reflPanValFile = input("Enter full file path of .xlsx file with mean DN values for radiometric calibration: ") 
-
 # Sheet in the Excel with acutal mean values for the reflectance panels
 ValSheet = 'EmpLineValues'
 
 # Which reflectance panels are used: 1 = Spectralon; 2 = MosaicMill
-# Change it as per the panels used.
+# Change it as per the panels used (only used for a single orthomosaic, the manifest gives it per flight).
 panelType = 2
 
-# Reflectance values for the panels (rough refelctance, "real" values derived from dictionary below)
-if panelType == 1:
-    reflPercentage = ['5', '20', '50'] # For Spectralon
-elif panelType == 2:
-    reflPercentage = ['9', '23', '44'] # For MosaicMill
+# Sensor of the orthomosaic (only used for a single orthomosaic, the manifest gives it per flight)
+sensor = 'MSP'
 
-# Plotting images or not
+# Spectral bands of each sensor, in the band order of the orthomosaic
+# DJI P4 spectral bands and DJI RGB bands. Included as list to ensure band order is correct. 
+sensorBands = {'MSP': ['BLU', 'GRE', 'RED', 'REG', 'NIR'],
+               'RGB': ['RED', 'GRE', 'BLU']}
+
+# Reflectance of the panels per sensor, panel type, panel and band
+panelReflFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SITES_UAV_panelReflectance.csv')
+
+# Plotting images or not (the images are plotted at a reduced size, at most plotSize pixels wide). Only used for 
+# a single orthomosaic, the flights of a manifest are never plotted.
 plotImages = True
+plotSize = 1000
 verbose = True
-computeNDVI = True # Set to False if you don't want NDVI computation
+
+# Spectral indices computed in the same pass as the calibration for each sensor (name: expression of the band 
+# reflectances of the sensor). Predefined indices are found in indexDict of SITES_UAV_utils.py, other indices can
+# be added here, e.g. 'SR': 'NIR / RED'.
+computeIndices = True # Set to False if you don't want the spectral indices
+indexList = {'MSP': {name: indexDict[name] for name in ['NDVI', 'NDRE', 'GNDVI', 'OSAVI']},
+             'RGB': {name: indexDict[name] for name in ['GCC', 'RCC']}}
+
+# Number of image rows read, calibrated and written at a time
+blockRows = 512
+
+# Number of orthomosaics of a manifest calibrated in parallel (1 calibrates them one at a time without worker 
+# processes). At most one worker per flight is started.
+nbrWorkers = os.cpu_count() or 1
 
 ################################################################################################################
-# Define standard reflectance values for the panels chosen and read the orthomosaic
+# Function definitions
 ################################################################################################################
-# DJI P4 spectral bands. Included as list to ensure band order is correct. 
-djiBandList = ['BLU', 'GRE', 'RED', 'REG', 'NIR']
-
-bandProc = '' # To append names of corrected bands to file name later
-
-# The bands and reflectance panel reflectances for 5%, 20%, 50%
-if panelType == 1:
-    djiBandDict = {'BLU': [0.036542424,	0.201557576, 0.481509091], 'GRE':[0.037827273, 0.213139394, 0.500790909], 
-               'RED':[0.039157576, 0.222890909, 0.515169697], 'REG':[0.04050303, 0.231678788, 0.527287879], 
-               'NIR':[0.04345283, 0.244384906, 0.543090566]}
-    
-# The bands and reflectance panel reflectances for 9%, 23%, 44%    
-elif  panelType == 2:
-    djiBandDict = {'BLU': [0.071864034, 0.217418623, 0.382620256], 'GRE':[0.068064604, 0.218853955, 0.45281708], 
-               'RED':[0.076557511, 0.22275384, 0.43940517], 'REG':[0.084988391, 0.234725921, 0.466921599], 
-               'NIR':[0.100331593, 0.251634465, 0.497430071]}        
-
-# Reading Excel sheet as a dataframe
-reflPanValues = pd.ExcelFile(reflPanValFile)
-reflPanValSheet = pd.read_excel(reflPanValues, ValSheet)
-
-model = LinearRegression()
-
-# Reading original TIFF
-orgTIFF = gdal.Open(orgImg, gdal.GA_ReadOnly)
-
-# And creating a new "empty" tiff with the same size as original
-nbrCols = orgTIFF.RasterXSize
-nbrRows = orgTIFF.RasterYSize
-
-orgImgBase, orgImgExt = orgImg.split('.')
-outImgName = orgImgBase + ReflImgExt + '.' + orgImgExt
-
-# Reading just to get data type
-tempDT = orgTIFF.GetRasterBand(1)
-tiffDataType = tempDT.DataType
-del tempDT
-# Need same driver
-driver = orgTIFF.GetDriver()
-# Finally creating new tiff file
-outImgGDAL = driver.Create(outImgName, nbrCols, nbrRows, nbrBands, tiffDataType)
-#outImgGDAL = driver.Create(outImgName, nbrCols, nbrRows, nbrBands, gdal.GDT_Float32)
-
-if verbose:
-    print(outImgGDAL)
-    print(driver)
-    print(gdal.GetDataTypeName(tiffDataType))
+
+def readPanelReflectance(panelFile):
+    '''
+    Reads the reflectance of the panels as {(sensor, panel type): (panel names, {band: reflectances})}, with
+    the panels in the order of the file (e.g. 9, 23, 44).
+    '''
+    panels = pd.read_csv(panelFile, dtype = {'Sensor': str, 'Panel': str})
     
-################################################################################################################
-# Performing empirical line correction and saving the reflectance tiff
-################################################################################################################
+    tables = {}
+    for (sensorName, panelNbr), table in panels.groupby(['Sensor', 'PanelType'], sort = False):
+        panelNames = list(dict.fromkeys(table['Panel']))
+        bandRefl = {band: rows.set_index('Panel')['Reflectance'].reindex(panelNames).to_numpy(np.float64)
+                    for band, rows in table.groupby('Band', sort = False)}
+        tables[(sensorName, int(panelNbr))] = (panelNames, bandRefl)
     
-for idx, band in enumerate(djiBandList):
-    panelRefl = np.array(djiBandDict[band])
-    
-    # Extracting mean reflectance for the reflectance panels in the orthophoto
-    # Setting NaN for saturated panels
-    orthoRefl = np.full(3, np.nan)
-    nbrReflVal = 0
-    for i, r in enumerate(reflPercentage):
-        tempRefl = band + '_' + r
-        if reflPanValSheet[tempRefl][0] > 0:
-            orthoRefl[i] = reflPanValSheet[tempRefl][0]
-            nbrReflVal += 1
-        
-        print(tempRefl)
-   
-    print(orthoRefl)
+    return tables
+
+def empiricalLine(panelDN, panelRefl):
+    '''
+    Closed form least squares fit of the panel reflectances on the mean DN of the panels. Returns the gain 
+    (slope), the offset (intercept) and the coefficient of determination.
+    '''
+    dnDev = panelDN - panelDN.mean()
+    reflDev = panelRefl - panelRefl.mean()
     
-    # Finding indices of NaN to omit in regression
-    nonNanIdx = ~np.isnan(orthoRefl)
+    slope = (dnDev * reflDev).sum() / (dnDev ** 2).sum()
+    intercept = panelRefl.mean() - slope * panelDN.mean()
     
-    orthoRefl = orthoRefl[nonNanIdx].reshape(-1, 1)
+    residuals = panelRefl - (slope * panelDN + intercept)
+    rSquared = 1 - (residuals ** 2).sum() / (reflDev ** 2).sum() if (reflDev ** 2).sum() > 0 else 1.0
     
-    panelRefl = panelRefl[np.transpose(nonNanIdx)]
+    return slope, intercept, rSquared
+
+def initWorker(tables, trees, threads = 'ALL_CPUS', plot = False):
+    '''
+    Makes the panel reflectance tables, the parsed index expressions, the number of threads compressing the
+    Cloud Optimized GeoTIFFs and whether the images are plotted available to a worker process. Called once 
+    per worker instead of reading the tables for every orthomosaic.
+    '''
+    global panelTables, indexTrees, cogThreads, showPlots
+    panelTables = tables
+    indexTrees = trees
+    cogThreads = threads
+    showPlots = plot
+
+def calibrateMosaic(orgImg, reflPanValFile, panelType, sensor):
+    '''
+    Empirical line calibration of one orthomosaic with the mean DN values of the panels in reflPanValFile.
+    Saves the reflectance image and the spectral indices as Cloud Optimized GeoTIFFs next to the orthomosaic
+    and returns the empirical line of each band as a list of dictionaries.
+    '''
+    bandList = sensorBands[sensor]
+    reflPercentage, bandDict = panelTables[(sensor, panelType)]
+    trees = indexTrees[sensor]
     
-    print(panelRefl)
+    bandProc = '' # To append names of corrected bands to file name later
     
-    model = LinearRegression().fit(orthoRefl, panelRefl)
+    # Reading Excel sheet as a dataframe
+    reflPanValSheet = pd.read_excel(reflPanValFile, ValSheet)
     
-    if verbose:    
-        print('Coefficient of determination: {}'.format(model.score(orthoRefl, panelRefl)))
-        print('Intercept: {}'.format(model.intercept_))
-        print('Slope: {}'.format(model.coef_))
+    # Reading original TIFF
+    orgTIFF = gdal.Open(orgImg, gdal.GA_ReadOnly)
     
-    tiffBand = orgTIFF.GetRasterBand(idx+1)
-    tiffArray = tiffBand.ReadAsArray()
+    # And creating a new "empty" tiff with the same size as original
+    nbrCols = orgTIFF.RasterXSize
+    nbrRows = orgTIFF.RasterYSize
     
-    if plotImages:
-        plt.imshow(tiffArray)
-        plt.title('Original TIFF')
-        plt.show()
+    if orgTIFF.RasterCount < len(bandList):
+        raise ValueError('{} has {} bands, but the {} sensor has {} bands'.format(orgImg, orgTIFF.RasterCount, sensor, len(bandList)))
+    
+    orgImgBase, orgImgExt = os.path.splitext(orgImg)
+    outImgName = orgImgBase + ReflImgExt + orgImgExt
+    
+    # Reading just to get data type (8-bit orthomosaics, e.g. RGB, are saved as uint16 to hold reflectance * 10000)
+    tiffDataType = orgTIFF.GetRasterBand(1).DataType
+    outDataType = gdal.GDT_UInt16 if tiffDataType == gdal.GDT_Byte else tiffDataType
+    
+    # Pixels outside the orthomosaic (mask of the alpha band or of the nodata value of the first band)
+    maskBand = orgTIFF.GetRasterBand(1).GetMaskBand()
+    useMask = orgTIFF.GetRasterBand(1).GetMaskFlags() != gdal.GMF_ALL_VALID
+    
+    # Finally creating new tiff file (temporary tiled tiff with the georeferencing of the original, converted to
+    # a Cloud Optimized GeoTIFF at the end)
+    outImgGDAL = tempGeoTIFF(outImgName, orgTIFF, len(bandList), outDataType)
+    
+    # One float32 tiff per spectral index
+    indexNames = {name: orgImgBase + '_' + name + orgImgExt for name in trees}
+    indexGDAL = {}
+    for name in trees:
+        indexGDAL[name] = tempGeoTIFF(indexNames[name], orgTIFF, 1, gdal.GDT_Float32)
+        indexGDAL[name].GetRasterBand(1).SetNoDataValue(np.nan)
+    
+    if verbose:
+        print('{}: {} bands of {}'.format(os.path.basename(orgImg), sensor, gdal.GetDataTypeName(tiffDataType)))
+    
+    ############################################################################################################
+    # Empirical line (least squares fit of panel reflectance on the mean DN of the panels) for each band
+    ############################################################################################################
+    bandModels = {}
+    empLine = []
+    
+    for idx, band in enumerate(bandList):
+        panelRefl = bandDict[band]
+        
+        # Extracting mean DN for the reflectance panels in the orthophoto
+        # Setting NaN for saturated panels
+        orthoDN = np.array([reflPanValSheet[band + '_' + r][0] for r in reflPercentage], dtype = np.float64)
+        orthoDN[~(orthoDN > 0)] = np.nan
+        
+        # Finding indices of NaN to omit in regression
+        nonNanIdx = ~np.isnan(orthoDN)
+        
+        # Bands with less than two valid panels are not calibrated
+        if nonNanIdx.sum() < 2:
+            print('{}: band {} is not calibrated (less than two valid panel values)'.format(os.path.basename(orgImg), band))
+            continue
+        
+        slope, intercept, rSquared = empiricalLine(orthoDN[nonNanIdx], panelRefl[nonNanIdx])
         
-        if nbrReflVal > 1:
-            bandProc  += '_' + band
-            reflArray = tiffArray*model.coef_[0] + model.intercept_
+        if verbose:
+            print('{} {}: slope {}, intercept {}, coefficient of determination {}'.format(os.path.basename(orgImg), 
+                                                                                       band, slope, intercept, rSquared))
         
-            plt.imshow(reflArray)
+        bandProc  += '_' + band
+        bandModels[band] = (np.float32(slope), np.float32(intercept))
+        empLine.append({'Mosaic': orgImg, 'Band': band, 'Slope': slope, 'Intercept': intercept, 'R2': rSquared,
+                        'Panels': ' '.join(r for r, valid in zip(reflPercentage, nonNanIdx) if valid)})
+        
+        if showPlots:
+            # Reduced size image of the band for plotting
+            plotCols = min(plotSize, nbrCols)
+            plotRows = max(1, round(nbrRows * plotCols / nbrCols))
+            tiffArray = orgTIFF.GetRasterBand(idx+1).ReadAsArray(buf_xsize = plotCols, buf_ysize = plotRows).astype(np.float32)
+            
+            plt.imshow(tiffArray)
+            plt.title('Original TIFF')
+            plt.show()
+            
+            plt.imshow(tiffArray*bandModels[band][0] + bandModels[band][1])
             plt.title('Reflectance')
             plt.colorbar()
             plt.show()
     
-    if computeNDVI:   
-        # Need to make deep coppies as Python will only copy the reference otherwise
-        if "RED" in band:
-            NDVIRED = copy.deepcopy(reflArray)
-        elif "NIR" in band:
-            NDVINIR = copy.deepcopy(reflArray)
-    
-    # Saving reflectance to the tiff file
-    # First needs to scale and convert to integer
-    # and remove negative numbers (which will otherwise be max value)
-    if nbrReflVal > 1:
-        reflArray[reflArray<0] = 0
-        reflArray *= 10000 
-        reflArray = np.uint16(reflArray)
-        # Need idx+1 since raster band index start at 1
-        outImgGDAL.GetRasterBand(idx+1).WriteArray(reflArray)
-    else:
-        outImgGDAL.GetRasterBand(idx+1).WriteArray(tiffArray)
-
-# "Closing" the driver    
-outImgGDAL = None        
-
-## Renaming image to append processed band names to file name
-#curr_name = orgImgBase + ReflImgExt + '.' + orgImgExt
-#new_name = orgImgBase + ReflImgExt + bandProc + '.' + orgImgExt
-#os.rename(curr_name, new_name)
+    ############################################################################################################
+    # Performing empirical line correction and saving the reflectance tiff and the spectral indices
+    # One block of rows at a time, all bands of a block are read once
+    ############################################################################################################
+    for r0 in range(0, nbrRows, blockRows):
+        nrows = min(blockRows, nbrRows - r0)
+        
+        outside = maskBand.ReadAsArray(0, r0, nbrCols, nrows) == 0 if useMask else None
+        
+        reflBands = {}
+        for idx, band in enumerate(bandList):
+            tiffArray = orgTIFF.GetRasterBand(idx+1).ReadAsArray(0, r0, nbrCols, nrows)
+            
+            if band not in bandModels:
+                # Original values are kept, and the band isn't used for the indices
+                outImgGDAL.GetRasterBand(idx+1).WriteArray(tiffArray, 0, r0)
+                reflBands[band] = np.full(tiffArray.shape, np.nan, dtype = np.float32)
+                continue
+            
+            slope, intercept = bandModels[band]
+            reflArray = tiffArray.astype(np.float32)
+            reflArray *= slope
+            reflArray += intercept
+            if useMask:
+                np.copyto(reflArray, np.nan, where = outside)
+            reflBands[band] = reflArray
+            
+            # Saving reflectance to the tiff file
+            # First needs to scale and convert to integer
+            # and remove negative numbers (which will otherwise be max value)
+            # Need idx+1 since raster band index start at 1
+            # (pixels outside the orthomosaic are NaN and saved as 0)
+            outImgGDAL.GetRasterBand(idx+1).WriteArray(np.uint16(np.nan_to_num(np.clip(reflArray, 0, None)) * 10000), 0, r0)
+        
+        # Spectral indices of the block
+        for name, tree in trees.items():
+            indexGDAL[name].GetRasterBand(1).WriteArray(evalIndex(tree, reflBands).astype(np.float32, copy = False), 0, r0)
+        
+        if verbose:
+            print('{}: calibrated rows {} - {} of {}'.format(os.path.basename(orgImg), r0, r0 + nrows, nbrRows))
+    
+    # "Closing" the driver    
+    outImgGDAL = None        
+    for name in trees:
+        indexGDAL[name] = None
+    orgTIFF = None
+    
+    ## Renaming image to append processed band names to file name
+    #curr_name = orgImgBase + ReflImgExt + orgImgExt
+    #new_name = orgImgBase + ReflImgExt + bandProc + orgImgExt
+    #os.rename(curr_name, new_name)
+    
+    ############################################################################################################
+    # Converting the tiffs to Cloud Optimized GeoTIFFs (compressed, with overviews and embedded georeferencing)
+    ############################################################################################################
+    if verbose:
+        print('{}: writing Cloud Optimized GeoTIFFs'.format(os.path.basename(orgImg)))
+    
+    writeCOG(outImgName, threads = cogThreads)
+    for name in trees:
+        writeCOG(indexNames[name], threads = cogThreads)
     
-# Creating the tfw-file for the new tiff
-copyTFWstring = 'copy ' + orgImgBase + '.tfw ' + orgImgBase + ReflImgExt + '.tfw'
-os.popen(copyTFWstring)
+    return empLine
 
 ################################################################################################################
-# NDVI computation and export
+# Main program
+# The guard is needed since the worker processes import this script on Windows
 ################################################################################################################
-# Handling NDVI
-if computeNDVI:
+if __name__ == '__main__':
     
-    NDVIArray = (NDVINIR - NDVIRED)/(NDVINIR + NDVIRED)
-    NDVIArray[NDVIArray<0] = 0
-    NDVIArray *= 10000 
-    NDVIArray = np.uint16(NDVIArray)
+    # Define file path for orthophoto to be corrected for radiometry, or for a manifest of flights
+    orgImg = input("Enter full file path of the multispectral orthomosaic, or of a manifest of flights (.csv): ") 
     
-    NDVIFileName = orgImgBase + '_NDVI.' + orgImgExt
-    outImgNDVI = driver.Create(NDVIFileName, nbrCols, nbrRows, 1, tiffDataType)
-    outImgNDVI.GetRasterBand(1).WriteArray(NDVIArray)
-
-    # Creating the tfw-file for the new tiff
-    copyTFWstringNDVI = 'copy ' + orgImgBase + '.tfw ' + orgImgBase + '_NDVI.tfw'
-    os.popen(copyTFWstringNDVI)    
+    if orgImg.lower().endswith('.csv'):
+        # One row per flight, relative file paths are relative to the folder of the manifest
+        manifest = pd.read_csv(orgImg, dtype = {'Mosaic': str, 'PanelDN': str, 'Sensor': str})
+        manifestDir = os.path.dirname(os.path.abspath(orgImg))
+        flights = [(os.path.join(manifestDir, row.Mosaic), os.path.join(manifestDir, row.PanelDN), int(row.PanelType), row.Sensor)
+                   for row in manifest.itertuples()]
+        empLineFile = os.path.splitext(orgImg)[0] + '_empLine.csv'
+    else:
+        # Excel sheet with mean DN values for the reflectance panels in the orthophoto to calcualte reflectance for
+        reflPanValFile = input("Enter full file path of .xlsx file with mean DN values for radiometric calibration: ") 
+        flights = [(orgImg, reflPanValFile, panelType, sensor)]
+        empLineFile = None
     
-    outImgNDVI = None # "Closing" the driver
-
-print('\n')
-print('Radiometric calibration performed successfully.')
-print('Check the reflectance and NDVI image layers in .tif format in the same file path as the original data.')
+    ############################################################################################################
+    # Reading the panel reflectances once and parsing the index expressions of each sensor (fails here on 
+    # invalid flights or expressions, before any processing)
+    ############################################################################################################
+    panelTables = readPanelReflectance(panelReflFile)
+    indexTrees = {name: {index: parseIndex(expression, bands) for index, expression in indexList.get(name, {}).items()} 
+                  if computeIndices else {} for name, bands in sensorBands.items()}
+    
+    for flight in flights:
+        if flight[3] not in sensorBands or (flight[3], flight[2]) not in panelTables:
+            sys.exit('Error: No panel reflectance for sensor {} and panel type {} in {} ({})'.format(flight[3], flight[2], 
+                     os.path.basename(panelReflFile), flight[0]))
+        for path in flight[:2]:
+            if not os.path.isfile(path):
+                sys.exit('Error: File {} does not exist'.format(path))
+    
+    ############################################################################################################
+    # Calibrating the orthomosaics, in parallel by worker processes
+    # The COG compression threads are shared by the workers, so that the cores are not oversubscribed
+    ############################################################################################################
+    workers = min(nbrWorkers, len(flights))
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers = workers, initializer = initWorker, 
+                                   initargs = (panelTables, indexTrees, max(1, (os.cpu_count() or 1) // workers)))
+        futures = [pool.submit(calibrateMosaic, *flight) for flight in flights]
+    else:
+        # The images are plotted for a single orthomosaic only
+        initWorker(panelTables, indexTrees, plot = plotImages and empLineFile is None)
+    
+    # Empirical lines of the flights, and the flights that failed with the error
+    results = []
+    failed = []
+    for i, flight in enumerate(flights):
+        try:
+            results.append(futures[i].result() if workers > 1 else calibrateMosaic(*flight))
+        except Exception as error:
+            print('Calibration of {} failed: {}'.format(flight[0], error))
+            failed.append((flight[0], error))
+            results.append([{'Mosaic': flight[0], 'Status': 'Failed: {}'.format(error)}])
+    
+    if workers > 1:
+        pool.shutdown()
+    
+    ############################################################################################################
+    # Save the empirical line of each band of the flights of the manifest (with the status of each flight)
+    ############################################################################################################
+    if empLineFile:
+        pd.DataFrame([dict(row, Status = row.get('Status', 'OK')) for empLine in results for row in empLine], 
+                     columns = ['Mosaic', 'Band', 'Slope', 'Intercept', 'R2', 'Panels', 'Status']).to_csv(empLineFile, index = False)
+        print('The empirical lines of the bands are saved in {}'.format(empLineFile))
+    
+    print('\n')
+    if failed:
+        print('Radiometric calibration failed for {} of {} orthomosaics:'.format(len(failed), len(flights)))
+        for mosaic, error in failed:
+            print('    {}: {}'.format(mosaic, error))
+        sys.exit(1)
+    
+    print('Radiometric calibration performed successfully.')
+    print('Check the reflectance and spectral index image layers in .tif format in the same file path as the original data.')
 
 ################################################################################################################
 ################################################################################################################
-
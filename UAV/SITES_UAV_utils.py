@@ -0,0 +1,278 @@
+"""
+***************************************************************************************************************
+#########################################################
+Shared functions for the UAV processing scripts
+
+Created on Mon Oct 26 10:14:38 2026
+#########################################################
+
+This Python module collects functions that are used by more than one of the UAV processing scripts (e.g. Step 1
+SITES_UAV-MSP-DJI_exifReaderWriter.py and Step 3 SITES_UAV-MSP-DJI_exposureVignetting_irradianceNormalization.py).
+It is not run on its own, but imported by the scripts placed in the same folder.
+
+    a) Metadata cache   : All EXIF and XMP tags of the images of a flight are read in one batched exiftool
+                          session and stored in a SQLite database next to the flight folder, e.g.
+                                ...SWE-LON-SFAB-AGR-msp-210604-U01_metadata.sqlite
+                          The steps then read the tags they need from the database instead of running exiftool
+                          over the flight again. Images that are new or modified (file size or modification
+                          time) since they were cached are read again with exiftool.
+    b) Metadata copying : All EXIF and XMP tags of the original images are copied to the processed images (same
+                          name) with one exiftool command for all images, sent as argument file to a
+                          stay_open exiftool session. Each processed image is rewritten once, without
+                          keeping a backup copy.
+    c) Spectral indices : Band math expressions of the band reflectances (e.g. '(NIR - RED) / (NIR + RED)' with
+                          the band names BLU, GRE, RED, REG and NIR, or RED, GRE and BLU of the RGB camera)
+                          evaluated in float32 on blocks of the orthomosaic. The expressions are parsed once
+                          and only numbers, band names, the operators + - * / ** and parentheses are accepted
+                          (no Python code is run).
+    d) COG output       : The data products (e.g. reflectance orthomosaic and spectral indices) are written block
+                          by block to a temporary tiled GeoTIFF with the georeferencing of the orthomosaic,
+                          which is then converted to a Cloud Optimized GeoTIFF (COG): tiled, compressed (DEFLATE
+                          or ZSTD, compressed in parallel threads) and with overviews, so that viewers and
+                          windowed reads only read the tiles and the overview level they need.
+
+Note: The module was tested on windows environment in Python 3.7.6 version only. This module is only for the
+      internal use within SITES.
+
+Package installation:
+    a) exiftool (only needed for the metadata cache and copying)
+    b) PyExifTool (only needed for the metadata cache and copying)
+    c) numpy
+    d) gdal (only needed for the Cloud Optimized GeoTIFFs, version 3.1 or newer)
+
+Limitations of the module:
+    a) Binary tags (e.g. thumbnail images) are not cached, exiftool only reports their size.
+    b) The cache is keyed by image name. Rename the images as per the SITES Standard before the cache is
+       created (Step 1).
+
+Important information:
+    a) Download and read more on Exiftool:
+       https://exiftool.org/
+
+    b) Download and read more on PyExifTool:
+       https://github.com/sylikc/pyexiftool
+
+For enquiries, please send an email to: shangharsha.thapa@nateko.lu.se
+                                        lars.eklundh@nateko.lu.se
+
+@author: Shangharsha
+"""
+################################################################################################################
+# Importing required modules
+################################################################################################################
+import os
+import ast
+import json
+import sqlite3
+import numpy as np
+
+################################################################################################################
+# Paramter setting section
+################################################################################################################
+
+# Extension of the metadata cache next to the flight folder
+metadataCacheExt = '_metadata.sqlite'
+
+# Number of images read per exiftool call when the cache is filled (one exiftool session for all calls)
+metadataChunk = 500
+
+# Compression (DEFLATE or ZSTD, ZSTD is faster but needs a GDAL built with ZSTD) and tile size of the Cloud
+# Optimized GeoTIFFs
+cogCompress = 'DEFLATE'
+cogBlockSize = 512
+
+# Spectral indices (name: expression of the band reflectances)
+indexDict = {'NDVI' : '(NIR - RED) / (NIR + RED)',
+             'NDRE' : '(NIR - REG) / (NIR + REG)',
+             'GNDVI': '(NIR - GRE) / (NIR + GRE)',
+             'OSAVI': '1.16 * (NIR - RED) / (NIR + RED + 0.16)',
+             'GCC'  : 'GRE / (RED + GRE + BLU)',
+             'RCC'  : 'RED / (RED + GRE + BLU)'}
+
+################################################################################################################
+# Metadata cache
+################################################################################################################
+
+def metadataCachePath(directory):
+    '''
+    Path of the metadata cache of the flight images in directory.
+    '''
+    return directory.rstrip('\\/') + metadataCacheExt
+
+def openMetadataCache(directory):
+    '''
+    Opens (and creates if needed) the metadata cache of the flight images in directory.
+    '''
+    db = sqlite3.connect(metadataCachePath(directory))
+    db.execute('CREATE TABLE IF NOT EXISTS files (Image TEXT PRIMARY KEY, Bytes INTEGER, Modified INTEGER)')
+    db.execute('CREATE TABLE IF NOT EXISTS tags (Image TEXT, Tag TEXT, Value TEXT, PRIMARY KEY (Image, Tag)) WITHOUT ROWID')
+    db.execute('CREATE INDEX IF NOT EXISTS tagIndex ON tags (Tag)')
+
+    return db
+
+def updateMetadataCache(files):
+    '''
+    Reads all EXIF and XMP tags of the images (complete file paths, all in the same folder) that are not yet in
+    the metadata cache, or were modified since they were cached, in one exiftool session.
+    '''
+    directory = os.path.dirname(files[0])
+    db = openMetadataCache(directory)
+
+    cached = {img: (nbrBytes, modified) for img, nbrBytes, modified in db.execute('SELECT * FROM files')}
+    toRead = [f for f in files if cached.get(os.path.basename(f)) != (os.path.getsize(f), int(os.path.getmtime(f)))]
+
+    if toRead:
+        import exiftool
+        
+        print ('Reading the metadata of {} images into {}'.format(len(toRead), metadataCachePath(directory)))
+
+        with exiftool.ExifTool() as et:
+            for i in range(0, len(toRead), metadataChunk):
+                chunk = toRead[i:i + metadataChunk]
+                metadata = et.get_metadata_batch(chunk)
+
+                with db:
+                    for f, file_metadata in zip(chunk, metadata):
+                        img = os.path.basename(f)
+                        db.execute('DELETE FROM tags WHERE Image = ?', (img,))
+                        db.executemany('INSERT INTO tags VALUES (?, ?, ?)',
+                                       [(img, tag, json.dumps(val)) for tag, val in file_metadata.items()])
+                        db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)',
+                                   (img, os.path.getsize(f), int(os.path.getmtime(f))))
+
+    db.close()
+
+def readMetadata(files, tags):
+    '''
+    Returns the tags (e.g. 'XMP:Irradiance') of the images as a list of dictionaries in the order of files,
+    like get_tags_batch of PyExifTool. The tags are read from the metadata cache, which is updated first.
+    '''
+    updateMetadataCache(files)
+
+    db = openMetadataCache(os.path.dirname(files[0]))
+    images = [os.path.basename(f) for f in files]
+    metadata = {img: {'SourceFile': f} for img, f in zip(images, files)}
+
+    query = 'SELECT Image, Tag, Value FROM tags WHERE Tag IN ({})'.format(', '.join('?' * len(tags)))
+    for img, tag, val in db.execute(query, tags):
+        if img in metadata:
+            metadata[img][tag] = json.loads(val)
+
+    db.close()
+
+    return [metadata[img] for img in images]
+
+################################################################################################################
+# Metadata copying
+################################################################################################################
+
+def copyMetadata(directory, outFiles, srcExt = '.TIF'):
+    '''
+    Copies all EXIF and XMP tags of the original images in directory to the processed images outFiles (complete
+    file paths) with the same name, e.g. from DJI_0011_BLU.TIF to DJI_0011_BLU.tif in the output folder.
+    '''
+    if not outFiles:
+        return
+
+    # One command with all images, the arguments are passed to exiftool as argument file (-@) by PyExifTool
+    params = ['-tagsFromFile', os.path.join(directory, '%f' + srcExt), '-all:all', '-xmp', '-overwrite_original']
+
+    import exiftool
+    
+    with exiftool.ExifTool() as et:
+        result = et.execute(*[os.fsencode(param) for param in params + list(outFiles)])
+
+    print (result.decode(errors = 'replace').strip() if isinstance(result, bytes) else result.strip())
+
+################################################################################################################
+# Spectral indices
+################################################################################################################
+
+# Operators accepted in the index expressions
+indexOperators = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide, 
+                  ast.Pow: np.power, ast.USub: np.negative, ast.UAdd: np.positive}
+
+def indexNumber(node):
+    '''
+    Returns the value of a number in a parsed index expression, or None if node is not a number. Numbers are
+    ast.Num nodes before Python 3.8 and ast.Constant nodes since.
+    '''
+    if isinstance(node, ast.Constant):
+        value = node.value
+    elif type(node).__name__ == 'Num':
+        value = node.n
+    else:
+        return None
+    
+    return value if isinstance(value, (int, float)) else None
+
+def parseIndex(expression, bandNames):
+    '''
+    Parses an index expression (e.g. '(NIR - RED) / (NIR + RED)') and checks that it only contains numbers,
+    the band names, the operators + - * / ** and parentheses. Returns the parsed expression.
+    '''
+    tree = ast.parse(expression, mode = 'eval')
+    
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Load)) or type(node) in indexOperators:
+            continue
+        if indexNumber(node) is not None:
+            continue
+        if isinstance(node, ast.Name) and node.id in bandNames:
+            continue
+        raise ValueError('Not allowed in the index expression {}: {}'.format(expression, ast.dump(node)))
+    
+    return tree.body
+
+def evalIndex(node, bands):
+    '''
+    Evaluates a parsed index expression for the bands {band name: float32 array}. Division by zero gives
+    np.nan (or inf) instead of an error.
+    '''
+    number = indexNumber(node)
+    if number is not None:
+        return np.float32(number)
+    if isinstance(node, ast.Name):
+        return bands[node.id]
+    if isinstance(node, ast.UnaryOp):
+        return indexOperators[type(node.op)](evalIndex(node.operand, bands))
+    
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return indexOperators[type(node.op)](evalIndex(node.left, bands), evalIndex(node.right, bands))
+
+################################################################################################################
+# Cloud Optimized GeoTIFF
+################################################################################################################
+
+def tempGeoTIFF(outPath, refDataset, nbrBands, dataType):
+    '''
+    Creates a temporary tiled GeoTIFF (outPath + '.tmp.tif') with the size and the georeferencing (geotransform
+    and projection) of the GDAL dataset refDataset. Write the data to it, close it and convert it to the Cloud
+    Optimized GeoTIFF outPath with writeCOG.
+    '''
+    from osgeo import gdal
+    
+    dataset = gdal.GetDriverByName('GTiff').Create(outPath + '.tmp.tif', refDataset.RasterXSize, refDataset.RasterYSize,
+                                                   nbrBands, dataType, ['TILED=YES', 'BLOCKXSIZE={}'.format(cogBlockSize), 
+                                                   'BLOCKYSIZE={}'.format(cogBlockSize), 'BIGTIFF=IF_SAFER'])
+    dataset.SetGeoTransform(refDataset.GetGeoTransform())
+    dataset.SetProjection(refDataset.GetProjection())
+    
+    return dataset
+
+def writeCOG(outPath, resampling = 'AVERAGE', threads = 'ALL_CPUS'):
+    '''
+    Converts the temporary GeoTIFF of outPath (see tempGeoTIFF) to a compressed Cloud Optimized GeoTIFF with
+    overviews (computed with the resampling method) and removes the temporary file. The tiles are compressed in
+    threads parallel threads (e.g. fewer when several files are written in parallel processes).
+    '''
+    from osgeo import gdal
+    
+    options = ['COMPRESS={}'.format(cogCompress), 'PREDICTOR=YES', 'NUM_THREADS={}'.format(threads), 'BIGTIFF=IF_SAFER',
+               'BLOCKSIZE={}'.format(cogBlockSize), 'OVERVIEWS=AUTO', 'RESAMPLING={}'.format(resampling)]
+    
+    gdal.Translate(outPath, outPath + '.tmp.tif', format = 'COG', creationOptions = options)
+    gdal.GetDriverByName('GTiff').Delete(outPath + '.tmp.tif')
+
+################################################################################################################
+################################################################################################################